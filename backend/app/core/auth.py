@@ -1,59 +1,220 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Optional
+
+import jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from app.core.database import get_supabase
-from supabase import Client
+from starlette.concurrency import run_in_threadpool
+from app.core.database import get_supabase, get_user_client, SUPABASE_URL
+from postgrest import AsyncPostgrestClient
+from supabase import AsyncClient
 
 security = HTTPBearer()
+# For routes where a bearer token is only needed for some requests
+optional_security = HTTPBearer(auto_error=False)
+
+# JWT verification configuration
+# Projects using the legacy shared secret sign tokens with HS256; projects using
+# asymmetric signing keys publish them at the JWKS endpoint below.
+SUPABASE_JWT_SECRET = os.environ.get("SUPABASE_JWT_SECRET")
+JWT_AUDIENCE = "authenticated"
+JWKS_URL = f"{SUPABASE_URL}/auth/v1/.well-known/jwks.json" if SUPABASE_URL else None
+JWKS_CACHE_SECONDS = int(os.environ.get("JWKS_CACHE_SECONDS", "600"))
+# Accepted algorithms, fixed here rather than taken from the token header:
+# HS256 for the shared secret, and per JWKS key type for signing keys
+SECRET_ALGORITHMS = ["HS256"]
+JWKS_ALGORITHMS = {"RSA": ["RS256"], "EC": ["ES256"]}
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", "2048"))
+
+
+class AuthConfigError(Exception):
+    """Raised when token verification is needed but not configured."""
+
+
+class TokenCache:
+    """Bounded LRU cache of verified token claims, keyed on the token hash."""
+
+    def __init__(self, max_size: int = TOKEN_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, tuple[float, dict]]" = OrderedDict()
+        self._lock = Lock()
+
+    @staticmethod
+    def _key(token: str) -> str:
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def get(self, token: str) -> Optional[dict]:
+        """Return cached user data for the token, or None if missing or expired."""
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, user = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return user
+
+    def set(self, token: str, user: dict, expires_at: float) -> None:
+        """Store user data until the token's own expiry."""
+        if expires_at <= time.time():
+            return
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (expires_at, user)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache()
+
+# PyJWKClient caches the key set and refetches it when a token carries an
+# unknown `kid`, which is how signing key rotation shows up.
+_jwks_client: Optional[jwt.PyJWKClient] = None
+
+
+def _get_jwks_client() -> jwt.PyJWKClient:
+    global _jwks_client
+    if _jwks_client is None:
+        if not JWKS_URL:
+            raise AuthConfigError("SUPABASE_URL must be set to verify tokens")
+        _jwks_client = jwt.PyJWKClient(JWKS_URL, cache_jwk_set=True, lifespan=JWKS_CACHE_SECONDS)
+    return _jwks_client
+
+
+def _user_from_claims(claims: dict) -> dict:
+    """Build the current user dict from verified JWT claims."""
+    return {
+        "id": str(claims["sub"]),
+        "email": claims.get("email"),
+        "aud": claims.get("aud"),
+        "role": claims.get("role"),
+        "created_at": None,
+    }
+
+
+def verify_token_locally(token: str) -> Optional[dict]:
+    """
+    Verify a Supabase JWT signature and expiry without calling the Auth API.
+
+    Args:
+        token: Raw bearer token
+
+    Returns:
+        dict: Verified claims, or None if the token can't be verified locally
+        (HS256 token but no SUPABASE_JWT_SECRET configured)
+
+    Raises:
+        jwt.InvalidTokenError: If the token is malformed, expired or forged
+        AuthConfigError: If the token needs the JWKS but SUPABASE_URL is unset
+    """
+    # The header only picks which key to try; the algorithms accepted are
+    # fixed by that key, so a token can't choose a weaker one
+    header = jwt.get_unverified_header(token)
+
+    if header.get("alg") in SECRET_ALGORITHMS:
+        if not SUPABASE_JWT_SECRET:
+            return None
+        key = SUPABASE_JWT_SECRET
+        algorithms = SECRET_ALGORITHMS
+    else:
+        signing_key = _get_jwks_client().get_signing_key_from_jwt(token)
+        algorithms = JWKS_ALGORITHMS.get(signing_key.key_type)
+        if not algorithms:
+            raise jwt.InvalidAlgorithmError(f"Unsupported signing key type: {signing_key.key_type}")
+        key = signing_key.key
+
+    return jwt.decode(
+        token,
+        key,
+        algorithms=algorithms,
+        audience=JWT_AUDIENCE,
+        options={"require": ["exp", "sub"]},
+    )
+
+
+async def _verify_token_remotely(token: str) -> Optional[dict]:
+    """Fallback: ask Supabase Auth about the token (one HTTP round trip)."""
+    supabase: AsyncClient = get_supabase()
+    user_response = await supabase.auth.get_user(token)
+
+    if not user_response or not user_response.user:
+        return None
+
+    user = user_response.user
+    return {
+        "id": str(user.id),
+        "email": user.email,
+        "aud": user.aud if hasattr(user, 'aud') else None,
+        "role": user.role if hasattr(user, 'role') else None,
+        "created_at": str(user.created_at) if hasattr(user, 'created_at') else None,
+    }
+
 
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security)
 ) -> dict:
     """
     Verify JWT token and return current user.
-    Uses Supabase to verify JWT tokens and extract user information.
-    
+    Tokens are verified locally (HS256 secret or cached JWKS) and the result is
+    cached until the token expires, so most requests never leave the process.
+    Falls back to the Supabase Auth API only for HS256 tokens when no
+    SUPABASE_JWT_SECRET is configured.
+
     Returns:
         dict: User information including id, email, and other auth metadata
-        
+
     Raises:
         HTTPException: 401 if token is invalid, expired, or malformed
     """
     token = credentials.credentials
-    
+
+    cached_user = token_cache.get(token)
+    if cached_user is not None:
+        return cached_user
+
     try:
-        # Create Supabase client and verify token
-        supabase: Client = get_supabase()
-        
-        # Verify token and get user info
-        # This validates the JWT signature, expiry, and returns user data
-        user_response = supabase.auth.get_user(token)
-        
-        if not user_response or not user_response.user:
+        # Local signature/expiry check; only touches the network when the
+        # JWKS cache is cold or a rotated key is seen, so run it off the loop.
+        claims = await run_in_threadpool(verify_token_locally, token)
+
+        if claims is not None:
+            user_dict = _user_from_claims(claims)
+            token_cache.set(token, user_dict, float(claims["exp"]))
+            return user_dict
+
+        user_dict = await _verify_token_remotely(token)
+
+        if not user_dict:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid or expired token",
                 headers={"WWW-Authenticate": "Bearer"},
             )
-        
-        # Extract user data
-        user = user_response.user
-        
-        # Return user data as dict
-        user_dict = {
-            "id": str(user.id),
-            "email": user.email,
-            "aud": user.aud if hasattr(user, 'aud') else None,
-            "role": user.role if hasattr(user, 'role') else None,
-            "created_at": str(user.created_at) if hasattr(user, 'created_at') else None,
-        }
-        
+
+        # The Auth API already checked expiry; cache until the token's exp
+        exp = jwt.decode(token, options={"verify_signature": False}).get("exp")
+        if exp:
+            token_cache.set(token, user_dict, float(exp))
+
         return user_dict
-        
+
     except HTTPException:
         # Re-raise HTTP exceptions as-is
         raise
-    except AttributeError as e:
-        # Handle missing Supabase client or auth attribute
+    except (AttributeError, AuthConfigError) as e:
+        # Handle missing Supabase client, auth attribute or JWKS URL
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Authentication service not configured",
@@ -69,12 +230,11 @@ async def get_current_user(
 
 async def get_authenticated_client(
     credentials: HTTPAuthorizationCredentials = Depends(security)
-) -> Client:
+) -> AsyncPostgrestClient:
     """
-    Get a Supabase client authenticated as the current user.
+    Get a database client authenticated as the current user.
     This ensures RLS policies are applied correctly.
+    The client is a per-request view over the shared connection pool.
     """
     token = credentials.credentials
-    client = get_supabase()
-    client.postgrest.auth(token)
-    return client
+    return get_user_client(token)
@@ -1,6 +1,10 @@
 from dotenv import load_dotenv
 import os
-from supabase import create_client, Client
+from typing import Optional
+
+import httpx
+from postgrest import AsyncPostgrestClient
+from supabase import AsyncClient, AsyncClientOptions
 
 # Load environment variables
 load_dotenv()
@@ -10,16 +14,95 @@ SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_KEY = os.environ.get("SUPABASE_ANON_KEY")
 SUPABASE_SERVICE_KEY = os.environ.get("SUPABASE_SERVICE_KEY")  # For admin operations
 
+# Connection pool configuration (per process)
+SUPABASE_POOL_SIZE = int(os.environ.get("SUPABASE_POOL_SIZE", "100"))
+SUPABASE_KEEPALIVE_SECONDS = float(os.environ.get("SUPABASE_KEEPALIVE_SECONDS", "60"))
+SUPABASE_TIMEOUT_SECONDS = float(os.environ.get("SUPABASE_TIMEOUT_SECONDS", "30"))
+
+# Process-wide clients, created lazily and closed by the app lifespan.
+# All of these are only touched from the event loop, so no locking is needed.
+_http_client: Optional[httpx.AsyncClient] = None
+_supabase: Optional[AsyncClient] = None
+_supabase_admin: Optional[AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Get the shared keep-alive HTTP pool used for all Supabase traffic."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            http2=True,
+            follow_redirects=True,
+            timeout=SUPABASE_TIMEOUT_SECONDS,
+            limits=httpx.Limits(
+                max_connections=SUPABASE_POOL_SIZE,
+                max_keepalive_connections=SUPABASE_POOL_SIZE,
+                keepalive_expiry=SUPABASE_KEEPALIVE_SECONDS,
+            ),
+        )
+    return _http_client
+
+
 # Supabase client
-def get_supabase() -> Client:
+def get_supabase() -> AsyncClient:
     """Get Supabase client for regular operations."""
+    global _supabase
     if not SUPABASE_URL or not SUPABASE_KEY:
         raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set")
-    return create_client(SUPABASE_URL, SUPABASE_KEY)
+    if _supabase is None:
+        _supabase = AsyncClient(
+            SUPABASE_URL,
+            SUPABASE_KEY,
+            options=AsyncClientOptions(httpx_client=get_http_client()),
+        )
+    return _supabase
 
 # Supabase admin client (for server-side operations)
-def get_supabase_admin() -> Client:
+def get_supabase_admin() -> AsyncClient:
     """Get Supabase admin client for server-side operations."""
+    global _supabase_admin
     if not SUPABASE_URL or not SUPABASE_SERVICE_KEY:
         raise ValueError("SUPABASE_URL and SUPABASE_SERVICE_KEY must be set")
-    return create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
\ No newline at end of file
+    if _supabase_admin is None:
+        _supabase_admin = AsyncClient(
+            SUPABASE_URL,
+            SUPABASE_SERVICE_KEY,
+            options=AsyncClientOptions(httpx_client=get_http_client()),
+        )
+    return _supabase_admin
+
+
+def get_user_client(token: str) -> AsyncPostgrestClient:
+    """
+    Get a PostgREST client scoped to a user's JWT so RLS policies apply.
+
+    This is a lightweight view over the shared HTTP pool: it only carries the
+    per-request headers, so building one per request costs no connection setup
+    and never mutates the shared clients.
+
+    Args:
+        token: The user's access token
+
+    Returns:
+        AsyncPostgrestClient: Client exposing .table() and .rpc()
+    """
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set")
+    return AsyncPostgrestClient(
+        f"{SUPABASE_URL}/rest/v1",
+        headers={
+            "apikey": SUPABASE_KEY,
+            "Authorization": f"Bearer {token}",
+        },
+        http_client=get_http_client(),
+    )
+
+
+async def close_clients() -> None:
+    """Close the shared HTTP pool. Called on application shutdown."""
+    global _http_client, _supabase, _supabase_admin
+    if _http_client is not None:
+        await _http_client.aclose()
+    _http_client = None
+    _supabase = None
+    _supabase_admin = None
@@ -5,9 +5,17 @@ Handles chunking for large documents to preserve semantic meaning.
 """
 
 from dotenv import load_dotenv
+import asyncio
+import hashlib
 import os
-from typing import List
-from openai import OpenAI
+import random
+import re
+import unicodedata
+from typing import Dict, List, Optional
+import httpx
+import openai
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from app.core.cache import TTLCache
 from app.core.chunking import prepare_chunks_for_embedding
 
 load_dotenv()
@@ -16,11 +24,320 @@ OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 EMBEDDING_MODEL = "text-embedding-3-small"  # Using 1536-dimensional embeddings
 EMBEDDING_DIMENSION = 1536
 
-# Initialize OpenAI client
-client = OpenAI(api_key=OPENAI_API_KEY)
+# Maximum number of embedding requests in flight to OpenAI per process
+EMBEDDING_CONCURRENCY = int(os.environ.get("EMBEDDING_CONCURRENCY", "8"))
 
+# Provider limits for a single embeddings request
+EMBEDDING_BATCH_MAX_INPUTS = 2048
+EMBEDDING_BATCH_MAX_TOKENS = 300000
+EMBEDDING_MAX_INPUT_TOKENS = 8192
+# Conservative characters-per-token ratio used to estimate request size
+CHARS_PER_TOKEN = 3
 
-def create_embedding(text: str) -> List[float]:
+# Retry policy for rate limits, timeouts and 5xx responses
+EMBEDDING_MAX_RETRIES = int(os.environ.get("EMBEDDING_MAX_RETRIES", "5"))
+EMBEDDING_BACKOFF_BASE_SECONDS = 0.5
+EMBEDDING_BACKOFF_MAX_SECONDS = 30.0
+
+# Cache of search-query embeddings
+QUERY_CACHE_SIZE = int(os.environ.get("QUERY_CACHE_SIZE", "2048"))
+QUERY_CACHE_TTL_SECONDS = float(os.environ.get("QUERY_CACHE_TTL_SECONDS", "3600"))
+
+
+class EmbeddingBatchError(Exception):
+    """
+    Raised when some inputs of a batch could not be embedded.
+    Carries the vectors that did succeed so callers can keep them.
+    """
+
+    def __init__(self, failures: Dict[int, str], embeddings: List[Optional[List[float]]]):
+        """
+        Args:
+            failures: Input index -> reason it failed
+            embeddings: Vectors aligned with the input, None where it failed
+        """
+        self.failures = failures
+        self.embeddings = embeddings
+        details = "; ".join(f"input {idx}: {reason}" for idx, reason in sorted(failures.items())[:5])
+        super().__init__(f"Failed to embed {len(failures)} of {len(embeddings)} inputs ({details})")
+
+
+query_embedding_cache = TTLCache(max_size=QUERY_CACHE_SIZE, ttl_seconds=QUERY_CACHE_TTL_SECONDS)
+# Identical queries already waiting on the provider, so they share one call
+_inflight_queries: Dict[tuple, asyncio.Task] = {}
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the token count of a text without a tokenizer (errs high)."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def pack_batches(
+    texts: List[str],
+    max_inputs: int = EMBEDDING_BATCH_MAX_INPUTS,
+    max_tokens: int = EMBEDDING_BATCH_MAX_TOKENS
+) -> List[List[int]]:
+    """
+    Pack texts into as few provider-compliant batches as possible.
+    
+    Args:
+        texts: Texts to embed
+        max_inputs: Maximum number of inputs per request
+        max_tokens: Maximum estimated tokens per request
+        
+    Returns:
+        List[List[int]]: Batches of indices into texts, in input order
+    """
+    batches = []
+    current = []
+    current_tokens = 0
+    
+    for idx, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        if current and (len(current) >= max_inputs or current_tokens + tokens > max_tokens):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(idx)
+        current_tokens += tokens
+    
+    if current:
+        batches.append(current)
+    
+    return batches
+
+
+def _is_retryable(error: Exception) -> bool:
+    """Rate limits, timeouts, connection errors and 5xx are worth retrying."""
+    if isinstance(error, (openai.APIConnectionError, openai.RateLimitError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in (408, 409) or error.status_code >= 500
+    return False
+
+
+def _parse_duration(value: str) -> Optional[float]:
+    """Parse OpenAI reset durations like '250ms', '6s' or '1m30s' into seconds."""
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|s|m|h)", value)
+    if not parts:
+        return None
+    scale = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(amount) * scale[unit] for amount, unit in parts)
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """Delay the provider asked for in its rate-limit headers, if any."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    if headers.get("retry-after"):
+        try:
+            return float(headers["retry-after"])
+        except ValueError:
+            pass
+    
+    resets = [
+        _parse_duration(headers[name])
+        for name in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens")
+        if headers.get(name)
+    ]
+    resets = [reset for reset in resets if reset is not None]
+    return max(resets) if resets else None
+
+
+def _backoff_delay(error: Exception, attempt: int) -> float:
+    """Jittered exponential backoff, never shorter than what the provider asked for."""
+    backoff = min(EMBEDDING_BACKOFF_MAX_SECONDS, EMBEDDING_BACKOFF_BASE_SECONDS * (2 ** attempt))
+    delay = random.uniform(backoff / 2, backoff)
+    requested = _retry_after(error)
+    if requested is not None:
+        delay = max(delay, min(requested, EMBEDDING_BACKOFF_MAX_SECONDS))
+    return delay
+
+
+class EmbeddingEngine:
+    """
+    Async embedding client shared by the whole process.
+    Wraps AsyncOpenAI on a keep-alive HTTP pool, limits the number of
+    in-flight provider calls with a semaphore, and retries transient
+    failures with jittered exponential backoff.
+
+    embed_one embeds a single text (e.g. a search query); embed_batch is the
+    API for several, and reports every input it could not embed.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        model: str = EMBEDDING_MODEL,
+        max_concurrency: int = EMBEDDING_CONCURRENCY,
+        max_retries: int = EMBEDDING_MAX_RETRIES
+    ):
+        """
+        Initialize the embedding engine.
+
+        Args:
+            api_key: OpenAI API key
+            model: Embedding model name
+            max_concurrency: Maximum concurrent requests to the provider
+            max_retries: Retries per request for transient failures
+        """
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self._client = AsyncOpenAI(
+            api_key=api_key,
+            # Retries are handled here so the semaphore slot is freed while waiting
+            max_retries=0,
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=max_concurrency,
+                    max_keepalive_connections=max_concurrency,
+                )
+            ),
+        )
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _request(self, inputs):
+        """Call the embeddings endpoint, retrying transient failures."""
+        attempt = 0
+        while True:
+            try:
+                async with self._semaphore:
+                    return await self._client.embeddings.create(
+                        input=inputs,
+                        model=self.model
+                    )
+            except Exception as e:
+                if not _is_retryable(e) or attempt >= self.max_retries:
+                    raise
+                delay = _backoff_delay(e, attempt)
+                attempt += 1
+                print(f"[Embeddings] {type(e).__name__}, retry {attempt}/{self.max_retries} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+    async def embed_one(self, text: str) -> List[float]:
+        """
+        Create a vector embedding for a single text.
+
+        Args:
+            text: The text to embed
+
+        Returns:
+            List[float]: A vector of 1536 dimensions representing the text
+
+        Raises:
+            ValueError: If the text is empty
+        """
+        if not text or len(text.strip()) == 0:
+            raise ValueError("Text cannot be empty")
+
+        response = await self._request(text.strip())
+        return response.data[0].embedding
+
+    async def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed any number of texts, split into provider-compliant sub-batches
+        that are sent concurrently.
+
+        Args:
+            texts: Texts to embed
+
+        Returns:
+            List[List[float]]: One vector per input, in input order
+
+        Raises:
+            EmbeddingBatchError: If any input failed; carries the partial results
+        """
+        embeddings: List[Optional[List[float]]] = [None] * len(texts)
+        failures: Dict[int, str] = {}
+        valid = []
+
+        for idx, text in enumerate(texts):
+            if not text or not text.strip():
+                failures[idx] = "Text cannot be empty"
+            elif estimate_tokens(text.strip()) > EMBEDDING_MAX_INPUT_TOKENS:
+                failures[idx] = "Text exceeds the model's input token limit"
+            else:
+                valid.append(idx)
+
+        batches = pack_batches([texts[idx].strip() for idx in valid])
+        await asyncio.gather(*(
+            self._embed_sub_batch([valid[i] for i in batch], texts, embeddings, failures)
+            for batch in batches
+        ))
+
+        if failures:
+            raise EmbeddingBatchError(failures, embeddings)
+        return embeddings
+
+    async def _embed_sub_batch(
+        self,
+        indices: List[int],
+        texts: List[str],
+        embeddings: List[Optional[List[float]]],
+        failures: Dict[int, str]
+    ) -> None:
+        try:
+            response = await self._request([texts[idx].strip() for idx in indices])
+        except openai.BadRequestError as e:
+            # Usually a token cap our estimate missed: halve until the bad input is isolated
+            if len(indices) > 1:
+                middle = len(indices) // 2
+                await asyncio.gather(
+                    self._embed_sub_batch(indices[:middle], texts, embeddings, failures),
+                    self._embed_sub_batch(indices[middle:], texts, embeddings, failures)
+                )
+            else:
+                failures[indices[0]] = str(e)
+            return
+        except Exception as e:
+            for idx in indices:
+                failures[idx] = str(e)
+            return
+
+        for item in response.data:
+            embeddings[indices[item.index]] = item.embedding
+
+    async def aclose(self) -> None:
+        """Close the underlying HTTP pool."""
+        await self._client.close()
+
+
+_engine: Optional[EmbeddingEngine] = None
+
+
+def get_embedding_engine() -> EmbeddingEngine:
+    """
+    Get the process-wide embedding engine, creating it on first use.
+
+    Raises:
+        ValueError: If OPENAI_API_KEY is not set
+    """
+    global _engine
+    if not OPENAI_API_KEY:
+        raise ValueError("OPENAI_API_KEY must be set in environment variables")
+    if _engine is None:
+        _engine = EmbeddingEngine(api_key=OPENAI_API_KEY)
+    return _engine
+
+
+async def close_embedding_engine() -> None:
+    """Close the embedding engine. Called on application shutdown."""
+    global _engine
+    if _engine is not None:
+        await _engine.aclose()
+    _engine = None
+
+
+async def create_embedding(text: str) -> List[float]:
     """
     Create a vector embedding for the given text using OpenAI's API.
     
@@ -42,32 +359,28 @@ def create_embedding(text: str) -> List[float]:
         raise ValueError("Text cannot be empty")
     
     try:
-        response = client.embeddings.create(
-            input=text.strip(),
-            model=EMBEDDING_MODEL
-        )
-        
-        embedding = response.data[0].embedding
-        return embedding
+        return await get_embedding_engine().embed_one(text)
     
     except Exception as e:
         print(f"Error creating embedding: {e}")
         raise Exception(f"Failed to create embedding: {str(e)}")
 
 
-def create_embeddings_batch(texts: List[str]) -> List[List[float]]:
+async def create_embeddings_batch(texts: List[str]) -> List[List[float]]:
     """
-    Create embeddings for multiple texts in a single API call.
-    More efficient than creating embeddings one by one.
+    Create embeddings for multiple texts.
+    Large lists are split into sub-batches within the provider's input and
+    token caps, and transient failures are retried with backoff.
     
     Args:
         texts: List of texts to embed
         
     Returns:
-        List[List[float]]: List of embedding vectors
+        List[List[float]]: One embedding vector per text, in input order
         
     Raises:
         ValueError: If OPENAI_API_KEY is not set
+        EmbeddingBatchError: If some inputs failed (with the partial results)
         Exception: If the API call fails
     """
     if not OPENAI_API_KEY:
@@ -76,26 +389,70 @@ def create_embeddings_batch(texts: List[str]) -> List[List[float]]:
     if not texts:
         return []
     
-    # Filter out empty texts
-    valid_texts = [t.strip() for t in texts if t and t.strip()]
-    
-    if not valid_texts:
-        return []
-    
     try:
-        response = client.embeddings.create(
-            input=valid_texts,
-            model=EMBEDDING_MODEL
-        )
-        
-        # Sort by index to maintain order
-        embeddings = sorted(response.data, key=lambda x: x.index)
-        return [item.embedding for item in embeddings]
+        return await get_embedding_engine().embed_batch(texts)
     
+    except EmbeddingBatchError:
+        raise
     except Exception as e:
         raise Exception(f"Failed to create embeddings batch: {str(e)}")
 
 
+def normalize_query(query: str) -> str:
+    """Normalize a search query so trivially different spellings share a cache entry."""
+    return " ".join(unicodedata.normalize("NFKC", query).casefold().split())
+
+
+async def embed_query(query: str) -> List[float]:
+    """
+    Embed a search query, reusing the vector when the same query (after
+    normalization, for the same model) was embedded recently.
+    
+    Args:
+        query: Raw search query
+        
+    Returns:
+        List[float]: Query embedding
+        
+    Raises:
+        ValueError: If the query is empty
+    """
+    normalized = normalize_query(query)
+    if not normalized:
+        raise ValueError("Text cannot be empty")
+    
+    key = (EMBEDDING_MODEL, normalized)
+    cached = query_embedding_cache.get(key)
+    if cached is not None:
+        return cached
+    
+    task = _inflight_queries.get(key)
+    if task is None:
+        task = asyncio.ensure_future(create_embedding(normalized))
+        _inflight_queries[key] = task
+        task.add_done_callback(lambda _: _inflight_queries.pop(key, None))
+    
+    # Shielded so one caller disconnecting doesn't cancel the shared call
+    embedding = await asyncio.shield(task)
+    query_embedding_cache.set(key, embedding)
+    return embedding
+
+
+def chunk_content_hash(content: str, model: str = EMBEDDING_MODEL) -> str:
+    """
+    Hash a chunk's text together with the embedding model.
+    Two chunks with the same hash can share an embedding vector.
+    
+    Args:
+        content: Chunk text
+        model: Embedding model the vector was produced with
+        
+    Returns:
+        str: Hex-encoded SHA-256 digest
+    """
+    return hashlib.sha256(f"{model}\n{content.strip()}".encode("utf-8")).hexdigest()
+
+
 def prepare_note_for_embedding(title: str, content: str, chunk_size: int = 1000) -> List[dict]:
     """
     Prepare a note for embedding by chunking it into semantic pieces.
@@ -120,7 +477,7 @@ def prepare_note_for_embedding(title: str, content: str, chunk_size: int = 1000)
     return chunks
 
 
-def embed_chunks(chunks: List[dict]) -> List[dict]:
+async def embed_chunks(chunks: List[dict]) -> List[dict]:
     """
     Embed multiple chunks and return them with embeddings.
     
@@ -137,7 +494,7 @@ def embed_chunks(chunks: List[dict]) -> List[dict]:
     contents = [chunk["content"] for chunk in chunks]
     
     # Get embeddings
-    embeddings = create_embeddings_batch(contents)
+    embeddings = await create_embeddings_batch(contents)
     
     # Combine chunks with embeddings
     for chunk, embedding in zip(chunks, embeddings):
@@ -0,0 +1,41 @@
+"""
+Weak ETags and If-None-Match handling for conditional GETs.
+
+ETags are per user and per negotiated media type (JSON or msgpack), so the
+user id and media type go into the tag, and responses carrying one vary on
+Authorization and Accept.
+"""
+
+import hashlib
+from typing import Optional
+
+from fastapi import Response, status
+
+# Responses are per user and must be revalidated before reuse
+CACHE_CONTROL = "private, no-cache"
+# Request headers an ETagged response depends on
+VARY = "Accept, Authorization"
+
+
+def weak_etag(*parts) -> str:
+    """Build a weak ETag from the values that determine a response body."""
+    digest = hashlib.sha256("|".join(str(part) for part in parts).encode()).hexdigest()
+    return f'W/"{digest[:24]}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against an ETag."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == opaque for candidate in if_none_match.split(","))
+
+
+def not_modified(etag: str) -> Response:
+    """An empty 304 response carrying the current ETag."""
+    return Response(
+        status_code=status.HTTP_304_NOT_MODIFIED,
+        headers={"ETag": etag, "Cache-Control": CACHE_CONTROL, "Vary": VARY}
+    )
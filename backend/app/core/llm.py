@@ -0,0 +1,269 @@
+"""
+Shared Gemini client and the bulkhead that bounds concurrent LLM calls.
+
+Generations take seconds, so they run on Gemini's async client and through
+their own bulkhead: when the model is saturated, AI requests queue briefly
+and are then shed with 503, while everything else on the instance (notes,
+search, health checks) keeps its full capacity.
+"""
+
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+import google.generativeai as genai
+from google.generativeai import caching
+from google.generativeai import client as genai_client
+
+from app.core.cache import TTLCache
+
+GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
+GEMINI_MODEL = "gemini-2.5-flash"
+
+# Concurrent generations per process, how many more may wait for a slot,
+# and how long they wait before being shed
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "8"))
+LLM_MAX_QUEUE = int(os.environ.get("LLM_MAX_QUEUE", "32"))
+LLM_QUEUE_TIMEOUT_SECONDS = float(os.environ.get("LLM_QUEUE_TIMEOUT_SECONDS", "10"))
+# Upper bound on a single generation
+LLM_TIMEOUT_SECONDS = float(os.environ.get("LLM_TIMEOUT_SECONDS", "120"))
+# Suggested client back-off when shed
+LLM_RETRY_AFTER_SECONDS = 5
+# Gemini refuses to cache less than this much context
+GEMINI_CACHE_MIN_TOKENS = int(os.environ.get("GEMINI_CACHE_MIN_TOKENS", "1024"))
+# Models bound to a context cache kept per process, each until its cache expires
+GEMINI_CACHED_MODELS_MAX = 256
+
+if GEMINI_API_KEY:
+    genai.configure(api_key=GEMINI_API_KEY)
+
+
+class BulkheadFullError(Exception):
+    """Raised when a call is shed because the bulkhead and its queue are full."""
+
+
+class Bulkhead:
+    """
+    Concurrency limit with a bounded wait queue.
+
+    Up to max_concurrency calls run at once and up to max_queue more wait,
+    each for at most queue_timeout seconds. Anything beyond that is rejected
+    straight away instead of piling up behind slow calls.
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int, queue_timeout: float):
+        """
+        Args:
+            max_concurrency: Calls allowed to run at once
+            max_queue: Calls allowed to wait for a slot
+            queue_timeout: Longest a call waits for a slot, in seconds
+        """
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiting = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    def is_full(self) -> bool:
+        """True if a new call would be rejected right now."""
+        return self._semaphore.locked() and self.waiting >= self.max_queue
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        Hold one slot for the duration of the block.
+
+        Raises:
+            BulkheadFullError: If the queue is full or the wait times out
+        """
+        if self.is_full():
+            self.rejected += 1
+            raise BulkheadFullError("Too many requests waiting")
+
+        if not self._semaphore.locked():
+            # A slot is free: acquire() returns without suspending
+            await self._semaphore.acquire()
+        else:
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.timed_out += 1
+                raise BulkheadFullError(f"No slot free within {self.queue_timeout:g}s")
+            finally:
+                self.waiting -= 1
+
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self.completed += 1
+            self._semaphore.release()
+
+    def stats(self) -> Dict[str, Any]:
+        """Occupancy, queue depth and shed counters."""
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+        }
+
+
+llm_bulkhead = Bulkhead(LLM_MAX_CONCURRENCY, LLM_MAX_QUEUE, LLM_QUEUE_TIMEOUT_SECONDS)
+
+_model: Optional[genai.GenerativeModel] = None
+
+
+def get_gemini_model() -> genai.GenerativeModel:
+    """
+    Get the process-wide Gemini model. Its async client (a gRPC channel) is
+    opened on first use and reused by every request after that.
+
+    Raises:
+        ValueError: If GEMINI_API_KEY is not set
+    """
+    global _model
+    if not GEMINI_API_KEY:
+        raise ValueError("GEMINI_API_KEY must be set in environment variables")
+    if _model is None:
+        _model = genai.GenerativeModel(GEMINI_MODEL)
+    return _model
+
+
+async def close_gemini_client() -> None:
+    """
+    Close the async client the shared model opened, if it opened one.
+    Called on application shutdown. Models bound to context caches use the
+    same client, so this closes theirs too.
+    """
+    global _model
+    client = getattr(_model, "_async_client", None)
+    transport = getattr(client, "transport", None)
+    if transport is not None:
+        await transport.close()
+    _model = None
+    _cached_models.clear()
+
+
+async def create_context_cache(
+    system_instruction: str,
+    text: str,
+    ttl_seconds: float,
+    display_name: Optional[str] = None
+) -> Tuple[str, str]:
+    """
+    Store a system instruction and a long text on Gemini's side, so later
+    calls reference it by name instead of sending it again. Cached tokens
+    are billed at a reduced rate and skip re-processing.
+
+    The SDK call is blocking, so it runs in a worker thread.
+
+    Returns:
+        Tuple of (cache name, expiry as an ISO timestamp)
+    """
+    cached = await asyncio.to_thread(
+        caching.CachedContent.create,
+        model=GEMINI_MODEL,
+        display_name=display_name,
+        system_instruction=system_instruction,
+        contents=[text],
+        ttl=timedelta(seconds=ttl_seconds),
+    )
+    _remember_cached_model(cached)
+    return cached.name, cached.expire_time.isoformat()
+
+
+async def delete_context_cache(name: str) -> None:
+    """Delete a context cache early; errors are logged, it expires anyway."""
+    def delete():
+        genai_client.get_default_cache_client().delete_cached_content(name=name)
+
+    _cached_models.delete(name)
+    try:
+        await asyncio.to_thread(delete)
+    except Exception as e:
+        print(f"[LLM] Failed to delete context cache {name}: {e}")
+
+
+def _chunk_text(chunk) -> str:
+    """Text of a streamed chunk; chunks without text parts (e.g. a final safety
+    or finish-reason chunk) raise on .text, so treat them as empty."""
+    try:
+        return chunk.text
+    except ValueError:
+        return ""
+
+
+async def stream_text(stream) -> AsyncIterator[str]:
+    """
+    Relay the text of a streamed Gemini response.
+
+    The response is read by a separate task. Closing or cancelling this
+    generator cancels that task while it waits on the gRPC read, and gRPC
+    then cancels the call, so Gemini stops generating. Use it under
+    contextlib.aclosing so that happens as soon as the consumer stops.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def pump():
+        try:
+            async for chunk in stream:
+                queue.put_nowait(("chunk", chunk))
+        except Exception as e:
+            queue.put_nowait(("error", e))
+        else:
+            queue.put_nowait(("end", None))
+
+    reader = asyncio.create_task(pump())
+    try:
+        while True:
+            kind, value = await queue.get()
+            if kind == "end":
+                return
+            if kind == "error":
+                raise value
+            text = _chunk_text(value)
+            if text:
+                yield text
+    finally:
+        reader.cancel()
+
+
+# Every entry is stored with its own cache's remaining lifetime
+_cached_models = TTLCache(max_size=GEMINI_CACHED_MODELS_MAX, ttl_seconds=0)
+
+
+def _remember_cached_model(cached: caching.CachedContent) -> genai.GenerativeModel:
+    """Build the model for a context cache and keep it until the cache expires."""
+    model = genai.GenerativeModel.from_cached_content(cached)
+    ttl = (cached.expire_time - datetime.now(timezone.utc)).total_seconds()
+    _cached_models.set(cached.name, model, ttl_seconds=ttl)
+    return model
+
+
+async def get_cached_model(cache_name: str) -> genai.GenerativeModel:
+    """
+    Model bound to a context cache, built with the SDK's public
+    GenerativeModel.from_cached_content. Caches created by this process are
+    already known; others are looked up once, in a worker thread since the
+    lookup is blocking.
+
+    Raises:
+        google.api_core.exceptions.NotFound: If the cache expired or was deleted
+    """
+    model = _cached_models.get(cache_name)
+    if model is None:
+        cached = await asyncio.to_thread(caching.CachedContent.get, cache_name)
+        model = _remember_cached_model(cached)
+    return model
@@ -0,0 +1,40 @@
+"""
+Opaque cursors for keyset pagination.
+
+A cursor is the sort key of the last row a client has seen, encoded so
+clients treat it as a token rather than building their own.
+"""
+
+import base64
+import json
+from typing import Any, Dict
+
+
+def encode_cursor(position: Dict[str, Any]) -> str:
+    """Encode a sort key (e.g. {"updated_at": ..., "id": ...}) as a URL-safe token."""
+    raw = json.dumps(position, separators=(",", ":"), default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, *keys: str) -> Dict[str, Any]:
+    """
+    Decode a cursor produced by encode_cursor.
+
+    Args:
+        cursor: Token from a previous response
+        keys: Keys the cursor must contain
+
+    Returns:
+        Dict: The sort key
+
+    Raises:
+        ValueError: If the cursor is malformed or missing keys
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        position = json.loads(raw)
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(position, dict) or any(key not in position for key in keys):
+        raise ValueError("Invalid cursor")
+    return position
@@ -0,0 +1,67 @@
+"""
+Response encoding: orjson by default, MessagePack when the client asks for it.
+
+Routes that return rows straight from the database (already shaped like their
+response model) can hand them to negotiated_response, which skips FastAPI's
+response-model validation and serializes once in the negotiated format.
+"""
+
+from typing import Any, Dict, Optional
+
+from fastapi import Request, Response
+from fastapi.responses import ORJSONResponse
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - depends on the environment
+    msgpack = None
+
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+
+
+class MsgPackResponse(Response):
+    """MessagePack-encoded response."""
+
+    media_type = "application/msgpack"
+
+    def render(self, content: Any) -> bytes:
+        return msgpack.packb(content, use_bin_type=True)
+
+
+def wants_msgpack(request: Request) -> bool:
+    """True if msgpack is installed and the Accept header names it."""
+    if msgpack is None:
+        return False
+    accept = request.headers.get("accept", "")
+    return any(media_type in accept for media_type in MSGPACK_MEDIA_TYPES)
+
+
+def negotiated_media_type(request: Request) -> str:
+    """Media type negotiated_response will encode this request's body as."""
+    return MsgPackResponse.media_type if wants_msgpack(request) else ORJSONResponse.media_type
+
+
+def negotiated_response(
+    request: Request,
+    content: Any,
+    headers: Optional[Dict[str, str]] = None,
+    status_code: int = 200
+) -> Response:
+    """
+    Encode JSON-compatible content as msgpack or JSON per the Accept header.
+
+    Args:
+        request: The incoming request
+        content: Plain JSON types (dicts, lists, strings, numbers)
+        headers: Extra response headers (a Vary is merged with Accept)
+        status_code: HTTP status
+
+    Returns:
+        Response: MsgPackResponse or ORJSONResponse
+    """
+    headers = dict(headers or {})
+    # Keep any Vary the caller set, adding Accept
+    vary = [name.strip() for name in headers.get("Vary", "").split(",") if name.strip()]
+    headers["Vary"] = ", ".join(dict.fromkeys(["Accept", *vary]))
+    response_class = MsgPackResponse if wants_msgpack(request) else ORJSONResponse
+    return response_class(content=content, headers=headers, status_code=status_code)
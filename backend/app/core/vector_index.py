@@ -0,0 +1,364 @@
+"""
+In-process vector index used as a hot tier in front of the search RPC.
+
+Each active user gets an in-memory index of their note chunks, loaded lazily
+from note_chunks the first time they search. Small corpora are searched by
+exact cosine similarity over a NumPy matrix; large ones use an HNSW graph when
+hnswlib is installed. Indexes are kept fresh on writes, evicted least recently
+used under a memory cap, and optionally snapshotted to disk so a restarted
+instance can skip the reload.
+
+NumPy is required for the index; hnswlib is optional. Without NumPy, or when
+VECTOR_INDEX_ENABLED is off, every search goes to the database as before.
+"""
+
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from postgrest import AsyncPostgrestClient
+from starlette.concurrency import run_in_threadpool
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - depends on the environment
+    np = None
+
+try:
+    import hnswlib
+except ImportError:  # pragma: no cover - depends on the environment
+    hnswlib = None
+
+from app.core.embeddings import EMBEDDING_DIMENSION
+
+VECTOR_INDEX_ENABLED = os.environ.get("VECTOR_INDEX_ENABLED", "false").lower() in ("1", "true", "yes")
+# Total memory all resident indexes may use before LRU eviction
+VECTOR_INDEX_MAX_BYTES = int(os.environ.get("VECTOR_INDEX_MAX_MB", "256")) * 1024 * 1024
+# Corpora at least this large use HNSW (if available) instead of exact search
+VECTOR_INDEX_HNSW_THRESHOLD = int(os.environ.get("VECTOR_INDEX_HNSW_THRESHOLD", "20000"))
+# Resident indexes older than this are reloaded, to pick up writes made by other instances
+VECTOR_INDEX_TTL_SECONDS = float(os.environ.get("VECTOR_INDEX_TTL_SECONDS", "300"))
+# Directory for snapshots; unset disables them (on Cloud Run the disk is memory)
+VECTOR_INDEX_SNAPSHOT_DIR = os.environ.get("VECTOR_INDEX_SNAPSHOT_DIR")
+
+# Columns kept for each chunk, matching the search RPC's result rows
+CHUNK_COLUMNS = ["id", "note_id", "content", "chunk_index", "total_chunks"]
+LOAD_PAGE_SIZE = 1000
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 200
+
+
+def _to_vector(embedding) -> "np.ndarray":
+    """Parse a stored embedding (pgvector text or list) into a unit float32 vector."""
+    if isinstance(embedding, str):
+        embedding = json.loads(embedding)
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+class UserVectorIndex:
+    """Vectors and chunk metadata for one user's notes."""
+
+    def __init__(self, dimension: int = EMBEDDING_DIMENSION, watermark: Optional[str] = None):
+        self.dimension = dimension
+        self.watermark = watermark
+        self.loaded_at = time.time()
+        self._vectors = np.zeros((0, dimension), dtype=np.float32)
+        self._alive = np.zeros(0, dtype=bool)
+        self._rows: List[Optional[Dict]] = []
+        self._labels_by_note: Dict[str, List[int]] = {}
+        self._hnsw = None
+        self._content_bytes = 0
+
+    @property
+    def size(self) -> int:
+        """Number of live chunks."""
+        return int(self._alive.sum())
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory used by this index."""
+        hnsw_bytes = len(self._rows) * HNSW_M * 2 * 4 if self._hnsw is not None else 0
+        return self._vectors.nbytes + self._content_bytes + hnsw_bytes
+
+    def add_rows(self, rows: List[Dict]) -> None:
+        """Add chunk rows (with an 'embedding' key) to the index."""
+        if not rows:
+            return
+        vectors = np.stack([_to_vector(row["embedding"]) for row in rows])
+        start = len(self._rows)
+        if start == 0:
+            self.dimension = vectors.shape[1]
+            self._vectors = np.zeros((0, self.dimension), dtype=np.float32)
+
+        self._vectors = np.vstack([self._vectors, vectors])
+        self._alive = np.concatenate([self._alive, np.ones(len(rows), dtype=bool)])
+        for offset, row in enumerate(rows):
+            meta = {column: row.get(column) for column in CHUNK_COLUMNS}
+            self._rows.append(meta)
+            self._labels_by_note.setdefault(meta["note_id"], []).append(start + offset)
+            self._content_bytes += len(meta["content"] or "")
+
+        if self._hnsw is not None:
+            self._hnsw.resize_index(len(self._rows))
+            self._hnsw.add_items(vectors, np.arange(start, start + len(rows)))
+        self._maybe_build_hnsw()
+
+    def remove_note(self, note_id: str) -> None:
+        """Drop every chunk of a note."""
+        for label in self._labels_by_note.pop(note_id, []):
+            self._alive[label] = False
+            self._content_bytes -= len(self._rows[label]["content"] or "")
+            self._rows[label] = None
+            if self._hnsw is not None:
+                self._hnsw.mark_deleted(label)
+
+        # Compact once most of the storage is dead
+        if len(self._rows) > 64 and self.size < len(self._rows) // 2:
+            self._compact()
+
+    def replace_note(self, note_id: str, rows: List[Dict]) -> None:
+        """Swap a note's chunks for a fresh set."""
+        self.remove_note(note_id)
+        self.add_rows(rows)
+
+    def search(self, query_embedding: List[float], limit: int) -> List[Dict]:
+        """
+        Find the chunks most similar to the query.
+
+        Returns:
+            List[Dict]: Rows shaped like the search RPC's output, best first
+        """
+        live = self.size
+        if live == 0 or limit <= 0:
+            return []
+        k = min(limit, live)
+        query = _to_vector(query_embedding)
+
+        if self._hnsw is not None:
+            self._hnsw.set_ef(max(64, k * 2))
+            labels, distances = self._hnsw.knn_query(query, k=k)
+            hits = [(int(label), 1.0 - float(distance)) for label, distance in zip(labels[0], distances[0])]
+        else:
+            scores = self._vectors @ query
+            scores[~self._alive] = -np.inf
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            hits = [(int(label), float(scores[label])) for label in top]
+
+        return [{**self._rows[label], "similarity": similarity} for label, similarity in hits]
+
+    def _compact(self) -> None:
+        keep = np.flatnonzero(self._alive)
+        rows = [self._rows[label] for label in keep]
+        vectors = self._vectors[keep]
+
+        self._vectors = vectors
+        self._alive = np.ones(len(rows), dtype=bool)
+        self._rows = rows
+        self._labels_by_note = {}
+        for label, row in enumerate(rows):
+            self._labels_by_note.setdefault(row["note_id"], []).append(label)
+        self._hnsw = None
+        self._maybe_build_hnsw()
+
+    def _maybe_build_hnsw(self) -> None:
+        if hnswlib is None or self._hnsw is not None or self.size < VECTOR_INDEX_HNSW_THRESHOLD:
+            return
+        index = hnswlib.Index(space="cosine", dim=self.dimension)
+        index.init_index(max_elements=len(self._rows), ef_construction=HNSW_EF_CONSTRUCTION, M=HNSW_M)
+        index.add_items(self._vectors, np.arange(len(self._rows)))
+        for label in np.flatnonzero(~self._alive):
+            index.mark_deleted(int(label))
+        self._hnsw = index
+
+    def save(self, path: str) -> None:
+        """Write live vectors and metadata to an .npz snapshot."""
+        keep = np.flatnonzero(self._alive)
+        rows = [self._rows[label] for label in keep]
+        np.savez(
+            path,
+            vectors=self._vectors[keep],
+            rows=np.array(json.dumps(rows)),
+            watermark=np.array(self.watermark or "")
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "UserVectorIndex":
+        """Read a snapshot written by save()."""
+        with np.load(path) as data:
+            index = cls(dimension=data["vectors"].shape[1], watermark=str(data["watermark"]) or None)
+            rows = json.loads(str(data["rows"]))
+            for row, vector in zip(rows, data["vectors"]):
+                row["embedding"] = vector
+            index.add_rows(rows)
+        return index
+
+
+class VectorIndexManager:
+    """Per-process registry of user indexes with lazy loading and LRU eviction."""
+
+    def __init__(
+        self,
+        enabled: bool = VECTOR_INDEX_ENABLED,
+        max_bytes: int = VECTOR_INDEX_MAX_BYTES,
+        ttl_seconds: float = VECTOR_INDEX_TTL_SECONDS,
+        snapshot_dir: Optional[str] = VECTOR_INDEX_SNAPSHOT_DIR
+    ):
+        self.enabled = enabled and np is not None
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.snapshot_dir = snapshot_dir
+        self.hits = 0
+        self.misses = 0
+        self._indexes: "OrderedDict[str, UserVectorIndex]" = OrderedDict()
+        self._loading: Dict[str, asyncio.Task] = {}
+        # Updates run in worker threads; a user's lock keeps searches and
+        # snapshots of their index from seeing it half-updated
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def _lock(self, user_id: str) -> asyncio.Lock:
+        return self._locks.setdefault(user_id, asyncio.Lock())
+
+    async def search(
+        self,
+        supabase: AsyncPostgrestClient,
+        user_id: str,
+        query_embedding: List[float],
+        limit: int
+    ) -> Optional[List[Dict]]:
+        """
+        Search the user's resident index.
+
+        Returns:
+            List[Dict] of results, or None when the index isn't loaded yet (a
+            background load is started and the caller should use the database)
+        """
+        if not self.enabled:
+            return None
+
+        index = self._indexes.get(user_id)
+        if index is not None and time.time() - index.loaded_at > self.ttl_seconds:
+            self._schedule_load(supabase, user_id)
+        if index is None:
+            self.misses += 1
+            self._schedule_load(supabase, user_id)
+            return None
+
+        self._indexes.move_to_end(user_id)
+        self.hits += 1
+        async with self._lock(user_id):
+            return index.search(query_embedding, limit)
+
+    async def note_changed(self, supabase: AsyncPostgrestClient, user_id: str, note_id: str) -> None:
+        """Refresh one note's chunks in the user's index, if it is resident."""
+        index = self._indexes.get(user_id)
+        if index is None:
+            return
+        response = await supabase.table("note_chunks").select(", ".join(CHUNK_COLUMNS + ["embedding"])).eq("note_id", note_id).execute()
+        # Parsing vectors and growing the index (possibly building the HNSW
+        # graph) is CPU-bound, so it runs off the event loop
+        async with self._lock(user_id):
+            await run_in_threadpool(index.replace_note, note_id, response.data or [])
+        await self._evict()
+
+    async def note_deleted(self, user_id: str, note_id: str) -> None:
+        """Remove a deleted note from the user's index, if it is resident."""
+        index = self._indexes.get(user_id)
+        if index is not None:
+            # Removal may compact the index and rebuild its HNSW graph
+            async with self._lock(user_id):
+                await run_in_threadpool(index.remove_note, note_id)
+
+    def _schedule_load(self, supabase: AsyncPostgrestClient, user_id: str) -> None:
+        if user_id in self._loading:
+            return
+        task = asyncio.create_task(self._load(supabase, user_id))
+        self._loading[user_id] = task
+        task.add_done_callback(lambda _: self._loading.pop(user_id, None))
+
+    async def _load(self, supabase: AsyncPostgrestClient, user_id: str) -> None:
+        try:
+            watermark = await self._fetch_watermark(supabase, user_id)
+            index = await run_in_threadpool(self._read_snapshot, user_id, watermark)
+
+            if index is None:
+                rows = []
+                offset = 0
+                while True:
+                    response = await supabase.table("note_chunks").select(", ".join(CHUNK_COLUMNS + ["embedding"])).eq("user_id", user_id).not_.is_("embedding", "null").order("id").range(offset, offset + LOAD_PAGE_SIZE - 1).execute()
+                    page = response.data or []
+                    rows.extend(page)
+                    if len(page) < LOAD_PAGE_SIZE:
+                        break
+                    offset += LOAD_PAGE_SIZE
+
+                index = UserVectorIndex(watermark=watermark)
+                await run_in_threadpool(index.add_rows, rows)
+
+            self._indexes[user_id] = index
+            self._indexes.move_to_end(user_id)
+            await self._evict()
+            print(f"[Vector-Index] Loaded {index.size} chunks for user {user_id}")
+        except Exception as e:
+            print(f"[Vector-Index] ERROR loading index for user {user_id}: {e}")
+
+    async def _fetch_watermark(self, supabase: AsyncPostgrestClient, user_id: str) -> str:
+        """Row count plus latest updated_at: changes whenever the user's chunks do."""
+        response = await supabase.table("note_chunks").select("updated_at", count="exact").eq("user_id", user_id).order("updated_at", desc=True).limit(1).execute()
+        latest = response.data[0]["updated_at"] if response.data else ""
+        return f"{response.count or 0}:{latest}"
+
+    def _snapshot_path(self, user_id: str) -> Optional[str]:
+        if not self.snapshot_dir:
+            return None
+        return os.path.join(self.snapshot_dir, f"{user_id}.npz")
+
+    def _read_snapshot(self, user_id: str, watermark: str) -> Optional[UserVectorIndex]:
+        path = self._snapshot_path(user_id)
+        if not path or not os.path.exists(path):
+            return None
+        index = UserVectorIndex.load(path)
+        return index if index.watermark == watermark else None
+
+    def _write_snapshot(self, user_id: str, index: UserVectorIndex) -> None:
+        path = self._snapshot_path(user_id)
+        if not path:
+            return
+        try:
+            os.makedirs(self.snapshot_dir, exist_ok=True)
+            index.save(path)
+        except Exception as e:
+            print(f"[Vector-Index] ERROR writing snapshot for user {user_id}: {e}")
+
+    async def _evict(self) -> None:
+        while len(self._indexes) > 1 and self.total_bytes() > self.max_bytes:
+            user_id, index = self._indexes.popitem(last=False)
+            async with self._lock(user_id):
+                await run_in_threadpool(self._write_snapshot, user_id, index)
+            self._locks.pop(user_id, None)
+
+    def total_bytes(self) -> int:
+        return sum(index.nbytes for index in self._indexes.values())
+
+    def snapshot_all(self) -> None:
+        """Snapshot every resident index. Called on application shutdown."""
+        for user_id, index in self._indexes.items():
+            self._write_snapshot(user_id, index)
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "users": len(self._indexes),
+            "bytes": self.total_bytes(),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+vector_index = VectorIndexManager()
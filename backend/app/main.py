@@ -1,11 +1,50 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+import os
+from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
+from app.core.database import close_clients
+from app.core.embeddings import close_embedding_engine, query_embedding_cache
+from app.core.llm import close_gemini_client, llm_bulkhead
+from app.core.vector_index import vector_index
+from app.services.ai_cache import ai_response_cache
+from app.services.embedding_queue import embedding_queue
 from app.routes import notes, users, profiles, ai, embeddings, ocr
 
+
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:  # pragma: no cover - depends on the environment
+    BrotliMiddleware = None
+
+
+# How long shutdown waits for queued embeddings to finish
+SHUTDOWN_FLUSH_SECONDS = 8.0
+# Responses smaller than this aren't worth compressing
+COMPRESSION_MIN_BYTES = int(os.environ.get("COMPRESSION_MIN_BYTES", "1024"))
+# /metrics exposes cache and queue internals, so it is off unless asked for
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "").lower() in ("1", "true", "yes")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Supabase, OpenAI and Gemini clients hold keep-alive pools, created on first use
+    yield
+    # Finish queued embeds before the pools they use are closed
+    await embedding_queue.flush(timeout=SHUTDOWN_FLUSH_SECONDS)
+    vector_index.snapshot_all()
+    await close_clients()
+    await close_embedding_engine()
+    await close_gemini_client()
+
+
 app = FastAPI(
     title="Notes App API",
     description="API for the Notes App",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # CORS configuration
@@ -23,8 +62,21 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
+# Brotli when the client accepts it, else gzip. Event streams are left alone
+# so each event reaches the client as soon as it is sent.
+if BrotliMiddleware is not None:
+    app.add_middleware(
+        BrotliMiddleware,
+        minimum_size=COMPRESSION_MIN_BYTES,
+        gzip_fallback=True,
+        excluded_handlers=[r"/stream$"]
+    )
+else:
+    app.add_middleware(GZipMiddleware, minimum_size=COMPRESSION_MIN_BYTES)
+
 # Include routers
 app.include_router(notes.router)
 app.include_router(users.router)
@@ -41,3 +93,14 @@ def root():
 def health_check():
     return {"status": "healthy"}
 
+@app.get("/metrics")
+def metrics():
+    """In-process cache counters and LLM queue depth for this instance."""
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return {
+        "query_embedding_cache": query_embedding_cache.stats(),
+        "vector_index": vector_index.stats(),
+        "ai_response_cache": ai_response_cache.stats(),
+        "llm_bulkhead": llm_bulkhead.stats()
+    }
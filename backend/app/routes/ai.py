@@ -1,67 +1,368 @@
-import os
-import google.generativeai as genai
+import asyncio
+import json
+from contextlib import aclosing
 from fastapi import APIRouter, HTTPException, status, Depends
-from pydantic import BaseModel
+from postgrest import AsyncPostgrestClient
+from fastapi.responses import StreamingResponse
+from fastapi.security import HTTPAuthorizationCredentials
+from pydantic import BaseModel, Field, model_validator
 from datetime import datetime, timezone
-from app.core.auth import get_current_user
+from typing import Any, Dict, Optional
+from app.core.auth import get_authenticated_client, get_current_user, optional_security
+from app.core.llm import (
+    GEMINI_API_KEY, GEMINI_MODEL, LLM_RETRY_AFTER_SECONDS, LLM_TIMEOUT_SECONDS,
+    BulkheadFullError, get_gemini_model, llm_bulkhead, stream_text
+)
+from app.schemas.chat import (
+    ChatMessageRequest, ChatSessionCreate, ChatSessionResponse, ChatTurnResponse
+)
+from app.services.ai_cache import ai_cache_key, get_cached_answer, store_answer
+from app.services.ai_chat import AIChatService
+from app.services.ai_context import AIContextService
+from app.services.library_qa import LibraryQAService
 
 router = APIRouter(prefix="/ai", tags=["ai"])
 
-# 1. Configure the AI with your Key
-api_key = os.environ.get("GEMINI_API_KEY")
-if api_key:
-    genai.configure(api_key=api_key)
+# 1. The Gemini client is shared by the whole process (see app.core.llm)
+MODEL_NAME = GEMINI_MODEL
 
 # 2. Define the data structure we expect from the App
+# Either note_id (the server loads the note; needs a bearer token) or the
+# note's title and content inline
 class AIProcessRequest(BaseModel):
-    noteTitle: str
-    noteContent: str
     userPrompt: str
+    note_id: Optional[str] = None
+    noteTitle: Optional[str] = None
+    noteContent: Optional[str] = None
+
+    @model_validator(mode="after")
+    def check_note_source(self):
+        if self.note_id is None and self.noteContent is None:
+            raise ValueError("Provide either note_id or noteContent")
+        return self
+
+class AIAskRequest(BaseModel):
+    question: str = Field(..., min_length=1)
 
 # 3. Define the data structure we send back to the App
 class AIProcessResponse(BaseModel):
     result: str
     processedAt: str
     modelUsed: str
+    metadata: Dict[str, Any] = {}
 
-# 4. The actual route handler
-@router.post("/process", response_model=AIProcessResponse)
-async def process_ai_request(
-    request: AIProcessRequest,
-  
-):
-    if not api_key:
-        raise HTTPException(status_code=503, detail="Server missing API Key")
-
-    try:
-        # Use the 'flash' model for speed and low cost
-        model = genai.GenerativeModel('gemini-2.5-flash')
-
-        # Build the context for the AI
-        prompt = f"""
+def build_prompt(note_title: str, note_content: str, user_prompt: str) -> str:
+    """Build the context for the AI"""
+    return f"""
         You are a helpful AI assistant built into a notes app.
         
         Context:
-        Note Title: {request.noteTitle}
+        Note Title: {note_title}
         Note Content:
-        {request.noteContent}
+        {note_content}
         
-        User Request: {request.userPrompt}
+        User Request: {user_prompt}
         
         Please provide a helpful response based on the note content above.
         """
 
-        response = model.generate_content(prompt)
+async def resolve_context(
+    request: AIProcessRequest,
+    credentials: Optional[HTTPAuthorizationCredentials]
+) -> Dict[str, Any]:
+    """
+    Title and content to prompt with. For note_id requests the note is
+    loaded server-side and long notes are cut to the chunks most relevant to
+    the prompt (see AIContextService).
+
+    The response cache is checked before any chunk ranking, so a cached
+    answer costs one note read at most.
+
+    Returns:
+        Dict: cache_key, and either cached (a stored answer) or title,
+        content and metadata describing the context used
+    """
+    if request.note_id is None:
+        title = request.noteTitle or ""
+        cache_key = ai_cache_key(None, None, title, request.noteContent, request.userPrompt, MODEL_NAME)
+        cached = get_cached_answer(cache_key)
+        if cached is not None:
+            return {"cache_key": cache_key, "cached": cached}
+        return {
+            "cache_key": cache_key,
+            "title": title,
+            "content": request.noteContent,
+            "metadata": {"context": "inline"}
+        }
+
+    if credentials is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="note_id requires authentication")
+    current_user = await get_current_user(credentials)
+    supabase = await get_authenticated_client(credentials)
+
+    note = await AIContextService.load_note(supabase, current_user["id"], request.note_id)
+    cache_key = ai_cache_key(
+        current_user["id"], request.note_id, note["title"], note["content"], request.userPrompt, MODEL_NAME
+    )
+    cached = get_cached_answer(cache_key)
+    if cached is not None:
+        return {"cache_key": cache_key, "cached": cached}
+
+    context = await AIContextService.build_note_context(supabase, note, request.userPrompt)
+    return {
+        "cache_key": cache_key,
+        "title": context["title"],
+        "content": context["content"],
+        "metadata": {"context": context["strategy"], "noteId": request.note_id}
+    }
+
+def _busy(e: BulkheadFullError) -> HTTPException:
+    """503 for a request shed by the LLM bulkhead."""
+    print(f"[AI] Shedding request: {e}")
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="AI is busy, try again shortly",
+        headers={"Retry-After": str(LLM_RETRY_AFTER_SECONDS)}
+    )
+
+# 4. The actual route handler
+@router.post("/process", response_model=AIProcessResponse)
+async def process_ai_request(
+    request: AIProcessRequest,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+):
+    if not GEMINI_API_KEY:
+        raise HTTPException(status_code=503, detail="Server missing API Key")
+
+    context = await resolve_context(request, credentials)
+    if "cached" in context:
+        cached = context["cached"]
+        return AIProcessResponse(**{**cached, "metadata": {**cached["metadata"], "cacheHit": True}})
+
+    try:
+        prompt = build_prompt(context["title"], context["content"], request.userPrompt)
+
+        # Awaited on the shared async client, so a slow generation only
+        # holds one bulkhead slot and never blocks the event loop
+        async with llm_bulkhead.slot():
+            response = await get_gemini_model().generate_content_async(
+                prompt, request_options={"timeout": LLM_TIMEOUT_SECONDS}
+            )
         
         if not response.text:
             raise ValueError("Empty response from AI")
 
-        return AIProcessResponse(
-            result=response.text,
-            processedAt=datetime.now(timezone.utc).isoformat(),
-            modelUsed='gemini-2.5-flash'
-        )
+        answer = {
+            "result": response.text,
+            "processedAt": datetime.now(timezone.utc).isoformat(),
+            "modelUsed": MODEL_NAME,
+            "metadata": context["metadata"]
+        }
+        store_answer(context["cache_key"], answer)
+        return AIProcessResponse(**{**answer, "metadata": {**answer["metadata"], "cacheHit": False}})
 
+    except BulkheadFullError as e:
+        raise _busy(e)
     except Exception as e:
         print(f"AI Error: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def _sse(event: str, data: dict) -> str:
+    """Format one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@router.post("/process/stream")
+async def stream_ai_request(
+    request: AIProcessRequest,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+):
+    """
+    Same as /process, but relays the answer as Server-Sent Events as Gemini
+    generates it.
+
+    Events:
+        chunk: {"text": ...} for each piece of the answer
+        done:  {"processedAt": ..., "modelUsed": ..., "metadata": ...} once finished
+        error: {"detail": ...} if generation fails midway
+
+    If the client disconnects, the upstream generation is cancelled. Cached
+    answers are replayed as a single chunk. A generation holds its bulkhead
+    slot until the stream ends.
+    """
+    if not GEMINI_API_KEY:
+        raise HTTPException(status_code=503, detail="Server missing API Key")
+
+    context = await resolve_context(request, credentials)
+    # Shed before the 200 is sent; a slot is taken once the stream starts
+    if "cached" not in context and llm_bulkhead.is_full():
+        raise _busy(BulkheadFullError("Too many requests waiting"))
+
+    async def replay(cached):
+        yield _sse("chunk", {"text": cached["result"]})
+        yield _sse("done", {
+            "processedAt": cached["processedAt"],
+            "modelUsed": cached["modelUsed"],
+            "metadata": {**cached["metadata"], "cacheHit": True}
+        })
+
+    async def events():
+        prompt = build_prompt(context["title"], context["content"], request.userPrompt)
+        stream = None
+        parts = []
+        try:
+            async with llm_bulkhead.slot():
+                stream = await get_gemini_model().generate_content_async(
+                    prompt, stream=True, request_options={"timeout": LLM_TIMEOUT_SECONDS}
+                )
+                # Closing the relay cancels the gRPC call (see stream_text)
+                async with aclosing(stream_text(stream)) as texts:
+                    async for text in texts:
+                        parts.append(text)
+                        yield _sse("chunk", {"text": text})
+            answer = {
+                "result": "".join(parts),
+                "processedAt": datetime.now(timezone.utc).isoformat(),
+                "modelUsed": MODEL_NAME,
+                "metadata": context["metadata"]
+            }
+            # Only complete answers are cached; a disconnect or error skips this
+            if parts:
+                store_answer(context["cache_key"], answer)
+            yield _sse("done", {
+                "processedAt": answer["processedAt"],
+                "modelUsed": MODEL_NAME,
+                "metadata": {**context["metadata"], "cacheHit": False}
+            })
+        except (asyncio.CancelledError, GeneratorExit):
+            # The client disconnected: the response task was cancelled or
+            # this generator closed. Leaving the block above has already
+            # cancelled the call, so no more tokens are paid for.
+            if stream is not None:
+                print("[AI-Stream] Client went away, generation cancelled")
+            raise
+        except Exception as e:
+            print(f"AI Stream Error: {str(e)}")
+            yield _sse("error", {"detail": str(e)})
+
+    return StreamingResponse(
+        replay(context["cached"]) if "cached" in context else events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.post("/ask/stream")
+async def ask_library(
+    request: AIAskRequest,
+    current_user: dict = Depends(get_current_user),
+    supabase: AsyncPostgrestClient = Depends(get_authenticated_client)
+):
+    """
+    Answer a question from all of the user's notes, streamed as Server-Sent
+    Events. The most relevant notes are read concurrently and combined into
+    one answer within a fixed time budget (see LibraryQAService).
+
+    Events:
+        sources: {"notes": [...]} the notes being read
+        partial: {"note_id", "title", "text"} what each note says, as it finishes
+        chunk:   {"text": ...} pieces of the combined answer
+        done:    {"processedAt", "modelUsed", "metadata"} once finished
+        error:   {"detail": ...} if the answer can't be completed
+    """
+    if not GEMINI_API_KEY:
+        raise HTTPException(status_code=503, detail="Server missing API Key")
+    if llm_bulkhead.is_full():
+        raise _busy(BulkheadFullError("Too many requests waiting"))
+
+    async def events():
+        answer = LibraryQAService.ask(supabase, current_user["id"], request.question)
+        try:
+            async for event, data in answer:
+                yield _sse(event, data)
+        except Exception as e:
+            print(f"AI Ask Error: {str(e)}")
+            yield _sse("error", {"detail": str(e)})
+        finally:
+            # Runs the service's cleanup (cancelling its calls) on disconnect
+            await answer.aclose()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+def _session_response(session: dict) -> ChatSessionResponse:
+    return ChatSessionResponse(
+        id=session["id"],
+        note_id=session["note_id"],
+        context_cached=session.get("cached_content") is not None,
+        messages=session.get("messages") or [],
+        created_at=session["created_at"],
+        updated_at=session["updated_at"]
+    )
+
+
+@router.post("/chat/sessions", response_model=ChatSessionResponse, status_code=status.HTTP_201_CREATED)
+async def create_chat_session(
+    body: ChatSessionCreate,
+    current_user: dict = Depends(get_current_user),
+    supabase: AsyncPostgrestClient = Depends(get_authenticated_client)
+):
+    """
+    Start a chat about a note. The conversation is kept server-side, and long
+    notes are put in a Gemini context cache so each turn only sends the new
+    message and recent history (needs sql/ai_chat_sessions.sql).
+    """
+    if not GEMINI_API_KEY:
+        raise HTTPException(status_code=503, detail="Server missing API Key")
+    session = await AIChatService.create_session(supabase, current_user["id"], body.note_id)
+    return _session_response(session)
+
+
+@router.get("/chat/sessions/{session_id}", response_model=ChatSessionResponse)
+async def get_chat_session(
+    session_id: str,
+    current_user: dict = Depends(get_current_user),
+    supabase: AsyncPostgrestClient = Depends(get_authenticated_client)
+):
+    """Get a chat session and its history."""
+    session = await AIChatService.get_session(supabase, current_user["id"], session_id)
+    return _session_response(session)
+
+
+@router.post("/chat/sessions/{session_id}/messages", response_model=ChatTurnResponse)
+async def send_chat_message(
+    session_id: str,
+    body: ChatMessageRequest,
+    current_user: dict = Depends(get_current_user),
+    supabase: AsyncPostgrestClient = Depends(get_authenticated_client)
+):
+    """Send a message in a chat session and get the reply."""
+    if not GEMINI_API_KEY:
+        raise HTTPException(status_code=503, detail="Server missing API Key")
+
+    try:
+        reply, metadata = await AIChatService.send_message(supabase, current_user["id"], session_id, body.message)
+    except HTTPException:
+        raise
+    except BulkheadFullError as e:
+        raise _busy(e)
+    except Exception as e:
+        print(f"AI Chat Error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return ChatTurnResponse(session_id=session_id, message=reply, model_used=MODEL_NAME, metadata=metadata)
+
+
+@router.delete("/chat/sessions/{session_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_chat_session(
+    session_id: str,
+    current_user: dict = Depends(get_current_user),
+    supabase: AsyncPostgrestClient = Depends(get_authenticated_client)
+):
+    """End a chat session and release its context cache."""
+    await AIChatService.delete_session(supabase, current_user["id"], session_id)
@@ -3,10 +3,12 @@ API routes for handling embeddings and vector search.
 Provides endpoints for embedding notes, storing chunks, and semantic search.
 """
 
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from supabase import Client
+from fastapi import APIRouter, Depends, HTTPException, Request, status, Query
+from postgrest import AsyncPostgrestClient
 
 from app.core.auth import get_current_user, get_authenticated_client
+from app.core.responses import negotiated_response
+from app.services.embedding_queue import embedding_queue
 from app.services.embeddings import EmbeddingService
 from app.schemas.embeddings import (
     EmbeddingResponse,
@@ -26,14 +28,16 @@ async def embed_note(
     note_id: str,
     chunk_size: int = Query(1000, ge=500, le=3000),
     current_user: dict = Depends(get_current_user),
-    supabase: Client = Depends(get_authenticated_client)
+    supabase: AsyncPostgrestClient = Depends(get_authenticated_client)
 ):
     """
     Create and store embeddings for a note using semantic chunking.
+    Goes through the embedding queue, so it is ordered with background
+    embeds of the same note instead of racing them.
     """
     try:
         # Fetch the note to verify existence/permissions
-        response = supabase.table("notes").select("*").eq("id", note_id).single().execute()
+        response = await supabase.table("notes").select("id, user_id, title, content").eq("id", note_id).single().execute()
         
         if not response.data:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Note not found")
@@ -42,7 +46,7 @@ async def embed_note(
         if note["user_id"] != current_user["id"]:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Permission denied")
             
-        embedded_chunks = EmbeddingService.embed_note(
+        embedded_chunks = await embedding_queue.embed_now(
             supabase=supabase,
             user_id=current_user["id"],
             note_id=note_id,
@@ -50,6 +54,12 @@ async def embed_note(
             content=note["content"],
             chunk_size=chunk_size
         )
+        if embedded_chunks is None:
+            return EmbeddingResponse(
+                note_id=note_id,
+                chunks_created=0,
+                message="A newer version of the note was saved meanwhile and will be embedded instead"
+            )
         
         return EmbeddingResponse(
             note_id=note_id,
@@ -67,25 +77,27 @@ async def embed_note(
 
 @router.post("/search", response_model=VectorSearchResponse)
 async def vector_search(
+    request: Request,
     search_request: VectorSearchRequest,
     current_user: dict = Depends(get_current_user),
-    supabase: Client = Depends(get_authenticated_client)
+    supabase: AsyncPostgrestClient = Depends(get_authenticated_client)
 ):
     """
     Search note chunks using vector similarity (semantic search).
     """
     try:
-        search_results = EmbeddingService.vector_search(
+        search_results = await EmbeddingService.vector_search(
             supabase=supabase,
             user_id=current_user["id"],
             query=search_request.query,
             limit=search_request.limit
         )
         
-        return VectorSearchResponse(
-            results=search_results,
-            count=len(search_results)
-        )
+        # Results are built as VectorSearchResult already; encode them directly
+        return negotiated_response(request, {
+            "results": [result.model_dump() for result in search_results],
+            "count": len(search_results)
+        })
     
     except Exception as e:
         raise HTTPException(
@@ -98,13 +110,13 @@ async def vector_search(
 async def embed_all_notes(
     chunk_size: int = Query(1000, ge=500, le=3000),
     current_user: dict = Depends(get_current_user),
-    supabase: Client = Depends(get_authenticated_client)
+    supabase: AsyncPostgrestClient = Depends(get_authenticated_client)
 ):
     """
     Create embeddings for all of a user's notes.
     """
     try:
-        result = EmbeddingService.embed_all_notes(
+        result = await EmbeddingService.embed_all_notes(
             supabase=supabase,
             user_id=current_user["id"],
             chunk_size=chunk_size
@@ -125,7 +137,7 @@ async def embed_all_notes(
 async def get_note_chunks(
     note_id: str,
     current_user: dict = Depends(get_current_user),
-    supabase: Client = Depends(get_authenticated_client)
+    supabase: AsyncPostgrestClient = Depends(get_authenticated_client)
 ):
     """
     Get all chunks for a specific note.
@@ -135,7 +147,7 @@ async def get_note_chunks(
     """
     try:
         # Verify note ownership
-        note_response = supabase.table("notes").select("user_id").eq(
+        note_response = await supabase.table("notes").select("user_id").eq(
             "id", note_id
         ).single().execute()
         
@@ -146,7 +158,7 @@ async def get_note_chunks(
             )
         
         # Fetch chunks
-        chunks_response = supabase.table("note_chunks").select("*").eq(
+        chunks_response = await supabase.table("note_chunks").select("*").eq(
             "note_id", note_id
         ).order("chunk_index", desc=False).execute()
         
@@ -1,58 +1,294 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from typing import List
-from supabase import Client
+import math
+import os
+import time
+from datetime import datetime
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, status, Query
+from typing import List, Literal, Optional, Tuple, Union
+from postgrest import AsyncPostgrestClient
 
 from app.core.auth import get_current_user, get_authenticated_client
-from app.schemas.notes import NoteCreate, NoteUpdate, NoteResponse
-from app.services.embeddings import EmbeddingService
+from app.core.etag import CACHE_CONTROL, VARY, etag_matches, not_modified, weak_etag
+from app.core.pagination import encode_cursor, decode_cursor
+from app.core.responses import negotiated_media_type, negotiated_response
+from app.core.vector_index import vector_index
+from app.schemas.notes import (
+    NoteCreate, NoteUpdate, NoteResponse, NoteSummary, NoteSearchResult, NoteChangesResponse,
+    NoteBatchRequest, NoteBatchResponse
+)
+from app.schemas.search import HybridSearchResponse
+from app.services.ai_cache import invalidate_notes
+from app.services.embedding_queue import embedding_queue
+from app.services.notes import NoteService, derive_title, parse_note_id
+from app.services.search import SearchService
 
 router = APIRouter(prefix="/notes", tags=["notes"])
 
+# Columns returned to clients (leaves out the search_vector column)
+NOTE_COLUMNS = "id, user_id, title, content, created_at, updated_at, basic_stats"
+# view=summary: the generated preview column instead of the full content
+SUMMARY_COLUMNS = "id, user_id, title, preview, created_at, updated_at"
+# Columns a client may ask for with fields=
+SELECTABLE_FIELDS = {"id", "user_id", "title", "content", "preview", "created_at", "updated_at", "basic_stats"}
+# Response header carrying the cursor for the next page of list_notes
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+# How long deletions stay visible to /notes/changes; older cursors must resync
+NOTE_TOMBSTONE_RETENTION_DAYS = int(os.environ.get("NOTE_TOMBSTONE_RETENTION_DAYS", "30"))
+
 # ---------------------------
 # Routes
 # ---------------------------
 
-@router.get("/", response_model=List[NoteResponse])
+def _select_columns(view: str, fields: Optional[str]) -> str:
+    """Columns for a list query from the view/fields parameters."""
+    if fields:
+        requested = [field.strip() for field in fields.split(",") if field.strip()]
+        unknown = set(requested) - SELECTABLE_FIELDS
+        if unknown:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unknown fields: {', '.join(sorted(unknown))}"
+            )
+        # id and updated_at are always needed for the next cursor
+        columns = ["id", "updated_at"] + [field for field in requested if field not in ("id", "updated_at")]
+        return ", ".join(dict.fromkeys(columns))
+    if view == "summary":
+        return SUMMARY_COLUMNS
+    return NOTE_COLUMNS
+
+
+def _list_position(cursor: str) -> Tuple[str, str]:
+    """
+    The (updated_at, id) a list cursor points at, in canonical form. They go
+    into a PostgREST filter, so anything but a timestamp and a UUID is refused.
+
+    Raises:
+        HTTPException: 400 if the cursor is malformed
+    """
+    invalid = HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    try:
+        position = decode_cursor(cursor, "updated_at", "id")
+        updated_at = datetime.fromisoformat(position["updated_at"]).isoformat()
+    except (ValueError, TypeError):
+        raise invalid
+    note_id = parse_note_id(position["id"])
+    if note_id is None:
+        raise invalid
+    return updated_at, note_id
+
+
+def _sync_position(since: str) -> Tuple[int, float]:
+    """
+    The (seq, at) a sync cursor points at: a change counter and the Unix time
+    the cursor was issued.
+
+    Raises:
+        HTTPException: 400 if the cursor is malformed
+    """
+    invalid = HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    try:
+        position = decode_cursor(since, "seq", "at")
+    except ValueError:
+        raise invalid
+    seq, at = position["seq"], position["at"]
+    # bool is an int subclass, and json accepts NaN and Infinity
+    if isinstance(seq, bool) or not isinstance(seq, int) or seq < 0:
+        raise invalid
+    if isinstance(at, bool) or not isinstance(at, (int, float)) or not math.isfinite(at):
+        raise invalid
+    return seq, at
+
+
+async def _change_seq(supabase: AsyncPostgrestClient, user_id: str) -> Optional[int]:
+    """
+    The user's note change counter, bumped by every note write and delete.
+    None if it can't be read (e.g. before sql/notes_delta_sync.sql is applied).
+    """
+    try:
+        response = await supabase.table("note_sync_state").select("change_seq").eq("user_id", user_id).execute()
+        return response.data[0]["change_seq"] if response.data else 0
+    except Exception as e:
+        print(f"[Notes] Change counter unavailable, skipping ETag: {e}")
+        return None
+
+
+@router.get("/", response_model=Union[List[NoteResponse], List[NoteSummary]])
 async def list_notes(
-    skip: int = Query(0, ge=0),
+    request: Request,
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor from the previous page"),
+    skip: int = Query(0, ge=0, description="Deprecated: offset pagination, use cursor"),
     limit: int = Query(100, ge=1, le=100),
+    view: Literal["full", "summary"] = Query("full", description="summary returns a preview instead of content"),
+    fields: Optional[str] = Query(None, description="Comma-separated columns to return, overrides view"),
+    if_none_match: Optional[str] = Header(None),
     current_user: dict = Depends(get_current_user),
-    supabase: Client = Depends(get_authenticated_client)
+    supabase: AsyncPostgrestClient = Depends(get_authenticated_client)
 ):
     """
-    Get all notes for the current user.
+    Get notes for the current user, most recently updated first.
+
+    Pages by keyset on (updated_at, id): pass the X-Next-Cursor header of one
+    page as `cursor` to get the next. The header is absent on the last page.
+    view=summary returns NoteSummary items; fields= returns just those columns.
+    Responses carry an ETag; send it back as If-None-Match to get a 304 when
+    none of the user's notes changed.
     """
     user_id = current_user["id"]
     
-    response = supabase.table("notes").select("*").eq("user_id", user_id).range(skip, skip + limit - 1).order("updated_at", desc=True).execute()
+    # Read the counter before the notes so the ETag is never newer than the body
+    change_seq = await _change_seq(supabase, user_id)
+    etag = None
+    if change_seq is not None:
+        etag = weak_etag("notes", user_id, change_seq, sorted(request.query_params.multi_items()), negotiated_media_type(request))
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+    
+    query = supabase.table("notes").select(_select_columns(view, fields)).eq("user_id", user_id)
+    if cursor:
+        updated_at, note_id = _list_position(cursor)
+        query = query.or_(f'updated_at.lt."{updated_at}",and(updated_at.eq."{updated_at}",id.gt.{note_id})')
+        query = query.order("updated_at", desc=True).order("id").limit(limit)
+    else:
+        query = query.order("updated_at", desc=True).order("id").range(skip, skip + limit - 1)
+    
+    result = await query.execute()
+    notes = result.data or []
+
+    headers = {}
+    if etag:
+        headers.update({"ETag": etag, "Cache-Control": CACHE_CONTROL, "Vary": VARY})
+    if len(notes) == limit:
+        last = notes[-1]
+        headers[NEXT_CURSOR_HEADER] = encode_cursor({"updated_at": last["updated_at"], "id": last["id"]})
+
+    # Rows come back from PostgREST already in response shape (and partial
+    # rows under fields= fit neither model), so skip re-validation
+    return negotiated_response(request, notes, headers)
+
+
+@router.get("/changes", response_model=NoteChangesResponse)
+async def get_note_changes(
+    since: Optional[str] = Query(None, description="next_cursor from the previous sync; omit for a full sync"),
+    limit: int = Query(500, ge=1, le=1000),
+    current_user: dict = Depends(get_current_user),
+    supabase: AsyncPostgrestClient = Depends(get_authenticated_client)
+):
+    """
+    Notes created, updated or deleted since the given cursor, in change order.
+
+    Keep calling with next_cursor while has_more is true. A cursor older than
+    the tombstone retention window returns 410; start again without one.
+    """
+    user_id = current_user["id"]
+    issued_at = time.time()
+
+    since_seq, since_at = 0, issued_at
+    if since:
+        since_seq, since_at = _sync_position(since)
+        if issued_at - since_at > NOTE_TOMBSTONE_RETENTION_DAYS * 86400:
+            raise HTTPException(
+                status_code=status.HTTP_410_GONE,
+                detail="Sync cursor expired, full sync required"
+            )
+
+    result = await supabase.rpc(
+        "get_note_changes",
+        {
+            "p_user_id": user_id,
+            "p_since": since_seq,
+            "p_limit": limit,
+            "p_retention_days": NOTE_TOMBSTONE_RETENTION_DAYS
+        }
+    ).execute()
+    changes = result.data or []
+
+    upserted = [change for change in changes if not change["deleted"]]
+    deleted = [change["id"] for change in changes if change["deleted"]]
+    last_seq = changes[-1]["change_seq"] if changes else since_seq
+    # A full page may have more behind it; hold the issue time so nothing is
+    # purged under a client that is still paging
+    at = since_at if len(changes) == limit else issued_at
+
+    return NoteChangesResponse(
+        upserted=upserted,
+        deleted=deleted,
+        next_cursor=encode_cursor({"seq": last_seq, "at": at}),
+        has_more=len(changes) == limit
+    )
+
+
+@router.get("/search", response_model=List[NoteSearchResult])
+async def search_notes(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    current_user: dict = Depends(get_current_user),
+    supabase: AsyncPostgrestClient = Depends(get_authenticated_client)
+):
+    """
+    Search notes by keyword, ranked, with highlighted snippets.
+    """
+    user_id = current_user["id"]
     
-    return response.data
+    return await SearchService.keyword_search(supabase, user_id, q, limit=limit, offset=offset)
+
+
+@router.get("/search/hybrid", response_model=HybridSearchResponse)
+async def hybrid_search_notes(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(10, ge=1, le=50),
+    current_user: dict = Depends(get_current_user),
+    supabase: AsyncPostgrestClient = Depends(get_authenticated_client)
+):
+    """
+    Search notes by keyword and meaning at once, fused into one ranking.
+    """
+    try:
+        results = await SearchService.hybrid_search(supabase, current_user["id"], q, limit=limit)
+        return HybridSearchResponse(results=results, count=len(results))
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Hybrid search failed: {str(e)}"
+        )
 
 
 @router.get("/{note_id}", response_model=NoteResponse)
 async def get_note(
     note_id: str,
+    request: Request,
+    if_none_match: Optional[str] = Header(None),
     current_user: dict = Depends(get_current_user),
-    supabase: Client = Depends(get_authenticated_client)
+    supabase: AsyncPostgrestClient = Depends(get_authenticated_client)
 ):
     """
     Get a specific note by ID.
+    Send the response's ETag as If-None-Match to get a 304 if it hasn't changed.
     """
     user_id = current_user["id"]
     
-    response = supabase.table("notes").select("*").eq("id", note_id).eq("user_id", user_id).single().execute()
+    if if_none_match:
+        # Check the timestamp alone before paying for the full row
+        head = await supabase.table("notes").select("updated_at").eq("id", note_id).eq("user_id", user_id).single().execute()
+        if head.data:
+            etag = weak_etag(user_id, note_id, head.data["updated_at"], negotiated_media_type(request))
+            if etag_matches(if_none_match, etag):
+                return not_modified(etag)
     
-    if not response.data:
+    result = await supabase.table("notes").select(NOTE_COLUMNS).eq("id", note_id).eq("user_id", user_id).single().execute()
+    
+    if not result.data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Note not found")
-        
-    return response.data
+    
+    etag = weak_etag(user_id, note_id, result.data["updated_at"], negotiated_media_type(request))
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL, "Vary": VARY}
+    return negotiated_response(request, result.data, headers)
 
 
 @router.post("/", response_model=NoteResponse, status_code=status.HTTP_201_CREATED)
 async def create_note(
     note: NoteCreate,
     current_user: dict = Depends(get_current_user),
-    supabase: Client = Depends(get_authenticated_client)
+    supabase: AsyncPostgrestClient = Depends(get_authenticated_client)
 ):
     """
     Create a new note.
@@ -60,13 +296,7 @@ async def create_note(
     user_id = current_user["id"]
     
     # Use provided title or derive from content
-    title = note.title
-    if not title:
-        content_lines = note.content.strip().split('\n')
-        title = content_lines[0][:100] if content_lines else "Untitled Note"
-    
-    if not title:
-        title = "Untitled Note"
+    title = derive_title(note.title, note.content)
         
     # Store basic_stats (empty for now if not provided)
     basic_stats = note.basic_stats or {}
@@ -78,35 +308,50 @@ async def create_note(
         "basic_stats": basic_stats
     }
     
-    response = supabase.table("notes").insert(note_data).execute()
+    response = await supabase.table("notes").insert(note_data).execute()
     
     if not response.data:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Note not created")
         
     created_note = response.data[0]
     
-    # Auto-generate embeddings
-    try:
-        EmbeddingService.embed_note(
-            supabase=supabase,
-            user_id=user_id,
-            note_id=created_note["id"],
-            title=created_note["title"],
-            content=created_note["content"]
-        )
-    except Exception as e:
-        print(f"Error generating embeddings for new note: {e}")
-        # Don't fail the request, just log the error
+    # Auto-generate embeddings in the background
+    embedding_queue.schedule(
+        supabase=supabase,
+        user_id=user_id,
+        note_id=created_note["id"],
+        title=created_note["title"],
+        content=created_note["content"]
+    )
         
     return created_note
 
 
+@router.post("/batch", response_model=NoteBatchResponse)
+async def batch_notes(
+    batch: NoteBatchRequest,
+    current_user: dict = Depends(get_current_user),
+    supabase: AsyncPostgrestClient = Depends(get_authenticated_client)
+):
+    """
+    Create, update and delete many notes in one request, e.g. to replay
+    offline edits. Returns a result per operation, in order.
+    """
+    try:
+        return await NoteService.apply_batch(supabase, current_user["id"], batch.operations)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Batch failed, no changes applied: {str(e)}"
+        )
+
+
 @router.put("/{note_id}", response_model=NoteResponse)
 async def update_note(
     note_id: str,
     note: NoteUpdate,
     current_user: dict = Depends(get_current_user),
-    supabase: Client = Depends(get_authenticated_client)
+    supabase: AsyncPostgrestClient = Depends(get_authenticated_client)
 ):
     """
     Update an existing note.
@@ -114,7 +359,7 @@ async def update_note(
     user_id = current_user["id"]
     
     # First get existing note
-    existing = supabase.table("notes").select("basic_stats").eq("id", note_id).eq("user_id", user_id).single().execute()
+    existing = await supabase.table("notes").select("basic_stats").eq("id", note_id).eq("user_id", user_id).single().execute()
     if not existing.data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Note not found")
         
@@ -125,25 +370,24 @@ async def update_note(
     if not update_data:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No fields to update")
         
-    response = supabase.table("notes").update(update_data).eq("id", note_id).eq("user_id", user_id).execute()
+    response = await supabase.table("notes").update(update_data).eq("id", note_id).eq("user_id", user_id).execute()
     
     if not response.data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Note not found or no changes made")
         
     updated_note = response.data[0]
     
-    # Auto-update embeddings if content or title changed
+    # Auto-update embeddings if content or title changed; rapid successive
+    # saves of the same note are coalesced into one embed of the latest version
     if "content" in update_data or "title" in update_data:
-        try:
-            EmbeddingService.embed_note(
-                supabase=supabase,
-                user_id=user_id,
-                note_id=updated_note["id"],
-                title=updated_note["title"],
-                content=updated_note["content"]
-            )
-        except Exception as e:
-            print(f"Error updating embeddings: {e}")
+        invalidate_notes(user_id, [updated_note["id"]])
+        embedding_queue.schedule(
+            supabase=supabase,
+            user_id=user_id,
+            note_id=updated_note["id"],
+            title=updated_note["title"],
+            content=updated_note["content"]
+        )
             
     return updated_note
 
@@ -152,30 +396,17 @@ async def update_note(
 async def delete_note(
     note_id: str,
     current_user: dict = Depends(get_current_user),
-    supabase: Client = Depends(get_authenticated_client)
+    supabase: AsyncPostgrestClient = Depends(get_authenticated_client)
 ):
     """
     Delete a note.
     """
     user_id = current_user["id"]
     
-    response = supabase.table("notes").delete().eq("id", note_id).eq("user_id", user_id).execute()
+    response = await supabase.table("notes").delete().eq("id", note_id).eq("user_id", user_id).execute()
     
     if not response.data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Note not found")
 
-
-@router.get("/search", response_model=List[NoteResponse])
-async def search_notes(
-    q: str = Query(..., min_length=1),
-    current_user: dict = Depends(get_current_user),
-    supabase: Client = Depends(get_authenticated_client)
-):
-    """
-    Search notes by content (simple ILIKE).
-    """
-    user_id = current_user["id"]
-    
-    response = supabase.table("notes").select("*").eq("user_id", user_id).or_(f"title.ilike.%{q}%,content.ilike.%{q}%").order("updated_at", desc=True).execute()
-    
-    return response.data
+    await vector_index.note_deleted(user_id, note_id)
+    invalidate_notes(user_id, [note_id])
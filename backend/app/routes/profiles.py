@@ -4,7 +4,7 @@ from typing import Optional
 from datetime import datetime
 from app.core.database import get_supabase_admin
 from app.core.auth import get_current_user
-from supabase import Client
+from supabase import AsyncClient
 
 router = APIRouter(prefix="/profiles", tags=["profiles"])
 
@@ -34,7 +34,7 @@ class ProfileUpdate(BaseModel):
 async def create_profile(
     profile: ProfileCreate,
     current_user: dict = Depends(get_current_user),
-    supabase: Client = Depends(get_supabase_admin)
+    supabase: AsyncClient = Depends(get_supabase_admin)
 ):
     """
     Create a new profile for the current authenticated user.
@@ -48,7 +48,7 @@ async def create_profile(
     }
     
     try:
-        response = supabase.table("profiles").insert(profile_data).execute()
+        response = await supabase.table("profiles").insert(profile_data).execute()
         
         if not response.data:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Profile not created")
@@ -65,14 +65,14 @@ async def create_profile(
 @router.get("/me", response_model=ProfileResponse)
 async def get_current_user_profile(
     current_user: dict = Depends(get_current_user),
-    supabase: Client = Depends(get_supabase_admin)
+    supabase: AsyncClient = Depends(get_supabase_admin)
 ):
     """
     Get the profile for the currently authenticated user.
     """
     user_id = current_user["id"]
     
-    response = supabase.table("profiles").select("*").eq("id", user_id).single().execute()
+    response = await supabase.table("profiles").select("*").eq("id", user_id).single().execute()
     
     if not response.data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found")
@@ -83,7 +83,7 @@ async def get_current_user_profile(
 async def update_current_user_profile(
     profile: ProfileUpdate,
     current_user: dict = Depends(get_current_user),
-    supabase: Client = Depends(get_supabase_admin)
+    supabase: AsyncClient = Depends(get_supabase_admin)
 ):
     """
     Update the profile for the currently authenticated user.
@@ -95,7 +95,7 @@ async def update_current_user_profile(
     if not update_data:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No fields to update")
         
-    response = supabase.table("profiles").update(update_data).eq("id", user_id).execute()
+    response = await supabase.table("profiles").update(update_data).eq("id", user_id).execute()
     
     if not response.data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found or no changes made")
@@ -0,0 +1,37 @@
+from pydantic import BaseModel, Field
+from typing import Any, Dict, List, Literal
+
+
+class ChatSessionCreate(BaseModel):
+    """Start a conversation about a note."""
+    note_id: str
+
+
+class ChatMessage(BaseModel):
+    """One turn of a conversation."""
+    role: Literal["user", "model"]
+    text: str
+    at: str
+
+
+class ChatMessageRequest(BaseModel):
+    """A new user message in a session."""
+    message: str = Field(..., min_length=1)
+
+
+class ChatSessionResponse(BaseModel):
+    """A conversation and its history, oldest first."""
+    id: str
+    note_id: str
+    context_cached: bool
+    messages: List[ChatMessage]
+    created_at: str
+    updated_at: str
+
+
+class ChatTurnResponse(BaseModel):
+    """The model's reply to one message."""
+    session_id: str
+    message: ChatMessage
+    model_used: str
+    metadata: Dict[str, Any] = {}
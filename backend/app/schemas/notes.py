@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
 from datetime import datetime
 
 class NoteCreate(BaseModel):
@@ -20,3 +20,44 @@ class NoteResponse(BaseModel):
     created_at: datetime
     updated_at: datetime
     basic_stats: Optional[dict] = None
+
+class NoteSummary(BaseModel):
+    id: str
+    user_id: str
+    title: str
+    preview: str
+    created_at: datetime
+    updated_at: datetime
+
+class NoteSearchResult(NoteResponse):
+    rank: float
+    snippet: str
+
+class NoteChangesResponse(BaseModel):
+    upserted: List[NoteResponse]
+    deleted: List[str]
+    next_cursor: str
+    has_more: bool
+
+class NoteBatchOperation(BaseModel):
+    op: Literal["create", "update", "delete"]
+    note_id: Optional[str] = None
+    title: Optional[str] = None
+    content: Optional[str] = None
+    basic_stats: Optional[dict] = None
+
+class NoteBatchRequest(BaseModel):
+    operations: List[NoteBatchOperation] = Field(..., min_length=1, max_length=500)
+
+class NoteBatchResult(BaseModel):
+    index: int
+    op: str
+    status: int
+    note_id: Optional[str] = None
+    note: Optional[NoteResponse] = None
+    error: Optional[str] = None
+
+class NoteBatchResponse(BaseModel):
+    results: List[NoteBatchResult]
+    succeeded: int
+    failed: int
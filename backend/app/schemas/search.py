@@ -0,0 +1,20 @@
+from pydantic import BaseModel
+from typing import List, Optional
+
+
+class HybridSearchResult(BaseModel):
+    """A note matched by keyword search, semantic search, or both."""
+    note_id: str
+    title: str
+    snippet: str
+    score: float
+    keyword_rank: Optional[int] = None
+    vector_rank: Optional[int] = None
+    similarity: Optional[float] = None
+    chunk_index: Optional[int] = None
+
+
+class HybridSearchResponse(BaseModel):
+    """Response model for hybrid search."""
+    results: List[HybridSearchResult]
+    count: int
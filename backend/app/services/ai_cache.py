@@ -0,0 +1,58 @@
+"""
+Cache of AI answers, so repeating a quick action on an unchanged note doesn't
+generate again.
+
+Entries are keyed on (user, note, hash of the note text, normalized prompt,
+model). Editing a note changes its hash, so stale answers can't be served;
+note writes also drop the note's entries right away to free the space.
+"""
+
+import hashlib
+import os
+from typing import Dict, Iterable, Optional
+
+from app.core.cache import TTLCache
+from app.core.embeddings import normalize_query
+
+# Cache size (entries) and lifetime of a cached answer
+AI_RESPONSE_CACHE_SIZE = int(os.environ.get("AI_RESPONSE_CACHE_SIZE", "1000"))
+AI_RESPONSE_CACHE_TTL_SECONDS = float(os.environ.get("AI_RESPONSE_CACHE_TTL_SECONDS", "86400"))
+
+ai_response_cache = TTLCache(max_size=AI_RESPONSE_CACHE_SIZE, ttl_seconds=AI_RESPONSE_CACHE_TTL_SECONDS)
+
+
+def note_text_hash(title: str, content: str) -> str:
+    """Fingerprint of a note's text; changes whenever the note is edited."""
+    return hashlib.sha256(f"{title}\0{content}".encode("utf-8")).hexdigest()
+
+
+def ai_cache_key(
+    user_id: Optional[str],
+    note_id: Optional[str],
+    title: str,
+    content: str,
+    prompt: str,
+    model: str
+) -> tuple:
+    """
+    Cache key for one AI request. user_id and note_id are None for inline
+    requests, which are then shared only by identical note text.
+    """
+    return (user_id, note_id, note_text_hash(title, content), normalize_query(prompt), model)
+
+
+def get_cached_answer(key: tuple) -> Optional[Dict]:
+    """Stored answer (result, processedAt, modelUsed, metadata) or None."""
+    return ai_response_cache.get(key)
+
+
+def store_answer(key: tuple, answer: Dict) -> None:
+    ai_response_cache.set(key, answer)
+
+
+def invalidate_notes(user_id: str, note_ids: Iterable[str]) -> None:
+    """Drop cached answers about notes that were just edited or deleted."""
+    note_ids = set(note_ids)
+    if not note_ids:
+        return
+    ai_response_cache.delete_where(lambda key: key[0] == user_id and key[1] in note_ids)
@@ -0,0 +1,252 @@
+"""
+Multi-turn chat about a note, with the conversation kept server-side.
+
+The note body is put in a Gemini context cache once per session (and again
+only when the note is edited or the cache expires), so a turn sends just
+the recent history and the new message. Notes too short for Gemini to
+cache are sent inline, which is cheap at that size.
+
+Users can only read and delete their sessions (see sql/ai_chat_sessions.sql).
+Rows are written with the service-role client, after the user's own client
+has confirmed they own the note or session. Turns are appended with the
+append_ai_chat_turn function, so concurrent turns don't drop each other's
+messages or leak a context cache.
+"""
+
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+import google.generativeai as genai
+from fastapi import HTTPException, status
+from google.api_core import exceptions as google_exceptions
+from postgrest import AsyncPostgrestClient
+
+from app.core.database import get_supabase_admin
+from app.core.embeddings import estimate_tokens
+from app.core.llm import (
+    GEMINI_CACHE_MIN_TOKENS, GEMINI_MODEL, LLM_TIMEOUT_SECONDS,
+    create_context_cache, delete_context_cache, get_cached_model, llm_bulkhead
+)
+from app.services.ai_cache import note_text_hash
+from app.services.ai_context import AIContextService
+from app.services.notes import parse_note_id
+
+# Lifetime of a note's context cache; Gemini bills cache storage per hour
+AI_CHAT_CACHE_TTL_SECONDS = int(os.environ.get("AI_CHAT_CACHE_TTL_SECONDS", "3600"))
+# Renew a cache this close to expiry rather than risk it lapsing mid-turn
+AI_CHAT_CACHE_REFRESH_MARGIN_SECONDS = 60
+# Most earlier messages sent with each turn, so cost per turn stays flat
+AI_CHAT_MAX_HISTORY_MESSAGES = int(os.environ.get("AI_CHAT_MAX_HISTORY_MESSAGES", "20"))
+
+SESSION_COLUMNS = "id, note_id, note_hash, cached_content, cache_expires_at, messages, created_at, updated_at"
+CHAT_SYSTEM_INSTRUCTION = (
+    "You are a helpful AI assistant built into a notes app. "
+    "Answer the user's questions about their note, which follows."
+)
+
+
+def _note_document(note: Dict) -> str:
+    return f"Note Title: {note['title']}\nNote Content:\n{note['content']}"
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class AIChatService:
+    """Service class for chat sessions about a note."""
+
+    @staticmethod
+    async def _cache_note(note: Dict) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Put a note in a context cache if it is long enough to be worth it.
+
+        Returns:
+            Tuple of (cache name, expiry), or (None, None) to send it inline
+        """
+        if estimate_tokens(note["content"]) < GEMINI_CACHE_MIN_TOKENS:
+            return None, None
+        try:
+            return await create_context_cache(
+                CHAT_SYSTEM_INSTRUCTION,
+                _note_document(note),
+                AI_CHAT_CACHE_TTL_SECONDS,
+                display_name=f"note-{note['id']}"
+            )
+        except Exception as e:
+            print(f"[AI-Chat] Context cache failed for note {note['id']}, sending inline: {e}")
+            return None, None
+
+    @staticmethod
+    def _cache_is_fresh(session: Dict, note_hash: str) -> bool:
+        """True if the session's cache holds this version of the note and won't lapse soon."""
+        if not session.get("cached_content") or session.get("note_hash") != note_hash:
+            return False
+        expires_at = datetime.fromisoformat(session["cache_expires_at"])
+        return expires_at - _now() > timedelta(seconds=AI_CHAT_CACHE_REFRESH_MARGIN_SECONDS)
+
+    @staticmethod
+    def _turn_contents(history: List[Dict], message: str) -> List[Dict]:
+        """Recent history plus the new message, in Gemini's content format."""
+        recent = history[-AI_CHAT_MAX_HISTORY_MESSAGES:] if AI_CHAT_MAX_HISTORY_MESSAGES > 0 else []
+        contents = [{"role": turn["role"], "parts": [turn["text"]]} for turn in recent]
+        contents.append({"role": "user", "parts": [message]})
+        return contents
+
+    @staticmethod
+    async def get_session(supabase: AsyncPostgrestClient, user_id: str, session_id: str) -> Dict:
+        """
+        Fetch a session row.
+
+        Raises:
+            HTTPException: 404 if the session doesn't exist
+        """
+        not_found = HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Chat session not found")
+        session_id = parse_note_id(session_id)
+        if session_id is None:
+            raise not_found
+        # limit(1) rather than single(): single() raises on zero rows
+        response = await supabase.table("ai_chat_sessions").select(SESSION_COLUMNS).eq("id", session_id).eq("user_id", user_id).limit(1).execute()
+        if not response.data:
+            raise not_found
+        return response.data[0]
+
+    @staticmethod
+    async def create_session(supabase: AsyncPostgrestClient, user_id: str, note_id: str) -> Dict:
+        """
+        Start a conversation about a note, caching the note body up front so
+        the first turn is already cheap.
+
+        Returns:
+            Dict: The new session row
+        """
+        # Loaded through the user's client, so this also checks they own the note
+        note = await AIContextService.load_note(supabase, user_id, note_id)
+        cache_name, expires_at = await AIChatService._cache_note(note)
+
+        try:
+            response = await get_supabase_admin().table("ai_chat_sessions").insert({
+                "user_id": user_id,
+                "note_id": note_id,
+                "note_hash": note_text_hash(note["title"], note["content"]),
+                "cached_content": cache_name,
+                "cache_expires_at": expires_at,
+                "messages": []
+            }).execute()
+        except Exception:
+            # No session will ever name this cache, so don't leave it billing
+            if cache_name:
+                await delete_context_cache(cache_name)
+            raise
+        if not response.data:
+            if cache_name:
+                await delete_context_cache(cache_name)
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to create chat session")
+        return response.data[0]
+
+    @staticmethod
+    async def send_message(
+        supabase: AsyncPostgrestClient,
+        user_id: str,
+        session_id: str,
+        message: str
+    ) -> Tuple[Dict, Dict]:
+        """
+        Answer one message and append both sides to the session.
+
+        The note is re-read each turn, so answers follow edits; the context
+        cache is rebuilt only when the note changed or the cache is about to
+        expire.
+
+        Returns:
+            Tuple of (reply message, metadata with context_cached and token counts)
+
+        Raises:
+            HTTPException: 404 if the session or its note doesn't exist
+            BulkheadFullError: If the LLM bulkhead sheds the call
+        """
+        session = await AIChatService.get_session(supabase, user_id, session_id)
+        note = await AIContextService.load_note(supabase, user_id, session["note_id"])
+        note_hash = note_text_hash(note["title"], note["content"])
+
+        previous_cache = session.get("cached_content")
+        cache_name = previous_cache
+        expires_at = session.get("cache_expires_at")
+        if not AIChatService._cache_is_fresh(session, note_hash):
+            cache_name, expires_at = await AIChatService._cache_note(note)
+
+        contents = AIChatService._turn_contents(session.get("messages") or [], message)
+        request_options = {"timeout": LLM_TIMEOUT_SECONDS}
+
+        async with llm_bulkhead.slot():
+            response = None
+            if cache_name:
+                try:
+                    model = await get_cached_model(cache_name)
+                    response = await model.generate_content_async(contents, request_options=request_options)
+                except google_exceptions.NotFound:
+                    # Expired or deleted on Gemini's side; answer inline this turn
+                    # and build a new cache on the next one
+                    print(f"[AI-Chat] Context cache {cache_name} is gone, sending note inline")
+                    cache_name, expires_at = None, None
+            if response is None:
+                model = genai.GenerativeModel(
+                    GEMINI_MODEL,
+                    system_instruction=f"{CHAT_SYSTEM_INSTRUCTION}\n\n{_note_document(note)}"
+                )
+                response = await model.generate_content_async(contents, request_options=request_options)
+
+        if not response.text:
+            raise ValueError("Empty response from AI")
+
+        at = _now().isoformat()
+        user_turn = {"role": "user", "text": message, "at": at}
+        reply = {"role": "model", "text": response.text, "at": at}
+        saved = await get_supabase_admin().rpc("append_ai_chat_turn", {
+            "p_session_id": session["id"],
+            "p_user_id": user_id,
+            "p_messages": [user_turn, reply],
+            "p_expected_cache": previous_cache,
+            "p_note_hash": note_hash,
+            "p_cached_content": cache_name,
+            "p_cache_expires_at": expires_at
+        }).execute()
+        built_cache = cache_name if cache_name != previous_cache else None
+        if not saved.data:
+            # Session deleted mid-turn
+            if built_cache:
+                await delete_context_cache(built_cache)
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Chat session not found")
+        if saved.data[0]["cache_swapped"]:
+            if previous_cache and previous_cache != cache_name:
+                await delete_context_cache(previous_cache)
+        elif built_cache:
+            # Another turn switched the session's cache first; ours is unused
+            await delete_context_cache(built_cache)
+
+        usage = getattr(response, "usage_metadata", None)
+        metadata = {
+            "context_cached": cache_name is not None,
+            "prompt_tokens": getattr(usage, "prompt_token_count", None),
+            "cached_tokens": getattr(usage, "cached_content_token_count", None)
+        }
+        return reply, metadata
+
+    @staticmethod
+    async def delete_session(supabase: AsyncPostgrestClient, user_id: str, session_id: str) -> None:
+        """
+        Delete a session and release its context cache.
+
+        Raises:
+            HTTPException: 404 if the session doesn't exist
+        """
+        session_id = parse_note_id(session_id)
+        if session_id is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Chat session not found")
+        response = await supabase.table("ai_chat_sessions").delete().eq("id", session_id).eq("user_id", user_id).execute()
+        if not response.data:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Chat session not found")
+        cache_name = response.data[0].get("cached_content")
+        if cache_name:
+            await delete_context_cache(cache_name)
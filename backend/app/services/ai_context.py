@@ -0,0 +1,117 @@
+"""
+Server-side context assembly for AI requests on a stored note.
+
+Short notes go into the prompt whole. Notes over the token budget are cut
+down to the chunks most relevant to the user's request, so prompt size
+tracks the budget rather than the note.
+"""
+
+import os
+from typing import Dict, List
+
+from fastapi import HTTPException, status
+from postgrest import AsyncPostgrestClient
+
+from app.core.embeddings import CHARS_PER_TOKEN, embed_query, estimate_tokens
+from app.services.notes import parse_note_id
+
+# Most tokens of note text to put in a prompt
+AI_CONTEXT_TOKEN_BUDGET = int(os.environ.get("AI_CONTEXT_TOKEN_BUDGET", "6000"))
+# Candidate chunks to rank when a note is over budget
+AI_CONTEXT_MAX_CHUNKS = 50
+CHUNK_SEPARATOR = "\n\n[...]\n\n"
+
+
+class AIContextService:
+    """Service class for building AI prompt context from notes."""
+
+    @staticmethod
+    def _fit_chunks(chunks: List[Dict], budget: int) -> List[Dict]:
+        """
+        Take chunks best first while they fit the budget, then put them back
+        in document order so the excerpt reads naturally.
+        """
+        selected = []
+        used = 0
+        for chunk in chunks:
+            tokens = estimate_tokens(chunk["content"])
+            if used + tokens > budget:
+                continue
+            selected.append(chunk)
+            used += tokens
+        return sorted(selected, key=lambda chunk: chunk["chunk_index"])
+
+    @staticmethod
+    def _truncate(content: str, budget: int) -> str:
+        """First part of a note that fits the budget, cut at a paragraph if possible."""
+        limit = budget * CHARS_PER_TOKEN
+        if len(content) <= limit:
+            return content
+        head = content[:limit]
+        cut = head.rfind("\n\n")
+        return head[:cut] if cut > limit // 2 else head
+
+    @staticmethod
+    async def load_note(supabase: AsyncPostgrestClient, user_id: str, note_id: str) -> Dict:
+        """
+        Fetch the note an AI request is about.
+
+        Raises:
+            HTTPException: 404 if the note doesn't exist, isn't the user's, or
+            the id isn't a UUID
+        """
+        not_found = HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Note not found")
+        note_id = parse_note_id(note_id)
+        if note_id is None:
+            raise not_found
+        # limit(1) rather than single(): single() raises on zero rows
+        response = await supabase.table("notes").select("id, title, content, updated_at").eq("id", note_id).eq("user_id", user_id).limit(1).execute()
+        if not response.data:
+            raise not_found
+        return response.data[0]
+
+    @staticmethod
+    async def build_note_context(
+        supabase: AsyncPostgrestClient,
+        note: Dict,
+        user_prompt: str,
+        budget: int = AI_CONTEXT_TOKEN_BUDGET
+    ) -> Dict:
+        """
+        Choose the text of a note to send with the user's request.
+
+        Args:
+            supabase: Authenticated Supabase client
+            note: Note from load_note
+            user_prompt: The request, used to rank chunks of long notes
+            budget: Maximum estimated tokens of note text
+
+        Returns:
+            Dict: title, content (the text to use), updated_at, and strategy:
+            "full", "chunks" (most relevant chunks) or "truncated" (over
+            budget with no stored chunks to rank)
+        """
+        context = {"title": note["title"], "updated_at": note["updated_at"]}
+        if estimate_tokens(note["content"]) <= budget:
+            return {**context, "content": note["content"], "strategy": "full"}
+
+        try:
+            query_embedding = await embed_query(user_prompt)
+            result = await supabase.rpc(
+                "match_note_chunks",
+                {
+                    "p_note_id": note["id"],
+                    "query_embedding": query_embedding,
+                    "match_count": AI_CONTEXT_MAX_CHUNKS
+                }
+            ).execute()
+            chunks = AIContextService._fit_chunks(result.data or [], budget)
+        except Exception as e:
+            print(f"[AI-Context] Chunk ranking failed for note {note['id']}, truncating: {e}")
+            chunks = []
+
+        if chunks:
+            content = CHUNK_SEPARATOR.join(chunk["content"] for chunk in chunks)
+            return {**context, "content": content, "strategy": "chunks"}
+
+        return {**context, "content": AIContextService._truncate(note["content"], budget), "strategy": "truncated"}
@@ -0,0 +1,261 @@
+"""
+Background embedding pipeline for note saves.
+Takes embedding work off the request path and coalesces rapid successive
+saves of the same note into a single embed of the latest version.
+
+Every scheduled version of a note gets a sequence number, and chunk writes
+for a note happen under that note's lock, and only if their version is still
+the latest one scheduled. Single-note and batch embeds of the same note
+therefore never overlap, and an older version can't land after a newer one.
+"""
+
+import asyncio
+import os
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from postgrest import AsyncPostgrestClient
+
+from app.services.embeddings import EmbeddingService
+
+# Quiet period after the last save before a note is embedded
+EMBED_DEBOUNCE_SECONDS = float(os.environ.get("EMBED_DEBOUNCE_SECONDS", "2.0"))
+# Upper bound on how long continuous saves can postpone an embed
+EMBED_MAX_DELAY_SECONDS = float(os.environ.get("EMBED_MAX_DELAY_SECONDS", "30.0"))
+
+
+class EmbeddingQueue:
+    """Debounced, per-note background embedding of saved notes."""
+
+    def __init__(
+        self,
+        debounce_seconds: float = EMBED_DEBOUNCE_SECONDS,
+        max_delay_seconds: float = EMBED_MAX_DELAY_SECONDS
+    ):
+        """
+        Initialize the queue.
+
+        Args:
+            debounce_seconds: Wait this long after the last save of a note
+            max_delay_seconds: Never wait longer than this after the first save
+        """
+        self.debounce_seconds = debounce_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self._pending: Dict[str, dict] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._batch_tasks: Set[asyncio.Task] = set()
+        # note_id -> {"seq": latest scheduled version, "lock": write lock}
+        self._versions: Dict[str, dict] = {}
+        self._seq = 0
+        self._flushing = asyncio.Event()
+
+    def _next_version(self, note_id: str) -> int:
+        """Record a newly scheduled version of a note and return its number."""
+        self._seq += 1
+        entry = self._versions.get(note_id)
+        if entry is None:
+            self._versions[note_id] = {"seq": self._seq, "lock": asyncio.Lock()}
+        else:
+            entry["seq"] = self._seq
+        return self._seq
+
+    async def _write_latest(
+        self,
+        versions: Dict[str, int],
+        write: Callable[[List[str]], Awaitable[None]]
+    ) -> None:
+        """
+        Run write for the notes whose given version is still the latest, holding
+        their locks (taken in id order, so concurrent batches can't deadlock).
+        Older versions are skipped: a newer one is queued and will be written.
+        """
+        locks = []
+        for note_id in sorted(versions):
+            entry = self._versions.get(note_id)
+            if entry is not None and entry["seq"] == versions[note_id]:
+                locks.append(entry["lock"])
+        for lock in locks:
+            await lock.acquire()
+        try:
+            fresh = [
+                note_id for note_id, seq in versions.items()
+                if note_id in self._versions and self._versions[note_id]["seq"] == seq
+            ]
+            if fresh:
+                await write(fresh)
+        finally:
+            for lock in locks:
+                lock.release()
+            for note_id, seq in versions.items():
+                entry = self._versions.get(note_id)
+                # Nothing newer queued: this note needs no more tracking
+                if entry is not None and entry["seq"] == seq and not entry["lock"].locked():
+                    del self._versions[note_id]
+
+    def schedule(
+        self,
+        supabase: AsyncPostgrestClient,
+        user_id: str,
+        note_id: str,
+        title: str,
+        content: str
+    ) -> None:
+        """
+        Queue a note for embedding, replacing any pending version of it.
+        Returns immediately; the embed runs once saves go quiet.
+        """
+        now = asyncio.get_running_loop().time()
+        previous = self._pending.get(note_id)
+        first_seen = previous["first_seen"] if previous else now
+        due = min(now + self.debounce_seconds, first_seen + self.max_delay_seconds)
+        if self._flushing.is_set():
+            due = now
+
+        self._pending[note_id] = {
+            "supabase": supabase,
+            "user_id": user_id,
+            "title": title,
+            "content": content,
+            "first_seen": first_seen,
+            "due": due,
+            "seq": self._next_version(note_id),
+        }
+
+        # One worker per note coalesces its saves; the note's lock keeps its
+        # writes sequential with batch embeds too
+        if note_id not in self._tasks:
+            self._tasks[note_id] = asyncio.create_task(self._run(note_id))
+
+    def schedule_batch(
+        self,
+        supabase: AsyncPostgrestClient,
+        user_id: str,
+        notes: List[Dict]
+    ) -> None:
+        """
+        Embed many notes at once (dicts with id, title, content), packing their
+        chunks into shared provider calls. Starts immediately, in the background;
+        supersedes any debounced embeds still pending for the same notes, and
+        waits for any already running.
+        """
+        if not notes:
+            return
+        versions = {}
+        for note in notes:
+            self._pending.pop(note["id"], None)
+            versions[note["id"]] = self._next_version(note["id"])
+
+        task = asyncio.create_task(self._run_batch(supabase, user_id, notes, versions))
+        self._batch_tasks.add(task)
+        task.add_done_callback(self._batch_tasks.discard)
+
+    async def embed_now(
+        self,
+        supabase: AsyncPostgrestClient,
+        user_id: str,
+        note_id: str,
+        title: str,
+        content: str,
+        chunk_size: int = 1000
+    ) -> Optional[List[Dict]]:
+        """
+        Embed a note right away, in the caller's task, as the note's newest
+        version: supersedes a debounced embed still pending for it and waits
+        for any already running.
+
+        Returns:
+            The embedded chunks, or None if a newer save of the note was
+            queued meanwhile (that version is written instead)
+        """
+        self._pending.pop(note_id, None)
+        chunks = None
+
+        async def write(_):
+            nonlocal chunks
+            chunks = await EmbeddingService.embed_note(
+                supabase=supabase,
+                user_id=user_id,
+                note_id=note_id,
+                title=title,
+                content=content,
+                chunk_size=chunk_size
+            )
+
+        await self._write_latest({note_id: self._next_version(note_id)}, write)
+        return chunks
+
+    def pending_count(self) -> int:
+        """Number of notes waiting to be embedded."""
+        return len(self._pending)
+
+    async def _run(self, note_id: str) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            while note_id in self._pending:
+                delay = self._pending[note_id]["due"] - loop.time()
+                if delay > 0:
+                    # Sleep until due, or until a flush makes everything due now
+                    try:
+                        await asyncio.wait_for(self._flushing.wait(), timeout=delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                job = self._pending.pop(note_id)
+
+                async def write(_, job=job):
+                    await EmbeddingService.embed_note(
+                        supabase=job["supabase"],
+                        user_id=job["user_id"],
+                        note_id=note_id,
+                        title=job["title"],
+                        content=job["content"]
+                    )
+
+                try:
+                    await self._write_latest({note_id: job["seq"]}, write)
+                except Exception as e:
+                    print(f"[Embed-Queue] ERROR embedding note {note_id}: {e}")
+        finally:
+            self._tasks.pop(note_id, None)
+
+    async def _run_batch(
+        self,
+        supabase: AsyncPostgrestClient,
+        user_id: str,
+        notes: List[Dict],
+        versions: Dict[str, int]
+    ) -> None:
+        async def write(fresh: List[str]) -> None:
+            keep = set(fresh)
+            batch = [note for note in notes if note["id"] in keep]
+            result = await EmbeddingService.embed_notes(supabase, user_id, batch)
+            if result["failed_notes"]:
+                print(f"[Embed-Queue] {result['failed_notes']} of {len(batch)} notes failed to embed: {result['errors']}")
+
+        try:
+            await self._write_latest(versions, write)
+        except Exception as e:
+            print(f"[Embed-Queue] ERROR embedding batch of {len(notes)} notes: {e}")
+
+    async def flush(self, timeout: Optional[float] = None) -> None:
+        """
+        Embed everything pending now instead of waiting for the debounce.
+        Called on application shutdown.
+
+        Args:
+            timeout: Maximum seconds to wait for outstanding embeds
+        """
+        self._flushing.set()
+        try:
+            now = asyncio.get_running_loop().time()
+            for job in self._pending.values():
+                job["due"] = now
+
+            tasks = list(self._tasks.values()) + list(self._batch_tasks)
+            if tasks:
+                await asyncio.wait(tasks, timeout=timeout)
+        finally:
+            self._flushing.clear()
+
+
+embedding_queue = EmbeddingQueue()
@@ -1,15 +1,124 @@
+import asyncio
 from datetime import datetime
 from typing import List, Optional, Dict
-from supabase import Client
+from postgrest import AsyncPostgrestClient
 from fastapi import HTTPException, status
 
-from app.core.embeddings import prepare_note_for_embedding, embed_chunks, create_embedding
+from app.core.embeddings import (
+    prepare_note_for_embedding,
+    embed_chunks,
+    embed_query,
+    create_embeddings_batch,
+    chunk_content_hash,
+    EmbeddingBatchError,
+)
+from app.core.vector_index import vector_index
 from app.schemas.embeddings import EmbeddingResponse, VectorSearchResult, VectorSearchResponse
 
+# Page size for reading rows back from PostgREST (its default max-rows is 1000)
+FETCH_PAGE_SIZE = 1000
+# Hashes per `in` filter when looking up reusable vectors
+HASH_LOOKUP_BATCH = 100
+# Concurrent note_chunks writes during a bulk re-embed
+WRITE_CONCURRENCY = 8
+
+
 class EmbeddingService:
     @staticmethod
-    def embed_note(
-        supabase: Client,
+    def _diff_chunks(chunks: List[Dict], stored_rows: List[Dict]) -> List[Dict]:
+        """
+        Hash new chunks and return the ones whose stored row isn't already correct.
+        """
+        stored_by_index = {row["chunk_index"]: row for row in stored_rows}
+        
+        for chunk in chunks:
+            chunk["content_hash"] = chunk_content_hash(chunk["content"])
+        
+        return [
+            chunk for chunk in chunks
+            if not (
+                chunk["chunk_index"] in stored_by_index
+                and stored_by_index[chunk["chunk_index"]]["content_hash"] == chunk["content_hash"]
+                and stored_by_index[chunk["chunk_index"]]["total_chunks"] == chunk["total_chunks"]
+            )
+        ]
+
+    @staticmethod
+    async def _fetch_stored_embeddings(
+        supabase: AsyncPostgrestClient,
+        column: str,
+        value: str,
+        hashes: List[str]
+    ) -> Dict[str, object]:
+        """
+        Look up stored vectors by content hash, filtered on note_id or user_id.
+        """
+        stored_embeddings = {}
+        for i in range(0, len(hashes), HASH_LOOKUP_BATCH):
+            batch = hashes[i:i + HASH_LOOKUP_BATCH]
+            response = await supabase.table("note_chunks").select("content_hash, embedding").eq(column, value).in_("content_hash", batch).execute()
+            for row in (response.data or []):
+                if row.get("embedding") is not None:
+                    stored_embeddings[row["content_hash"]] = row["embedding"]
+        return stored_embeddings
+
+    @staticmethod
+    async def _write_chunks(
+        supabase: AsyncPostgrestClient,
+        user_id: str,
+        note_id: str,
+        changed_chunks: List[Dict],
+        total_chunks: int,
+        stored_count: int
+    ) -> None:
+        """
+        Upsert changed rows and drop surplus trailing rows in one transaction.
+        """
+        chunk_records = [
+            {
+                "chunk_index": chunk["chunk_index"],
+                "total_chunks": chunk["total_chunks"],
+                "content": chunk["content"],
+                "content_hash": chunk["content_hash"],
+                "embedding": chunk["embedding"]
+            }
+            for chunk in changed_chunks
+        ]
+        
+        if chunk_records or stored_count > total_chunks:
+            await supabase.rpc(
+                "sync_note_chunks",
+                {
+                    "p_note_id": note_id,
+                    "p_user_id": user_id,
+                    "p_chunks": chunk_records,
+                    "p_total_chunks": total_chunks
+                }
+            ).execute()
+            try:
+                await vector_index.note_changed(supabase, user_id, note_id)
+            except Exception as e:
+                print(f"[Vector-Index] ERROR refreshing note {note_id}: {e}")
+
+    @staticmethod
+    async def _fetch_all(query_factory) -> List[Dict]:
+        """
+        Read every row of a query, a page at a time.
+        query_factory must return a fresh, ordered query builder on each call.
+        """
+        rows = []
+        offset = 0
+        while True:
+            response = await query_factory().range(offset, offset + FETCH_PAGE_SIZE - 1).execute()
+            page = response.data or []
+            rows.extend(page)
+            if len(page) < FETCH_PAGE_SIZE:
+                return rows
+            offset += FETCH_PAGE_SIZE
+
+    @staticmethod
+    async def embed_note(
+        supabase: AsyncPostgrestClient,
         user_id: str,
         note_id: str,
         title: str,
@@ -18,6 +127,9 @@ class EmbeddingService:
     ) -> List[Dict]:
         """
         Embeds a single note.
+        Chunks whose text is unchanged since the last embed reuse their stored
+        vectors; only new or edited chunks are sent to OpenAI. Only rows that
+        actually changed are written, through one transactional RPC.
         """
         # Chunk the note content
         chunks = prepare_note_for_embedding(
@@ -29,33 +141,42 @@ class EmbeddingService:
         if not chunks:
             return []
         
-        # Embed all chunks
-        embedded_chunks = embed_chunks(chunks)
+        # Current rows for this note (without vectors, which are large)
+        existing = await supabase.table("note_chunks").select("chunk_index, total_chunks, content_hash").eq("note_id", note_id).execute()
+        stored_rows = existing.data or []
         
-        # Delete existing chunks for this note
-        supabase.table("note_chunks").delete().eq("note_id", note_id).execute()
+        # Rows that are already correct in place are left untouched
+        changed_chunks = EmbeddingService._diff_chunks(chunks, stored_rows)
         
-        # Store chunks in database
-        chunk_records = [
-            {
-                "note_id": note_id,
-                "user_id": user_id,
-                "chunk_index": chunk["chunk_index"],
-                "total_chunks": chunk["total_chunks"],
-                "content": chunk["content"],
-                "embedding": chunk["embedding"]
-            }
-            for chunk in embedded_chunks
-        ]
+        # Chunks that moved to a new index can reuse their stored vector
+        stored_hashes = {row["content_hash"] for row in stored_rows if row.get("content_hash")}
+        moved_hashes = list({chunk["content_hash"] for chunk in changed_chunks if chunk["content_hash"] in stored_hashes})
+        stored_embeddings = {}
+        if moved_hashes:
+            stored_embeddings = await EmbeddingService._fetch_stored_embeddings(
+                supabase, "note_id", note_id, moved_hashes
+            )
         
-        if chunk_records:
-            supabase.table("note_chunks").insert(chunk_records).execute()
+        # Embed only chunks whose content changed
+        new_chunks = []
+        for chunk in changed_chunks:
+            if chunk["content_hash"] in stored_embeddings:
+                chunk["embedding"] = stored_embeddings[chunk["content_hash"]]
+            else:
+                new_chunks.append(chunk)
+        
+        if new_chunks:
+            await embed_chunks(new_chunks)
+        
+        await EmbeddingService._write_chunks(
+            supabase, user_id, note_id, changed_chunks, len(chunks), len(stored_rows)
+        )
             
-        return embedded_chunks
+        return chunks
 
     @staticmethod
-    def embed_all_notes(
-        supabase: Client,
+    async def embed_all_notes(
+        supabase: AsyncPostgrestClient,
         user_id: str,
         chunk_size: int = 1000
     ) -> Dict:
@@ -64,40 +185,130 @@ class EmbeddingService:
         """
         print(f"[Embed-All] Starting embedding generation for user {user_id}")
         
-        # Fetch all notes
-        response = supabase.table("notes").select("*").eq("user_id", user_id).execute()
-        notes = response.data or []
+        # Fetch all notes and the metadata of every stored chunk
+        notes = await EmbeddingService._fetch_all(
+            lambda: supabase.table("notes").select("id, title, content").eq("user_id", user_id).order("id")
+        )
+        stored_chunk_rows = await EmbeddingService._fetch_all(
+            lambda: supabase.table("note_chunks").select("note_id, chunk_index, total_chunks, content_hash").eq("user_id", user_id).order("note_id").order("chunk_index")
+        )
         
         print(f"[Embed-All] Found {len(notes)} notes to process")
         
+        return await EmbeddingService.embed_notes(
+            supabase, user_id, notes, chunk_size=chunk_size, stored_chunk_rows=stored_chunk_rows
+        )
+
+    @staticmethod
+    async def embed_notes(
+        supabase: AsyncPostgrestClient,
+        user_id: str,
+        notes: List[Dict],
+        chunk_size: int = 1000,
+        stored_chunk_rows: Optional[List[Dict]] = None
+    ) -> Dict:
+        """
+        Embeds a set of notes (dicts with id, title, content) together.
+        Chunks from every note are pooled, deduplicated by content hash and
+        packed into provider-sized batches that are embedded concurrently;
+        the vectors are then scattered back and each note's rows written.
+        
+        stored_chunk_rows is the notes' current chunk metadata, fetched here
+        if not given.
+        """
+        if stored_chunk_rows is None:
+            stored_chunk_rows = []
+            note_ids = [note["id"] for note in notes]
+            for i in range(0, len(note_ids), HASH_LOOKUP_BATCH):
+                response = await supabase.table("note_chunks").select("note_id, chunk_index, total_chunks, content_hash").in_("note_id", note_ids[i:i + HASH_LOOKUP_BATCH]).execute()
+                stored_chunk_rows.extend(response.data or [])
+        
+        stored_by_note: Dict[str, List[Dict]] = {}
+        for row in stored_chunk_rows:
+            stored_by_note.setdefault(row["note_id"], []).append(row)
+        
+        # Plan every note: which rows need writing
+        plans = []
+        for note in notes:
+            chunks = prepare_note_for_embedding(
+                title=note.get("title", ""),
+                content=note["content"],
+                chunk_size=chunk_size
+            )
+            if not chunks:
+                continue
+            stored_rows = stored_by_note.get(note["id"], [])
+            plans.append({
+                "note_id": note["id"],
+                "chunks": chunks,
+                "changed": EmbeddingService._diff_chunks(chunks, stored_rows),
+                "stored_count": len(stored_rows)
+            })
+        
+        # Any vector already stored for this user can be reused, across notes
+        stored_hashes = {row["content_hash"] for row in stored_chunk_rows if row.get("content_hash")}
+        needed_hashes = {chunk["content_hash"] for plan in plans for chunk in plan["changed"]}
+        vectors = await EmbeddingService._fetch_stored_embeddings(
+            supabase, "user_id", user_id, list(needed_hashes & stored_hashes)
+        )
+        
+        # Embed each distinct new text once; the batch call packs them into
+        # provider-sized requests and sends those concurrently
+        new_texts = {}
+        for plan in plans:
+            for chunk in plan["changed"]:
+                if chunk["content_hash"] not in vectors:
+                    new_texts.setdefault(chunk["content_hash"], chunk["content"])
+        
+        new_hashes = list(new_texts)
+        print(f"[Embed-All] Embedding {len(new_hashes)} new chunks")
+        
+        batch_errors = {}
+        if new_hashes:
+            try:
+                embeddings = await create_embeddings_batch([new_texts[h] for h in new_hashes])
+            except EmbeddingBatchError as e:
+                # Keep what succeeded; only notes with failed chunks fail
+                embeddings = e.embeddings
+                batch_errors = {new_hashes[idx]: reason for idx, reason in e.failures.items()}
+            
+            for content_hash, embedding in zip(new_hashes, embeddings):
+                if embedding is not None:
+                    vectors[content_hash] = embedding
+        
+        # Scatter vectors back and write each note
         total_chunks = 0
         failed_count = 0
         errors = []
+        write_semaphore = asyncio.Semaphore(WRITE_CONCURRENCY)
         
-        for note in notes:
-            try:
-                # Reuse embed_note logic
-                chunks = EmbeddingService.embed_note(
-                    supabase=supabase,
-                    user_id=user_id,
-                    note_id=note["id"],
-                    title=note.get("title", ""),
-                    content=note["content"],
-                    chunk_size=chunk_size
+        async def write_note(plan: Dict) -> None:
+            for chunk in plan["changed"]:
+                if chunk["content_hash"] in batch_errors:
+                    raise Exception(batch_errors[chunk["content_hash"]])
+                chunk["embedding"] = vectors[chunk["content_hash"]]
+            async with write_semaphore:
+                await EmbeddingService._write_chunks(
+                    supabase, user_id, plan["note_id"], plan["changed"],
+                    len(plan["chunks"]), plan["stored_count"]
                 )
-                
-                count = len(chunks)
-                total_chunks += count
-                print(f"[Embed-All] Successfully stored {count} chunks for note {note['id']}")
-            
-            except Exception as e:
+        
+        write_results = await asyncio.gather(
+            *(write_note(plan) for plan in plans),
+            return_exceptions=True
+        )
+        
+        for plan, result in zip(plans, write_results):
+            if isinstance(result, Exception):
                 failed_count += 1
-                error_msg = str(e)
-                print(f"[Embed-All] ERROR processing note {note['id']}: {error_msg}")
+                error_msg = str(result)
+                print(f"[Embed-All] ERROR processing note {plan['note_id']}: {error_msg}")
                 errors.append({
-                    "note_id": note["id"],
+                    "note_id": plan["note_id"],
                     "error": error_msg
                 })
+            else:
+                total_chunks += len(plan["chunks"])
         
         return {
             "total_notes": len(notes),
@@ -107,8 +318,8 @@ class EmbeddingService:
         }
 
     @staticmethod
-    def vector_search(
-        supabase: Client,
+    async def vector_search(
+        supabase: AsyncPostgrestClient,
         user_id: str,
         query: str,
         limit: int = 10
@@ -116,22 +327,37 @@ class EmbeddingService:
         """
         Performs semantic search.
         """
-        # Create embedding for the search query
-        query_embedding = create_embedding(query)
-        
-        # Perform vector similarity search using RPC
-        result = supabase.rpc(
-            "search_note_chunks_by_embedding",
-            {
-                "query_embedding": query_embedding,
-                "user_id": user_id,
-                "search_limit": limit
-            }
-        ).execute()
+        # Create embedding for the search query (cached for repeat queries)
+        query_embedding = await embed_query(query)
+        return await EmbeddingService.search_by_embedding(supabase, user_id, query_embedding, limit)
+
+    @staticmethod
+    async def search_by_embedding(
+        supabase: AsyncPostgrestClient,
+        user_id: str,
+        query_embedding: List[float],
+        limit: int = 10
+    ) -> List[VectorSearchResult]:
+        """
+        Find the chunks closest to an already computed query embedding.
+        """
+        # Serve from the in-process index when this user's is resident
+        rows = await vector_index.search(supabase, user_id, query_embedding, limit)
+        if rows is None:
+            # Perform vector similarity search using RPC
+            result = await supabase.rpc(
+                "search_note_chunks_by_embedding",
+                {
+                    "query_embedding": query_embedding,
+                    "user_id": user_id,
+                    "search_limit": limit
+                }
+            ).execute()
+            rows = result.data
         
         search_results = []
-        if result.data:
-            for item in result.data:
+        if rows:
+            for item in rows:
                 search_results.append(
                     VectorSearchResult(
                         chunk_id=item["id"],
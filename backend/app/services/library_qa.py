@@ -0,0 +1,233 @@
+"""
+Question answering across a user's whole library.
+
+Retrieval, then map-reduce: the chunks closest to the question are grouped
+by note, each note gets its own short extraction call (run concurrently and
+relayed as they finish), and a final call combines the extracts into one
+answer. Work is bounded by the retrieval limit rather than the library
+size, and everything runs against one latency budget: map calls still
+running when their share of it is spent are dropped, and the answer is
+built from what finished.
+"""
+
+import asyncio
+import os
+import time
+from contextlib import aclosing
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, List, Tuple
+
+from postgrest import AsyncPostgrestClient
+
+from app.core.llm import (
+    GEMINI_MODEL, BulkheadFullError, get_gemini_model, llm_bulkhead, stream_text
+)
+from app.schemas.embeddings import VectorSearchResult
+from app.services.ai_context import CHUNK_SEPARATOR
+from app.services.embeddings import EmbeddingService
+
+# Chunks retrieved per question, and most notes they may spread over
+LIBRARY_QA_TOP_CHUNKS = int(os.environ.get("LIBRARY_QA_TOP_CHUNKS", "40"))
+LIBRARY_QA_MAX_NOTES = int(os.environ.get("LIBRARY_QA_MAX_NOTES", "8"))
+# Extraction calls in flight per question (on top of the LLM bulkhead)
+LIBRARY_QA_MAP_CONCURRENCY = int(os.environ.get("LIBRARY_QA_MAP_CONCURRENCY", "4"))
+# Total time for a question, and the part of it kept back for the reduce step
+LIBRARY_QA_BUDGET_SECONDS = float(os.environ.get("LIBRARY_QA_BUDGET_SECONDS", "30"))
+LIBRARY_QA_REDUCE_RESERVE_SECONDS = float(os.environ.get("LIBRARY_QA_REDUCE_RESERVE_SECONDS", "12"))
+
+# What an extraction call answers when the note has nothing relevant
+NOTHING_RELEVANT = "NONE"
+NO_RESULTS_ANSWER = "I couldn't find anything about that in your notes."
+
+
+def build_extract_prompt(question: str, title: str, excerpt: str) -> str:
+    return f"""
+        You are helping answer a question from a user's notes.
+
+        Question: {question}
+
+        Note Title: {title}
+        Excerpts:
+        {excerpt}
+
+        List only what these excerpts say that is relevant to the question, as
+        short bullet points that keep key facts, names and numbers. If nothing
+        is relevant, reply with exactly {NOTHING_RELEVANT}.
+        """
+
+
+def build_reduce_prompt(question: str, extracts: List[Dict]) -> str:
+    findings = "\n\n".join(f"From \"{extract['title']}\":\n{extract['text']}" for extract in extracts)
+    return f"""
+        You are a helpful AI assistant built into a notes app.
+
+        The user asked: {question}
+
+        Relevant points found in their notes:
+        {findings}
+
+        Answer the question using only these points. Mention which note each
+        part of the answer comes from by its title.
+        """
+
+
+def _remaining(deadline: float) -> float:
+    return max(0.0, deadline - time.monotonic())
+
+
+class LibraryQAService:
+    """Service class for questions over all of a user's notes."""
+
+    @staticmethod
+    def _group_by_note(chunks: List[VectorSearchResult], max_notes: int) -> List[Dict]:
+        """
+        Group retrieved chunks by note, best note first (by its best chunk),
+        with each note's chunks back in document order.
+        """
+        groups: Dict[str, Dict] = {}
+        for chunk in chunks:
+            group = groups.setdefault(chunk.note_id, {"note_id": chunk.note_id, "similarity": chunk.similarity, "chunks": []})
+            group["similarity"] = max(group["similarity"], chunk.similarity)
+            group["chunks"].append(chunk)
+
+        ranked = sorted(groups.values(), key=lambda group: group["similarity"], reverse=True)[:max_notes]
+        for group in ranked:
+            group["chunks"].sort(key=lambda chunk: chunk.chunk_index)
+        return ranked
+
+    @staticmethod
+    async def _extract(question: str, note: Dict, semaphore: asyncio.Semaphore, deadline: float) -> Dict:
+        """Map step for one note: what it says about the question."""
+        excerpt = CHUNK_SEPARATOR.join(chunk.content for chunk in note["chunks"])
+        prompt = build_extract_prompt(question, note["title"], excerpt)
+        async with semaphore:
+            async with llm_bulkhead.slot():
+                response = await get_gemini_model().generate_content_async(
+                    prompt, request_options={"timeout": max(1.0, _remaining(deadline))}
+                )
+        text = (response.text or "").strip()
+        return {**note, "text": "" if text.upper().startswith(NOTHING_RELEVANT) else text}
+
+    @staticmethod
+    async def ask(
+        supabase: AsyncPostgrestClient,
+        user_id: str,
+        question: str,
+        budget_seconds: float = LIBRARY_QA_BUDGET_SECONDS
+    ) -> AsyncIterator[Tuple[str, Dict]]:
+        """
+        Answer a question from the user's notes, as a stream of events.
+
+        Yields:
+            (event, data) pairs:
+                sources: {"notes": [{note_id, title, similarity}]} once retrieved
+                partial: {note_id, title, text} per note as its extraction finishes
+                chunk:   {"text": ...} pieces of the final answer
+                error:   {"detail": ...} if the answer can't be completed
+                done:    {processedAt, modelUsed, metadata} at the end
+        """
+        started = time.monotonic()
+        deadline = started + budget_seconds
+        map_deadline = deadline - min(LIBRARY_QA_REDUCE_RESERVE_SECONDS, budget_seconds / 2)
+        metadata = {"notesConsidered": 0, "notesAnswered": 0, "notesSkipped": 0, "timedOut": False}
+
+        def done():
+            metadata["elapsedMs"] = int((time.monotonic() - started) * 1000)
+            return ("done", {
+                "processedAt": datetime.now(timezone.utc).isoformat(),
+                "modelUsed": GEMINI_MODEL,
+                "metadata": metadata
+            })
+
+        # Retrieval: bounded by LIBRARY_QA_TOP_CHUNKS however large the library
+        chunks = await EmbeddingService.vector_search(supabase, user_id, question, limit=LIBRARY_QA_TOP_CHUNKS)
+        notes = LibraryQAService._group_by_note(chunks, LIBRARY_QA_MAX_NOTES)
+        if notes:
+            response = await supabase.table("notes").select("id, title").in_("id", [note["note_id"] for note in notes]).execute()
+            titles = {row["id"]: row["title"] for row in response.data or []}
+            for note in notes:
+                note["title"] = titles.get(note["note_id"], "")
+
+        metadata["notesConsidered"] = len(notes)
+        yield ("sources", {"notes": [
+            {"note_id": note["note_id"], "title": note["title"], "similarity": note["similarity"]}
+            for note in notes
+        ]})
+        if not notes:
+            yield ("chunk", {"text": NO_RESULTS_ANSWER})
+            yield done()
+            return
+
+        # Map: one extraction per note, relayed in the order they finish
+        semaphore = asyncio.Semaphore(LIBRARY_QA_MAP_CONCURRENCY)
+        pending = {
+            asyncio.create_task(LibraryQAService._extract(question, note, semaphore, map_deadline))
+            for note in notes
+        }
+        extracts = []
+        shed = 0
+        try:
+            while pending:
+                finished, pending = await asyncio.wait(
+                    pending, timeout=_remaining(map_deadline), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not finished:
+                    metadata["timedOut"] = True
+                    break
+                for task in finished:
+                    try:
+                        extract = task.result()
+                    except BulkheadFullError:
+                        shed += 1
+                        continue
+                    except Exception as e:
+                        print(f"[Library-QA] Extraction failed: {e}")
+                        continue
+                    if extract["text"]:
+                        extracts.append(extract)
+                        yield ("partial", {"note_id": extract["note_id"], "title": extract["title"], "text": extract["text"]})
+        finally:
+            # Over budget, or the client went away
+            for task in pending:
+                task.cancel()
+
+        metadata["notesAnswered"] = len(extracts)
+        metadata["notesSkipped"] = len(notes) - len(extracts)
+
+        if not extracts:
+            if shed:
+                yield ("error", {"detail": "AI is busy, try again shortly"})
+            else:
+                yield ("chunk", {"text": NO_RESULTS_ANSWER})
+            yield done()
+            return
+
+        # Reduce: stream the combined answer within what is left of the budget
+        prompt = build_reduce_prompt(question, extracts)
+        try:
+            async with llm_bulkhead.slot():
+                stream = await asyncio.wait_for(
+                    get_gemini_model().generate_content_async(
+                        prompt, stream=True, request_options={"timeout": max(1.0, _remaining(deadline))}
+                    ),
+                    timeout=_remaining(deadline)
+                )
+                # Leaving this block (time limit, or the client went away)
+                # cancels the gRPC call, see stream_text
+                async with aclosing(stream_text(stream)) as texts:
+                    while True:
+                        try:
+                            text = await asyncio.wait_for(texts.__anext__(), timeout=_remaining(deadline))
+                        except StopAsyncIteration:
+                            break
+                        yield ("chunk", {"text": text})
+        except asyncio.TimeoutError:
+            metadata["timedOut"] = True
+            yield ("error", {"detail": "Answer cut short by the time limit"})
+        except BulkheadFullError:
+            yield ("error", {"detail": "AI is busy, try again shortly"})
+        except Exception as e:
+            print(f"[Library-QA] Answer failed: {e}")
+            yield ("error", {"detail": str(e)})
+
+        yield done()
@@ -0,0 +1,176 @@
+"""
+Note write helpers shared by the single-note routes and the bulk endpoint.
+"""
+
+import uuid
+from typing import Dict, List, Optional
+
+from postgrest import AsyncPostgrestClient
+
+from app.core.vector_index import vector_index
+from app.schemas.notes import NoteBatchOperation, NoteBatchResult, NoteBatchResponse
+from app.services.ai_cache import invalidate_notes
+from app.services.embedding_queue import embedding_queue
+
+# HTTP-style status per operation kind on success
+BATCH_SUCCESS_STATUS = {"create": 201, "update": 200, "delete": 204}
+
+
+def parse_note_id(note_id: str) -> Optional[str]:
+    """Canonical form of a note id, or None if it isn't a UUID."""
+    try:
+        return str(uuid.UUID(note_id))
+    except (ValueError, TypeError, AttributeError):
+        return None
+
+
+def derive_title(title: Optional[str], content: str) -> str:
+    """Use the given title, else the first line of the content."""
+    if title:
+        return title
+    content_lines = content.strip().split('\n')
+    return content_lines[0][:100] or "Untitled Note"
+
+
+class NoteService:
+    """Service class for bulk note operations."""
+
+    @staticmethod
+    def _fold_operations(operations: List[NoteBatchOperation]):
+        """
+        Validate operations and merge repeated ones on the same note, in order,
+        so each note is touched at most once: later update fields win, and a
+        delete absorbs earlier updates.
+
+        Returns:
+            Tuple of (payload for apply_note_batch, original indexes per payload
+            idx, results already decided here)
+        """
+        payload: List[Dict] = []
+        members: Dict[int, List[int]] = {}
+        results: Dict[int, NoteBatchResult] = {}
+        by_note: Dict[str, Dict] = {}
+
+        for index, operation in enumerate(operations):
+            def reject(status: int, error: str) -> None:
+                results[index] = NoteBatchResult(
+                    index=index, op=operation.op, status=status, note_id=operation.note_id, error=error
+                )
+
+            if operation.op == "create":
+                if operation.content is None:
+                    reject(400, "content is required")
+                    continue
+                payload.append({
+                    "idx": index,
+                    "op": "create",
+                    "title": derive_title(operation.title, operation.content),
+                    "content": operation.content,
+                    "basic_stats": operation.basic_stats or {}
+                })
+                members[index] = [index]
+                continue
+
+            if not operation.note_id:
+                reject(400, "note_id is required")
+                continue
+            # Checked here, not in the schema, so one bad id fails only its own
+            # operation instead of the whole batch (or the database statement)
+            note_id = parse_note_id(operation.note_id)
+            if note_id is None:
+                reject(400, "note_id must be a UUID")
+                continue
+
+            fields = {
+                key: value
+                for key, value in operation.model_dump(exclude_unset=True, include={"title", "content", "basic_stats"}).items()
+                if value is not None or key == "basic_stats"
+            }
+            if operation.op == "update" and not fields:
+                reject(400, "No fields to update")
+                continue
+
+            folded = by_note.get(note_id)
+            if folded is None:
+                folded = {"idx": index, "op": operation.op, "note_id": note_id}
+                if operation.op == "update":
+                    folded.update(fields)
+                by_note[note_id] = folded
+                payload.append(folded)
+                members[index] = [index]
+            elif folded["op"] == "delete":
+                reject(404, "Note deleted earlier in this batch")
+            else:
+                if operation.op == "delete":
+                    for key in ("title", "content", "basic_stats"):
+                        folded.pop(key, None)
+                    folded["op"] = "delete"
+                else:
+                    folded.update(fields)
+                members[folded["idx"]].append(index)
+
+        return payload, members, results
+
+    @staticmethod
+    async def apply_batch(
+        supabase: AsyncPostgrestClient,
+        user_id: str,
+        operations: List[NoteBatchOperation]
+    ) -> NoteBatchResponse:
+        """
+        Apply many note operations in one database statement.
+
+        The statement is atomic: a database error applies nothing and is raised.
+        Operations that can't apply (invalid, or on a missing note) get their own
+        error result without affecting the rest. Repeated operations on one note
+        are applied together and share a result. Embeddings for every created
+        or edited note are computed together in the background.
+
+        Returns:
+            NoteBatchResponse: One result per operation, in request order
+        """
+        payload, members, results = NoteService._fold_operations(operations)
+
+        rows = {}
+        if payload:
+            response = await supabase.rpc(
+                "apply_note_batch",
+                {"p_user_id": user_id, "p_operations": payload}
+            ).execute()
+            rows = {row["idx"]: row for row in response.data or []}
+
+        to_embed = []
+        for folded in payload:
+            row = rows.get(folded["idx"])
+            for index in members[folded["idx"]]:
+                operation = operations[index]
+                if row is None:
+                    results[index] = NoteBatchResult(
+                        index=index, op=operation.op, status=404, note_id=operation.note_id, error="Note not found"
+                    )
+                    continue
+                note = {key: value for key, value in row.items() if key not in ("idx", "op")}
+                results[index] = NoteBatchResult(
+                    index=index,
+                    op=operation.op,
+                    status=BATCH_SUCCESS_STATUS[folded["op"]],
+                    note_id=row["id"],
+                    note=note if folded["op"] != "delete" else None
+                )
+
+            if row is None:
+                continue
+            if folded["op"] == "delete":
+                await vector_index.note_deleted(user_id, row["id"])
+            elif folded["op"] == "create" or "title" in folded or "content" in folded:
+                to_embed.append({"id": row["id"], "title": row["title"], "content": row["content"]})
+
+        invalidate_notes(user_id, [
+            rows[folded["idx"]]["id"] for folded in payload
+            if folded["op"] != "create" and folded["idx"] in rows
+        ])
+        embedding_queue.schedule_batch(supabase, user_id, to_embed)
+
+        ordered = [results[index] for index in range(len(operations))]
+        failed = sum(1 for result in ordered if result.status >= 400)
+        return NoteBatchResponse(results=ordered, succeeded=len(ordered) - failed, failed=failed)
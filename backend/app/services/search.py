@@ -0,0 +1,147 @@
+"""
+Note search: indexed full-text search, and hybrid keyword + semantic search
+fused with reciprocal rank fusion.
+"""
+
+import asyncio
+import os
+from typing import Dict, List
+
+from postgrest import AsyncPostgrestClient
+
+from app.core.embeddings import embed_query
+from app.schemas.search import HybridSearchResult
+from app.services.embeddings import EmbeddingService
+
+# RRF damping constant; 60 is the value from the original RRF paper
+RRF_K = int(os.environ.get("HYBRID_RRF_K", "60"))
+# Candidates taken from each retriever, relative to the requested page size
+HYBRID_CANDIDATE_FACTOR = 2
+HYBRID_MIN_CANDIDATES = 20
+# Vector search returns chunks; over-fetch so enough distinct notes remain
+CHUNKS_PER_NOTE_ESTIMATE = 3
+
+
+class SearchService:
+    """Service class for note search."""
+
+    @staticmethod
+    async def keyword_search(
+        supabase: AsyncPostgrestClient,
+        user_id: str,
+        query: str,
+        limit: int = 20,
+        offset: int = 0
+    ) -> List[Dict]:
+        """
+        Ranked full-text search over note titles and content.
+
+        Args:
+            supabase: Authenticated Supabase client
+            user_id: Owner of the notes
+            query: Web-search style query ("quoted phrases", -exclusions, or)
+            limit: Page size
+            offset: Number of results to skip
+
+        Returns:
+            List[Dict]: Note rows with rank and a highlighted snippet, best first
+        """
+        result = await supabase.rpc(
+            "search_notes_full_text",
+            {
+                "p_user_id": user_id,
+                "p_query": query,
+                "p_limit": limit,
+                "p_offset": offset
+            }
+        ).execute()
+
+        return result.data or []
+
+    @staticmethod
+    async def _semantic_search(
+        supabase: AsyncPostgrestClient,
+        user_id: str,
+        query: str,
+        limit: int
+    ) -> List[Dict]:
+        """Best chunk per note from vector search, best note first."""
+        query_embedding = await embed_query(query)
+        chunks = await EmbeddingService.search_by_embedding(
+            supabase, user_id, query_embedding, limit * CHUNKS_PER_NOTE_ESTIMATE
+        )
+
+        best: Dict[str, Dict] = {}
+        for chunk in chunks:
+            if chunk.note_id not in best:
+                best[chunk.note_id] = chunk.model_dump()
+        return list(best.values())[:limit]
+
+    @staticmethod
+    async def hybrid_search(
+        supabase: AsyncPostgrestClient,
+        user_id: str,
+        query: str,
+        limit: int = 10
+    ) -> List[HybridSearchResult]:
+        """
+        Keyword and semantic search run concurrently and fused with reciprocal
+        rank fusion: each note scores sum(1 / (RRF_K + rank)) over the lists it
+        appears in. If one retriever fails, results come from the other.
+
+        Args:
+            supabase: Authenticated Supabase client
+            user_id: Owner of the notes
+            query: Search text
+            limit: Maximum number of notes to return
+
+        Returns:
+            List[HybridSearchResult]: Notes, best first, with the best matching
+            chunk (or keyword snippet) as the snippet
+
+        Raises:
+            Exception: If both retrievers fail
+        """
+        candidates = max(limit * HYBRID_CANDIDATE_FACTOR, HYBRID_MIN_CANDIDATES)
+        keyword_hits, semantic_hits = await asyncio.gather(
+            SearchService.keyword_search(supabase, user_id, query, limit=candidates),
+            SearchService._semantic_search(supabase, user_id, query, candidates),
+            return_exceptions=True
+        )
+
+        if isinstance(keyword_hits, Exception) and isinstance(semantic_hits, Exception):
+            raise keyword_hits
+        if isinstance(keyword_hits, Exception):
+            print(f"[Hybrid-Search] Keyword search failed, using semantic only: {keyword_hits}")
+            keyword_hits = []
+        if isinstance(semantic_hits, Exception):
+            print(f"[Hybrid-Search] Semantic search failed, using keyword only: {semantic_hits}")
+            semantic_hits = []
+
+        fused: Dict[str, Dict] = {}
+        for rank, hit in enumerate(keyword_hits, start=1):
+            entry = fused.setdefault(hit["id"], {"note_id": hit["id"], "score": 0.0})
+            entry["score"] += 1.0 / (RRF_K + rank)
+            entry["keyword_rank"] = rank
+            entry["title"] = hit["title"]
+            entry["snippet"] = hit["snippet"]
+        for rank, hit in enumerate(semantic_hits, start=1):
+            entry = fused.setdefault(hit["note_id"], {"note_id": hit["note_id"], "score": 0.0})
+            entry["score"] += 1.0 / (RRF_K + rank)
+            entry["vector_rank"] = rank
+            entry["similarity"] = hit["similarity"]
+            entry["chunk_index"] = hit["chunk_index"]
+            # The best matching chunk beats a keyword headline as context
+            entry["snippet"] = hit["content"]
+
+        top = sorted(fused.values(), key=lambda e: e["score"], reverse=True)[:limit]
+
+        # Notes found only by vector search still need their titles
+        missing = [entry["note_id"] for entry in top if "title" not in entry]
+        if missing:
+            response = await supabase.table("notes").select("id, title").in_("id", missing).execute()
+            titles = {row["id"]: row["title"] for row in response.data or []}
+            for entry in top:
+                entry.setdefault("title", titles.get(entry["note_id"], ""))
+
+        return [HybridSearchResult(**entry) for entry in top]
@@ -10,6 +10,9 @@ DROP TRIGGER IF EXISTS notes_set_updated_at ON public.notes;
 DROP FUNCTION IF EXISTS public.set_current_timestamp_on_update();
 
 -- Drop tables last
+DROP TABLE IF EXISTS public.ai_chat_sessions;
+DROP TABLE IF EXISTS public.note_tombstones;
+DROP TABLE IF EXISTS public.note_sync_state;
 DROP TABLE IF EXISTS public.note_chunks;
 DROP TABLE IF EXISTS public.notes;
 DROP TABLE IF EXISTS public.profiles;
@@ -34,7 +37,15 @@ CREATE TABLE public.notes (
   content TEXT NOT NULL,
   created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
   updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
-  basic_stats JSONB
+  basic_stats JSONB,
+  change_seq BIGINT NOT NULL DEFAULT 0,
+  preview TEXT GENERATED ALWAYS AS (
+    left(btrim(regexp_replace(content, '\s+', ' ', 'g')), 200)
+  ) STORED,
+  search_vector TSVECTOR GENERATED ALWAYS AS (
+    setweight(to_tsvector('english'::regconfig, coalesce(title, '')), 'A') ||
+    setweight(to_tsvector('english'::regconfig, coalesce(content, '')), 'B')
+  ) STORED
 );
 
 -- Create note_chunks table for storing embeddings of chunks
@@ -45,13 +56,16 @@ CREATE TABLE public.note_chunks (
   chunk_index INT NOT NULL,
   total_chunks INT NOT NULL,
   content TEXT NOT NULL,
+  content_hash TEXT,
   embedding vector(1536),
   created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
   updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
 );
 
 -- Create indexes for efficient querying
-CREATE INDEX note_chunks_note_id_idx ON public.note_chunks(note_id);
+CREATE UNIQUE INDEX note_chunks_note_id_chunk_index_key ON public.note_chunks(note_id, chunk_index);
+CREATE INDEX notes_user_id_updated_at_id_idx ON public.notes(user_id, updated_at DESC, id);
+CREATE INDEX notes_search_vector_idx ON public.notes USING GIN (search_vector);
 CREATE INDEX note_chunks_user_id_idx ON public.note_chunks(user_id);
 CREATE INDEX note_chunks_embedding_idx ON public.note_chunks USING ivfflat (embedding vector_cosine_ops) WITH (lists = 100);
 
@@ -0,0 +1,94 @@
+"""
+Benchmark concurrent request throughput of the notes API on a single worker.
+
+Runs the app in-process and fires concurrent GET /notes/ requests against it.
+Supabase is replaced by a fake PostgREST transport that waits a fixed latency
+per query, so the numbers only measure how well one event loop overlaps I/O:
+
+- blocking: the fake query sleeps synchronously, which is what the old
+  synchronous supabase-py `.execute()` did inside our `async def` routes
+- async:    the fake query is awaited, like the async PostgREST client
+
+Usage:
+    python scripts/benchmark_concurrency.py [--requests 200] [--concurrency 50] [--latency 0.05]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("SUPABASE_URL", "https://benchmark.supabase.co")
+os.environ.setdefault("SUPABASE_ANON_KEY", "benchmark-anon-key")
+os.environ.setdefault("OPENAI_API_KEY", "benchmark-openai-key")
+
+import httpx
+
+from app.core import database
+from app.core.auth import get_current_user
+from app.main import app
+
+NOTE = {
+    "id": "note-1",
+    "user_id": "bench-user",
+    "title": "Benchmark note",
+    "content": "Lorem ipsum " * 50,
+    "created_at": "2024-01-01T00:00:00Z",
+    "updated_at": "2024-01-01T00:00:00Z",
+    "basic_stats": {},
+}
+
+
+def make_transport(mode: str, latency: float) -> httpx.MockTransport:
+    if mode == "blocking":
+        def handler(request: httpx.Request) -> httpx.Response:
+            time.sleep(latency)
+            return httpx.Response(200, json=[NOTE] * 20)
+    else:
+        async def handler(request: httpx.Request) -> httpx.Response:
+            await asyncio.sleep(latency)
+            return httpx.Response(200, json=[NOTE] * 20)
+    return httpx.MockTransport(handler)
+
+
+async def run(mode: str, total: int, concurrency: int, latency: float) -> float:
+    database._http_client = httpx.AsyncClient(transport=make_transport(mode, latency))
+    app.dependency_overrides[get_current_user] = lambda: {"id": "bench-user"}
+
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def one():
+            async with semaphore:
+                response = await client.get("/notes/", headers={"Authorization": "Bearer bench"})
+                response.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(total)))
+        elapsed = time.perf_counter() - start
+
+    await database.close_clients()
+    app.dependency_overrides.clear()
+    return total / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.05, help="simulated query latency in seconds")
+    args = parser.parse_args()
+
+    print(f"{args.requests} requests, concurrency {args.concurrency}, {args.latency * 1000:.0f}ms per query")
+    for mode in ("blocking", "async"):
+        throughput = asyncio.run(run(mode, args.requests, args.concurrency, args.latency))
+        print(f"  {mode:<9} {throughput:8.1f} req/s")
+
+
+if __name__ == "__main__":
+    main()
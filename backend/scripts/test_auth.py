@@ -18,7 +18,8 @@ sys.path.insert(0, str(backend_dir))
 # Load .env from backend directory
 load_dotenv(backend_dir / ".env")
 
-from app.core.database import get_supabase
+from supabase import create_client
+from app.core.database import SUPABASE_URL, SUPABASE_KEY
 
 def test_jwt_verification(token: str):
     """Test JWT token verification"""
@@ -27,7 +28,7 @@ def test_jwt_verification(token: str):
         print(f"Token: {token[:20]}...")
         
         # Get Supabase client
-        supabase = get_supabase()
+        supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
         print("✓ Supabase client created")
         
         # Verify token
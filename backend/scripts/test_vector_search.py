@@ -13,6 +13,7 @@ Usage:
     To get a valid user_id, create a user through your auth system first.
 """
 
+import asyncio
 import os
 import sys
 from dotenv import load_dotenv
@@ -20,12 +21,18 @@ from dotenv import load_dotenv
 # Add parent directory to path for imports
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from app.core.database import get_supabase_admin
-from app.core.embeddings import prepare_note_for_embedding, embed_chunks
+from supabase import create_client
+from app.core.database import SUPABASE_URL, SUPABASE_SERVICE_KEY
+from app.core.embeddings import prepare_note_for_embedding, embed_chunks, close_embedding_engine
 import uuid
 
 load_dotenv()
 
+
+def get_supabase_admin():
+    """Synchronous admin client for this script (the app itself uses the async one)."""
+    return create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+
 # Dummy data
 DUMMY_NOTES = [
     {
@@ -159,7 +166,7 @@ def create_test_user_and_notes(supabase, user_id: str):
     return response.data
 
 
-def embed_all_notes(supabase, user_id: str, notes: list):
+async def embed_all_notes(supabase, user_id: str, notes: list):
     """Embed all notes into chunks."""
     print(f"\n🔗 Embedding notes into chunks...")
     
@@ -178,7 +185,7 @@ def embed_all_notes(supabase, user_id: str, notes: list):
                 continue
             
             # Embed chunks
-            embedded_chunks = embed_chunks(chunks)
+            embedded_chunks = await embed_chunks(chunks)
             
             # Prepare records for database
             chunk_records = [
@@ -206,13 +213,13 @@ def embed_all_notes(supabase, user_id: str, notes: list):
     return total_chunks
 
 
-def perform_search(supabase, user_id: str, query: str):
+async def perform_search(supabase, user_id: str, query: str):
     """Perform a semantic search."""
     from app.core.embeddings import create_embedding
     
     try:
         # Create embedding for query
-        query_embedding = create_embedding(query)
+        query_embedding = await create_embedding(query)
         
         # Search
         result = supabase.rpc(
@@ -273,8 +280,12 @@ def get_or_create_test_user(supabase):
     sys.exit(1)
 
 
-def main():
-    """Main script execution."""
+async def main():
+    """
+    Main script execution. Runs on a single event loop: the embedding engine
+    is shared by the process and its HTTP pool is bound to the loop it was
+    first used on.
+    """
     print("=" * 80)
     print("Vector Embeddings Test Script")
     print("=" * 80)
@@ -297,7 +308,7 @@ def main():
     notes = create_test_user_and_notes(supabase, user_id)
     
     # Embed notes
-    total_chunks = embed_all_notes(supabase, user_id, notes)
+    total_chunks = await embed_all_notes(supabase, user_id, notes)
     
     # Perform searches
     print(f"\n{'=' * 80}")
@@ -305,7 +316,7 @@ def main():
     print(f"{'=' * 80}")
     
     for query in TEST_QUERIES:
-        results = perform_search(supabase, user_id, query)
+        results = await perform_search(supabase, user_id, query)
         display_results(query, results)
     
     # Summary
@@ -325,6 +336,8 @@ def main():
     print("✅ Test completed successfully!")
     print(f"{'=' * 80}\n")
 
+    await close_embedding_engine()
+
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
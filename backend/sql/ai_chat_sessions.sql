@@ -0,0 +1,105 @@
+-- Chat sessions about a note, with their history and Gemini context cache
+-- Run this in Supabase SQL Editor after running schema.sql (safe to re-run)
+--
+-- One row per conversation. messages is the turn history, oldest first, as
+-- [{"role": "user" | "model", "text": ..., "at": ...}]. cached_content names
+-- the Gemini cache holding the note body (NULL for notes too short to cache),
+-- and note_hash is the note text it was built from, so an edited note gets a
+-- fresh cache. Sessions go away with their note.
+--
+-- Users may read and delete their sessions but not write them: the history,
+-- cache name and note hash are set by the API (with the service key), so a
+-- client can't point a session at someone else's cache or forge a reply.
+--
+-- Turns are saved with append_ai_chat_turn rather than a plain UPDATE, so two
+-- turns answered at once both keep their messages (see below).
+
+CREATE TABLE IF NOT EXISTS public.ai_chat_sessions (
+  id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+  user_id UUID NOT NULL REFERENCES auth.users(id) ON DELETE CASCADE,
+  note_id UUID NOT NULL REFERENCES public.notes(id) ON DELETE CASCADE,
+  note_hash TEXT NOT NULL,
+  cached_content TEXT,
+  cache_expires_at TIMESTAMPTZ,
+  messages JSONB NOT NULL DEFAULT '[]'::jsonb,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS ai_chat_sessions_user_id_note_id_idx
+  ON public.ai_chat_sessions(user_id, note_id);
+
+DROP TRIGGER IF EXISTS ai_chat_sessions_set_updated_at ON public.ai_chat_sessions;
+CREATE TRIGGER ai_chat_sessions_set_updated_at
+BEFORE UPDATE ON public.ai_chat_sessions
+FOR EACH ROW
+EXECUTE FUNCTION public.set_current_timestamp_on_update();
+
+ALTER TABLE public.ai_chat_sessions ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Users can view their own chat sessions" ON public.ai_chat_sessions;
+CREATE POLICY "Users can view their own chat sessions"
+  ON public.ai_chat_sessions FOR SELECT
+  USING (auth.uid() = user_id);
+
+-- No INSERT or UPDATE policies: only the service role writes sessions
+DROP POLICY IF EXISTS "Users can insert their own chat sessions" ON public.ai_chat_sessions;
+DROP POLICY IF EXISTS "Users can update their own chat sessions" ON public.ai_chat_sessions;
+REVOKE INSERT, UPDATE ON public.ai_chat_sessions FROM anon, authenticated;
+
+DROP POLICY IF EXISTS "Users can delete their own chat sessions" ON public.ai_chat_sessions;
+CREATE POLICY "Users can delete their own chat sessions"
+  ON public.ai_chat_sessions FOR DELETE
+  USING (auth.uid() = user_id);
+
+-- Append one exchange to a session and, if the turn built a new context cache,
+-- switch the session to it. The row is locked, so concurrent turns append in
+-- turn instead of overwriting each other's history.
+--
+-- The cache is only switched if the session still names p_expected_cache (the
+-- cache the turn started from). Otherwise another turn has already switched
+-- it, and the caller should delete the cache it built instead.
+--
+-- Returns the session's cache before this call and whether it was replaced,
+-- or no row if the session is gone. Service role only.
+
+CREATE OR REPLACE FUNCTION append_ai_chat_turn(
+  p_session_id UUID,
+  p_user_id UUID,
+  p_messages JSONB,
+  p_expected_cache TEXT,
+  p_note_hash TEXT,
+  p_cached_content TEXT,
+  p_cache_expires_at TIMESTAMPTZ
+)
+RETURNS TABLE(previous_cache TEXT, cache_swapped BOOLEAN) AS $$
+DECLARE
+  v_current TEXT;
+BEGIN
+  SELECT s.cached_content INTO v_current
+  FROM public.ai_chat_sessions s
+  WHERE s.id = p_session_id AND s.user_id = p_user_id
+  FOR UPDATE;
+
+  IF NOT FOUND THEN
+    RETURN;
+  END IF;
+
+  IF v_current IS NOT DISTINCT FROM p_expected_cache THEN
+    UPDATE public.ai_chat_sessions s
+    SET messages = s.messages || p_messages,
+        note_hash = p_note_hash,
+        cached_content = p_cached_content,
+        cache_expires_at = p_cache_expires_at
+    WHERE s.id = p_session_id;
+    RETURN QUERY SELECT v_current, TRUE;
+  ELSE
+    UPDATE public.ai_chat_sessions s
+    SET messages = s.messages || p_messages
+    WHERE s.id = p_session_id;
+    RETURN QUERY SELECT v_current, FALSE;
+  END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+REVOKE EXECUTE ON FUNCTION append_ai_chat_turn(UUID, UUID, JSONB, TEXT, TEXT, TEXT, TIMESTAMPTZ) FROM PUBLIC, anon, authenticated;
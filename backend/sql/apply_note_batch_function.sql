@@ -0,0 +1,80 @@
+-- Bulk create/update/delete of notes in one statement
+-- Run this in Supabase SQL Editor after running schema.sql
+--
+-- p_operations is a JSON array of objects with idx, op ('create', 'update' or
+-- 'delete') and, depending on op, note_id, title, content and basic_stats.
+-- Updates only change the keys present on the object. Each note may appear at
+-- most once (the API folds repeated edits of a note before calling this).
+--
+-- Returns one row per operation that matched: created and updated notes with
+-- their new values, deleted notes with just their id. Operations on notes the
+-- caller doesn't own, or that don't exist, return no row. Runs with the
+-- caller's privileges, so RLS applies.
+
+CREATE OR REPLACE FUNCTION apply_note_batch(
+  p_user_id UUID,
+  p_operations JSONB
+)
+RETURNS TABLE(
+  idx INT,
+  op TEXT,
+  id UUID,
+  user_id UUID,
+  title TEXT,
+  content TEXT,
+  created_at TIMESTAMPTZ,
+  updated_at TIMESTAMPTZ,
+  basic_stats JSONB
+) AS $$
+#variable_conflict use_column
+BEGIN
+  RETURN QUERY
+  WITH ops AS (
+    SELECT
+      (o->>'idx')::INT AS idx,
+      o->>'op' AS op,
+      (o->>'note_id')::UUID AS note_id,
+      o
+    FROM jsonb_array_elements(p_operations) AS o
+  ),
+  creates AS (
+    SELECT ops.idx, gen_random_uuid() AS new_id, ops.o
+    FROM ops
+    WHERE ops.op = 'create'
+  ),
+  inserted AS (
+    INSERT INTO public.notes (id, user_id, title, content, basic_stats)
+    SELECT c.new_id, p_user_id, c.o->>'title', c.o->>'content', coalesce(c.o->'basic_stats', '{}'::jsonb)
+    FROM creates c
+    RETURNING notes.*
+  ),
+  updated AS (
+    UPDATE public.notes n
+    SET title = CASE WHEN u.o ? 'title' THEN u.o->>'title' ELSE n.title END,
+        content = CASE WHEN u.o ? 'content' THEN u.o->>'content' ELSE n.content END,
+        basic_stats = CASE WHEN u.o ? 'basic_stats' THEN u.o->'basic_stats' ELSE n.basic_stats END
+    FROM ops u
+    WHERE u.op = 'update'
+      AND n.id = u.note_id
+      AND n.user_id = p_user_id
+    RETURNING u.idx, n.*
+  ),
+  deleted AS (
+    DELETE FROM public.notes n
+    USING ops d
+    WHERE d.op = 'delete'
+      AND n.id = d.note_id
+      AND n.user_id = p_user_id
+    RETURNING d.idx, n.id
+  )
+  SELECT c.idx, 'create', i.id, i.user_id, i.title, i.content, i.created_at, i.updated_at, i.basic_stats
+  FROM inserted i
+  JOIN creates c ON c.new_id = i.id
+  UNION ALL
+  SELECT u.idx, 'update', u.id, u.user_id, u.title, u.content, u.created_at, u.updated_at, u.basic_stats
+  FROM updated u
+  UNION ALL
+  SELECT d.idx, 'delete', d.id, p_user_id, NULL, NULL, NULL, NULL, NULL
+  FROM deleted d;
+END;
+$$ LANGUAGE plpgsql;
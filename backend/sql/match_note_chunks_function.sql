@@ -0,0 +1,33 @@
+-- Rank one note's chunks against a query embedding
+-- Run this in Supabase SQL Editor after running schema.sql
+--
+-- Used to fit long notes into an AI prompt: only the chunks most relevant to
+-- the user's request are sent. Returns chunk text without the vectors. Runs
+-- with the caller's privileges, so RLS applies.
+
+CREATE OR REPLACE FUNCTION match_note_chunks(
+  p_note_id UUID,
+  query_embedding vector(1536),
+  match_count INT DEFAULT 20
+)
+RETURNS TABLE(
+  chunk_index INT,
+  content TEXT,
+  similarity FLOAT8
+) AS $$
+BEGIN
+  RETURN QUERY
+  SELECT
+    note_chunks.chunk_index,
+    note_chunks.content,
+    (1 - (note_chunks.embedding <=> query_embedding)) AS similarity
+  FROM public.note_chunks
+  WHERE note_chunks.note_id = p_note_id
+    AND note_chunks.embedding IS NOT NULL
+  -- Ordering by the output column rather than the <=> expression keeps the
+  -- planner off the approximate ivfflat index: this is an exact scan of one
+  -- note's chunks, found through the (note_id, chunk_index) index.
+  ORDER BY 3 DESC
+  LIMIT match_count;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,4 @@
+-- Per-chunk content hash so unchanged chunks can reuse their stored embedding
+-- Run this in Supabase SQL Editor on databases created before content_hash was added to schema.sql
+
+ALTER TABLE public.note_chunks ADD COLUMN IF NOT EXISTS content_hash TEXT;
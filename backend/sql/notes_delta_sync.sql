@@ -0,0 +1,159 @@
+-- Delta sync for notes: per-user change sequence, tombstones and a changes function
+-- Run this in Supabase SQL Editor after running schema.sql (safe to re-run)
+--
+-- Every insert or update of a note stamps it with the next value of its
+-- owner's change counter, and every delete records a tombstone with one. The
+-- counter row is locked until the writing transaction commits, so a user's
+-- sequence numbers become visible in order and a client that has seen
+-- change_seq N has seen every change up to N.
+--
+-- get_note_changes returns notes and tombstones after a given sequence number,
+-- and first drops the caller's tombstones older than the retention window.
+-- It runs with the caller's privileges, so RLS applies.
+
+ALTER TABLE public.notes ADD COLUMN IF NOT EXISTS change_seq BIGINT NOT NULL DEFAULT 0;
+
+-- No foreign keys to auth.users: deleting a user cascades to notes, whose
+-- delete trigger writes here, and that must not fail on the vanished user.
+CREATE TABLE IF NOT EXISTS public.note_sync_state (
+  user_id UUID PRIMARY KEY,
+  change_seq BIGINT NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS public.note_tombstones (
+  note_id UUID PRIMARY KEY,
+  user_id UUID NOT NULL,
+  change_seq BIGINT NOT NULL,
+  deleted_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS notes_user_id_change_seq_idx ON public.notes(user_id, change_seq);
+CREATE INDEX IF NOT EXISTS note_tombstones_user_id_change_seq_idx ON public.note_tombstones(user_id, change_seq);
+
+CREATE OR REPLACE FUNCTION public.next_note_change_seq(p_user_id UUID)
+RETURNS BIGINT
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+  seq BIGINT;
+BEGIN
+  INSERT INTO public.note_sync_state (user_id, change_seq)
+  VALUES (p_user_id, 1)
+  ON CONFLICT (user_id) DO UPDATE SET change_seq = note_sync_state.change_seq + 1
+  RETURNING change_seq INTO seq;
+  RETURN seq;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION public.set_note_change_seq()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+  NEW.change_seq = public.next_note_change_seq(NEW.user_id);
+  RETURN NEW;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION public.record_note_tombstone()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+  INSERT INTO public.note_tombstones (note_id, user_id, change_seq)
+  VALUES (OLD.id, OLD.user_id, public.next_note_change_seq(OLD.user_id))
+  ON CONFLICT (note_id) DO UPDATE
+    SET change_seq = EXCLUDED.change_seq,
+        deleted_at = EXCLUDED.deleted_at;
+  RETURN OLD;
+END;
+$$;
+
+-- Number existing notes per user in updated_at order, without touching updated_at
+ALTER TABLE public.notes DISABLE TRIGGER notes_set_updated_at;
+UPDATE public.notes n
+SET change_seq = numbered.seq
+FROM (
+  SELECT id, row_number() OVER (PARTITION BY user_id ORDER BY updated_at, id) AS seq
+  FROM public.notes
+) AS numbered
+WHERE n.id = numbered.id AND n.change_seq = 0;
+ALTER TABLE public.notes ENABLE TRIGGER notes_set_updated_at;
+
+INSERT INTO public.note_sync_state (user_id, change_seq)
+SELECT user_id, max(change_seq) FROM public.notes GROUP BY user_id
+ON CONFLICT (user_id) DO NOTHING;
+
+DROP TRIGGER IF EXISTS notes_set_change_seq ON public.notes;
+CREATE TRIGGER notes_set_change_seq
+BEFORE INSERT OR UPDATE ON public.notes
+FOR EACH ROW
+EXECUTE FUNCTION public.set_note_change_seq();
+
+DROP TRIGGER IF EXISTS notes_record_tombstone ON public.notes;
+CREATE TRIGGER notes_record_tombstone
+AFTER DELETE ON public.notes
+FOR EACH ROW
+EXECUTE FUNCTION public.record_note_tombstone();
+
+ALTER TABLE public.note_sync_state ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.note_tombstones ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Users can view their own sync state" ON public.note_sync_state;
+CREATE POLICY "Users can view their own sync state"
+  ON public.note_sync_state FOR SELECT
+  USING (auth.uid() = user_id);
+
+DROP POLICY IF EXISTS "Users can view their own tombstones" ON public.note_tombstones;
+CREATE POLICY "Users can view their own tombstones"
+  ON public.note_tombstones FOR SELECT
+  USING (auth.uid() = user_id);
+
+DROP POLICY IF EXISTS "Users can delete their own tombstones" ON public.note_tombstones;
+CREATE POLICY "Users can delete their own tombstones"
+  ON public.note_tombstones FOR DELETE
+  USING (auth.uid() = user_id);
+
+CREATE OR REPLACE FUNCTION get_note_changes(
+  p_user_id UUID,
+  p_since BIGINT,
+  p_limit INT DEFAULT 500,
+  p_retention_days INT DEFAULT 30
+)
+RETURNS TABLE(
+  change_seq BIGINT,
+  deleted BOOLEAN,
+  id UUID,
+  user_id UUID,
+  title TEXT,
+  content TEXT,
+  created_at TIMESTAMPTZ,
+  updated_at TIMESTAMPTZ,
+  basic_stats JSONB
+) AS $$
+#variable_conflict use_column
+BEGIN
+  DELETE FROM public.note_tombstones t
+  WHERE t.user_id = p_user_id
+    AND t.deleted_at < NOW() - make_interval(days => p_retention_days);
+
+  RETURN QUERY
+  SELECT * FROM (
+    SELECT n.change_seq, FALSE, n.id, n.user_id, n.title, n.content, n.created_at, n.updated_at, n.basic_stats
+    FROM public.notes n
+    WHERE n.user_id = p_user_id AND n.change_seq > p_since
+    UNION ALL
+    SELECT t.change_seq, TRUE, t.note_id, t.user_id, NULL, NULL, NULL, NULL, NULL
+    FROM public.note_tombstones t
+    WHERE t.user_id = p_user_id AND t.change_seq > p_since
+  ) AS changes
+  ORDER BY 1
+  LIMIT p_limit;
+END;
+$$ LANGUAGE plpgsql;
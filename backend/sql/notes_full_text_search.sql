@@ -0,0 +1,61 @@
+-- Indexed full-text search over notes
+-- Run this in Supabase SQL Editor after running schema.sql
+--
+-- Adds a generated tsvector column (title weighted above content) with a GIN
+-- index, and a ranked search function. Matching uses the index, and snippets
+-- are only built for the requested page, so cost tracks the number of hits
+-- rather than the size of the library. Runs with the caller's privileges, so
+-- RLS applies.
+
+ALTER TABLE public.notes ADD COLUMN IF NOT EXISTS search_vector TSVECTOR
+  GENERATED ALWAYS AS (
+    setweight(to_tsvector('english'::regconfig, coalesce(title, '')), 'A') ||
+    setweight(to_tsvector('english'::regconfig, coalesce(content, '')), 'B')
+  ) STORED;
+
+CREATE INDEX IF NOT EXISTS notes_search_vector_idx ON public.notes USING GIN (search_vector);
+
+CREATE OR REPLACE FUNCTION search_notes_full_text(
+  p_user_id UUID,
+  p_query TEXT,
+  p_limit INT DEFAULT 20,
+  p_offset INT DEFAULT 0
+)
+RETURNS TABLE(
+  id UUID,
+  user_id UUID,
+  title TEXT,
+  content TEXT,
+  created_at TIMESTAMPTZ,
+  updated_at TIMESTAMPTZ,
+  basic_stats JSONB,
+  rank FLOAT4,
+  snippet TEXT
+) AS $$
+#variable_conflict use_column
+DECLARE
+  q tsquery := websearch_to_tsquery('english', p_query);
+BEGIN
+  RETURN QUERY
+  SELECT
+    page.id,
+    page.user_id,
+    page.title,
+    page.content,
+    page.created_at,
+    page.updated_at,
+    page.basic_stats,
+    page.score,
+    ts_headline('english', page.content, q, 'MaxFragments=2, MinWords=5, MaxWords=20, StartSel=<b>, StopSel=</b>')
+  FROM (
+    SELECT n.*, ts_rank_cd(n.search_vector, q) AS score
+    FROM public.notes n
+    WHERE n.user_id = p_user_id
+      AND n.search_vector @@ q
+    ORDER BY score DESC, n.updated_at DESC, n.id
+    LIMIT p_limit
+    OFFSET p_offset
+  ) AS page
+  ORDER BY page.score DESC, page.updated_at DESC, page.id;
+END;
+$$ LANGUAGE plpgsql STABLE;
@@ -0,0 +1,8 @@
+-- Composite index for keyset pagination of a user's notes
+-- Run this in Supabase SQL Editor on databases created before it was added to schema.sql
+--
+-- Matches list_notes' ORDER BY updated_at DESC, id, so every page (first or
+-- fiftieth) is a short index range scan starting at the cursor.
+
+CREATE INDEX IF NOT EXISTS notes_user_id_updated_at_id_idx
+  ON public.notes(user_id, updated_at DESC, id);
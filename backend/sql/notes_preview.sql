@@ -0,0 +1,10 @@
+-- Fixed-length content preview for note list screens
+-- Run this in Supabase SQL Editor on databases created before preview was added to schema.sql
+--
+-- The first 200 characters of content with whitespace collapsed, computed on
+-- write so GET /notes/?view=summary can skip transferring full content.
+
+ALTER TABLE public.notes ADD COLUMN IF NOT EXISTS preview TEXT
+  GENERATED ALWAYS AS (
+    left(btrim(regexp_replace(content, '\s+', ' ', 'g')), 200)
+  ) STORED;
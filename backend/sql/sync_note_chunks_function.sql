@@ -0,0 +1,45 @@
+-- Incremental write path for note chunks
+-- Run this in Supabase SQL Editor after running schema.sql
+--
+-- Upserts the given chunks by (note_id, chunk_index) and deletes rows past the
+-- new chunk count, all in one transaction. Rows whose content and position are
+-- unchanged are never rewritten, so their ivfflat index entries stay put and a
+-- note is never left without chunks mid-update.
+--
+-- p_chunks is a JSON array of objects with chunk_index, total_chunks, content,
+-- content_hash and embedding. Runs with the caller's privileges, so RLS applies.
+
+CREATE UNIQUE INDEX IF NOT EXISTS note_chunks_note_id_chunk_index_key
+  ON public.note_chunks(note_id, chunk_index);
+
+CREATE OR REPLACE FUNCTION sync_note_chunks(
+  p_note_id UUID,
+  p_user_id UUID,
+  p_chunks JSONB,
+  p_total_chunks INT
+)
+RETURNS VOID AS $$
+BEGIN
+  INSERT INTO public.note_chunks (note_id, user_id, chunk_index, total_chunks, content, content_hash, embedding)
+  SELECT
+    p_note_id,
+    p_user_id,
+    (c->>'chunk_index')::INT,
+    (c->>'total_chunks')::INT,
+    c->>'content',
+    c->>'content_hash',
+    (c->>'embedding')::vector(1536)
+  FROM jsonb_array_elements(p_chunks) AS c
+  ON CONFLICT (note_id, chunk_index) DO UPDATE
+    SET total_chunks = EXCLUDED.total_chunks,
+        content = EXCLUDED.content,
+        content_hash = EXCLUDED.content_hash,
+        embedding = EXCLUDED.embedding
+    WHERE note_chunks.content_hash IS DISTINCT FROM EXCLUDED.content_hash
+       OR note_chunks.total_chunks IS DISTINCT FROM EXCLUDED.total_chunks;
+
+  DELETE FROM public.note_chunks
+  WHERE note_id = p_note_id
+    AND chunk_index >= p_total_chunks;
+END;
+$$ LANGUAGE plpgsql;
@@ -1,3 +1,4 @@
+from unittest.mock import patch
 from fastapi.testclient import TestClient
 
 def test_read_root(client: TestClient):
@@ -9,3 +10,16 @@ def test_health_check(client: TestClient):
     response = client.get("/health")
     assert response.status_code == 200
     assert response.json() == {"status": "healthy"}
+
+def test_metrics_hidden_by_default(client: TestClient):
+    response = client.get("/metrics")
+    assert response.status_code == 404
+
+def test_metrics(client: TestClient):
+    with patch("app.main.METRICS_ENABLED", True):
+        response = client.get("/metrics")
+    assert response.status_code == 200
+    assert "hits" in response.json()["query_embedding_cache"]
+    assert "users" in response.json()["vector_index"]
+    assert "hits" in response.json()["ai_response_cache"]
+    assert "waiting" in response.json()["llm_bulkhead"]
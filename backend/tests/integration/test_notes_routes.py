@@ -1,7 +1,9 @@
-from unittest.mock import MagicMock
+import time
+from unittest.mock import MagicMock, AsyncMock
 import pytest
 from app.main import app
 from app.core.auth import get_current_user, get_authenticated_client
+from app.core.pagination import encode_cursor, decode_cursor
 from fastapi.testclient import TestClient
 
 # Mock User
@@ -25,7 +27,7 @@ client = TestClient(app)
 def test_create_note():
     """Test creating a note via POST /notes/."""
     # Setup mock response for insert
-    mock_supabase.table.return_value.insert.return_value.execute.return_value.data = [{
+    mock_supabase.table.return_value.insert.return_value.execute = AsyncMock(return_value=MagicMock(data=[{
         "id": "note-123",
         "user_id": "test-user-id",
         "title": "Test Note",
@@ -33,7 +35,7 @@ def test_create_note():
         "created_at": "2024-01-01T00:00:00Z",
         "updated_at": "2024-01-01T00:00:00Z",
         "basic_stats": {}
-    }]
+    }]))
 
     response = client.post("/notes/", json={"title": "Test Note", "content": "This is a test note."})
     
@@ -51,7 +53,7 @@ def test_create_note():
 def test_get_notes():
     """Test retrieving notes via GET /notes/."""
     # Setup mock response for select
-    mock_supabase.table.return_value.select.return_value.eq.return_value.range.return_value.order.return_value.execute.return_value.data = [{
+    mock_supabase.table.return_value.select.return_value.eq.return_value.order.return_value.order.return_value.range.return_value.execute = AsyncMock(return_value=MagicMock(data=[{
         "id": "note-123",
         "user_id": "test-user-id",
         "title": "Test Note",
@@ -59,7 +61,7 @@ def test_get_notes():
         "created_at": "2024-01-01T00:00:00Z",
         "updated_at": "2024-01-01T00:00:00Z",
         "basic_stats": {}
-    }]
+    }]))
     
     response = client.get("/notes/")
     
@@ -67,8 +69,293 @@ def test_get_notes():
     data = response.json()
     assert len(data) == 1
     assert data[0]["id"] == "note-123"
+    # Short page: no further cursor
+    assert "x-next-cursor" not in response.headers
+
+def test_get_notes_with_cursor():
+    """Test keyset pagination via GET /notes/?cursor=..."""
+    note = {
+        "id": "note-456",
+        "user_id": "test-user-id",
+        "title": "Older Note",
+        "content": "Older.",
+        "created_at": "2024-01-01T00:00:00Z",
+        "updated_at": "2023-12-31T00:00:00Z",
+        "basic_stats": {}
+    }
+    filtered = mock_supabase.table.return_value.select.return_value.eq.return_value.or_
+    filtered.return_value.order.return_value.order.return_value.limit.return_value.execute = AsyncMock(return_value=MagicMock(data=[note]))
+    cursor = encode_cursor({"updated_at": "2024-01-01T00:00:00Z", "id": "0b6e2a36-9c0e-4d8e-8f4f-3f1f2b6f9a11"})
+
+    response = client.get("/notes/", params={"cursor": cursor, "limit": 1})
+
+    assert response.status_code == 200
+    assert response.json()[0]["id"] == "note-456"
+    assert filtered.call_args[0][0] == (
+        'updated_at.lt."2024-01-01T00:00:00+00:00",'
+        'and(updated_at.eq."2024-01-01T00:00:00+00:00",id.gt.0b6e2a36-9c0e-4d8e-8f4f-3f1f2b6f9a11)'
+    )
+    # Full page: cursor points at its last row
+    assert decode_cursor(response.headers["x-next-cursor"]) == {"updated_at": "2023-12-31T00:00:00Z", "id": "note-456"}
+
+def test_get_notes_invalid_cursor():
+    response = client.get("/notes/", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
+
+@pytest.mark.parametrize("position", [
+    {"updated_at": "2024-01-01T00:00:00Z", "id": "x),id.neq.null"},
+    {"updated_at": '2024-01-01",user_id.neq."x', "id": "0b6e2a36-9c0e-4d8e-8f4f-3f1f2b6f9a11"},
+    {"updated_at": 5, "id": "0b6e2a36-9c0e-4d8e-8f4f-3f1f2b6f9a11"},
+    {"updated_at": "2024-01-01T00:00:00Z", "id": ["0b6e2a36-9c0e-4d8e-8f4f-3f1f2b6f9a11"]},
+])
+def test_get_notes_cursor_values_must_be_timestamp_and_uuid(position):
+    filtered = mock_supabase.table.return_value.select.return_value.eq.return_value.or_
+    filtered.reset_mock()
+
+    response = client.get("/notes/", params={"cursor": encode_cursor(position)})
+
+    assert response.status_code == 400
+    filtered.assert_not_called()
 
 def test_create_note_no_content():
     """Test validation error when content is missing."""
     response = client.post("/notes/", json={"title": "Empty Note"})
     assert response.status_code == 422
+
+def test_search_notes():
+    """Test ranked keyword search via GET /notes/search."""
+    mock_supabase.rpc.return_value.execute = AsyncMock(return_value=MagicMock(data=[{
+        "id": "note-123",
+        "user_id": "test-user-id",
+        "title": "Test Note",
+        "content": "This is a test note.",
+        "created_at": "2024-01-01T00:00:00Z",
+        "updated_at": "2024-01-01T00:00:00Z",
+        "basic_stats": {},
+        "rank": 0.5,
+        "snippet": "This is a <b>test</b> note."
+    }]))
+
+    response = client.get("/notes/search", params={"q": "test", "limit": 10, "offset": 20})
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data[0]["snippet"] == "This is a <b>test</b> note."
+    name, params = mock_supabase.rpc.call_args[0]
+    assert name == "search_notes_full_text"
+    assert params == {"p_user_id": "test-user-id", "p_query": "test", "p_limit": 10, "p_offset": 20}
+
+def test_get_notes_summary_view():
+    """Test view=summary returns previews instead of content."""
+    listed = mock_supabase.table.return_value.select
+    listed.return_value.eq.return_value.order.return_value.order.return_value.range.return_value.execute = AsyncMock(return_value=MagicMock(data=[{
+        "id": "note-123",
+        "user_id": "test-user-id",
+        "title": "Test Note",
+        "preview": "This is a test note.",
+        "created_at": "2024-01-01T00:00:00Z",
+        "updated_at": "2024-01-01T00:00:00Z"
+    }]))
+
+    response = client.get("/notes/", params={"view": "summary"})
+
+    assert response.status_code == 200
+    assert listed.call_args[0][0] == "id, user_id, title, preview, created_at, updated_at"
+    assert response.json()[0]["preview"] == "This is a test note."
+    assert "content" not in response.json()[0]
+
+def test_get_notes_fields_projection():
+    """Test fields= selects only the requested columns (plus cursor keys)."""
+    listed = mock_supabase.table.return_value.select
+    listed.return_value.eq.return_value.order.return_value.order.return_value.range.return_value.execute = AsyncMock(return_value=MagicMock(data=[
+        {"id": "note-123", "updated_at": "2024-01-01T00:00:00Z", "title": "Test Note"}
+    ]))
+
+    response = client.get("/notes/", params={"fields": "title", "limit": 1})
+
+    assert response.status_code == 200
+    assert listed.call_args[0][0] == "id, updated_at, title"
+    assert response.json() == [{"id": "note-123", "updated_at": "2024-01-01T00:00:00Z", "title": "Test Note"}]
+    assert "x-next-cursor" in response.headers
+
+def test_get_notes_unknown_field():
+    response = client.get("/notes/", params={"fields": "title,search_vector"})
+    assert response.status_code == 400
+
+def test_get_note_changes():
+    """Test delta sync via GET /notes/changes."""
+    mock_supabase.rpc.return_value.execute = AsyncMock(return_value=MagicMock(data=[
+        {
+            "change_seq": 7,
+            "deleted": False,
+            "id": "note-123",
+            "user_id": "test-user-id",
+            "title": "Test Note",
+            "content": "This is a test note.",
+            "created_at": "2024-01-01T00:00:00Z",
+            "updated_at": "2024-01-01T00:00:00Z",
+            "basic_stats": {}
+        },
+        {"change_seq": 9, "deleted": True, "id": "note-456", "user_id": "test-user-id",
+         "title": None, "content": None, "created_at": None, "updated_at": None, "basic_stats": None},
+    ]))
+    since = encode_cursor({"seq": 5, "at": time.time() - 60})
+
+    response = client.get("/notes/changes", params={"since": since})
+
+    assert response.status_code == 200
+    data = response.json()
+    assert [note["id"] for note in data["upserted"]] == ["note-123"]
+    assert data["deleted"] == ["note-456"]
+    assert data["has_more"] is False
+    assert decode_cursor(data["next_cursor"])["seq"] == 9
+    name, params = mock_supabase.rpc.call_args[0]
+    assert name == "get_note_changes"
+    assert params["p_since"] == 5
+
+def test_get_note_changes_expired_cursor():
+    since = encode_cursor({"seq": 5, "at": time.time() - 365 * 86400})
+    response = client.get("/notes/changes", params={"since": since})
+    assert response.status_code == 410
+
+@pytest.mark.parametrize("position", [
+    {"seq": "x", "at": "y"},
+    {"seq": 5, "at": "y"},
+    {"seq": "5", "at": 1700000000},
+    {"seq": True, "at": 1700000000},
+    {"seq": 5, "at": None},
+])
+def test_get_note_changes_cursor_values_must_be_numbers(position):
+    response = client.get("/notes/changes", params={"since": encode_cursor(position)})
+    assert response.status_code == 400
+
+def test_batch_notes():
+    """Test bulk operations via POST /notes/batch."""
+    mock_supabase.rpc.return_value.execute = AsyncMock(return_value=MagicMock(data=[{
+        "idx": 0,
+        "op": "create",
+        "id": "note-789",
+        "user_id": "test-user-id",
+        "title": "Offline",
+        "content": "Offline",
+        "created_at": "2024-01-01T00:00:00Z",
+        "updated_at": "2024-01-01T00:00:00Z",
+        "basic_stats": {}
+    }]))
+
+    response = client.post("/notes/batch", json={"operations": [
+        {"op": "create", "content": "Offline"},
+        {"op": "delete", "note_id": "00000000-0000-4000-8000-000000000001"},
+        {"op": "delete", "note_id": "note-gone"}
+    ]})
+
+    assert response.status_code == 200
+    data = response.json()
+    assert [r["status"] for r in data["results"]] == [201, 404, 400]
+    assert data["results"][0]["note"]["id"] == "note-789"
+
+def test_get_note_etag_and_not_modified():
+    """Test GET /notes/{id} returns an ETag and honours If-None-Match."""
+    mock_supabase.table.return_value.select.return_value.eq.return_value.eq.return_value.single.return_value.execute = AsyncMock(return_value=MagicMock(data={
+        "id": "note-123",
+        "user_id": "test-user-id",
+        "title": "Test Note",
+        "content": "This is a test note.",
+        "created_at": "2024-01-01T00:00:00Z",
+        "updated_at": "2024-01-02T00:00:00Z",
+        "basic_stats": {}
+    }))
+
+    first = client.get("/notes/note-123")
+    etag = first.headers["etag"]
+    assert etag.startswith('W/"')
+
+    second = client.get("/notes/note-123", headers={"If-None-Match": etag})
+    assert second.status_code == 304
+    assert second.content == b""
+    assert second.headers["vary"] == "Accept, Authorization"
+    assert first.headers["vary"] == "Accept, Authorization"
+    assert first.headers["cache-control"] == "private, no-cache"
+
+    stale = client.get("/notes/note-123", headers={"If-None-Match": 'W/"something-else"'})
+    assert stale.status_code == 200
+
+def test_get_notes_not_modified_until_counter_changes():
+    """Test list ETags follow the per-user change counter."""
+    counter = mock_supabase.table.return_value.select.return_value.eq.return_value
+    counter.execute = AsyncMock(return_value=MagicMock(data=[{"change_seq": 41}]))
+    counter.order.return_value.order.return_value.range.return_value.execute = AsyncMock(return_value=MagicMock(data=[]))
+
+    etag = client.get("/notes/", params={"view": "summary"}).headers["etag"]
+    assert client.get("/notes/", params={"view": "summary"}, headers={"If-None-Match": etag}).status_code == 304
+    # Different parameters are a different representation
+    assert client.get("/notes/", headers={"If-None-Match": etag}).status_code == 200
+
+    counter.execute = AsyncMock(return_value=MagicMock(data=[{"change_seq": 42}]))
+    assert client.get("/notes/", params={"view": "summary"}, headers={"If-None-Match": etag}).status_code == 200
+
+def test_list_etag_differs_per_user():
+    """The same list state for two users must not share an ETag."""
+    counter = mock_supabase.table.return_value.select.return_value.eq.return_value
+    counter.execute = AsyncMock(return_value=MagicMock(data=[{"change_seq": 41}]))
+    counter.order.return_value.order.return_value.range.return_value.execute = AsyncMock(return_value=MagicMock(data=[]))
+
+    first = client.get("/notes/")
+    app.dependency_overrides[get_current_user] = lambda: {"id": "other-user-id"}
+    try:
+        other = client.get("/notes/", headers={"If-None-Match": first.headers["etag"]})
+    finally:
+        app.dependency_overrides[get_current_user] = override_get_current_user
+
+    assert other.status_code == 200
+    assert other.headers["etag"] != first.headers["etag"]
+    assert first.headers["vary"] == "Accept, Authorization"
+
+def test_etags_differ_per_negotiated_media_type():
+    """A JSON ETag must not revalidate a cached msgpack body, or the reverse."""
+    pytest.importorskip("msgpack")
+    msgpack_accept = {"Accept": "application/msgpack"}
+    counter = mock_supabase.table.return_value.select.return_value.eq.return_value
+    counter.execute = AsyncMock(return_value=MagicMock(data=[{"change_seq": 41}]))
+    counter.order.return_value.order.return_value.range.return_value.execute = AsyncMock(return_value=MagicMock(data=[]))
+
+    json_etag = client.get("/notes/").headers["etag"]
+    msgpack_etag = client.get("/notes/", headers=msgpack_accept).headers["etag"]
+    assert json_etag != msgpack_etag
+    assert client.get("/notes/", headers={**msgpack_accept, "If-None-Match": json_etag}).status_code == 200
+    assert client.get("/notes/", headers={**msgpack_accept, "If-None-Match": msgpack_etag}).status_code == 304
+
+    mock_supabase.table.return_value.select.return_value.eq.return_value.eq.return_value.single.return_value.execute = AsyncMock(
+        return_value=MagicMock(data={"id": "note-123", "updated_at": "2024-01-02T00:00:00Z"})
+    )
+    note_json_etag = client.get("/notes/note-123").headers["etag"]
+    note_msgpack_etag = client.get("/notes/note-123", headers=msgpack_accept).headers["etag"]
+    assert note_json_etag != note_msgpack_etag
+    assert client.get("/notes/note-123", headers={**msgpack_accept, "If-None-Match": note_json_etag}).status_code == 200
+
+def test_get_notes_msgpack_and_compression():
+    """Test msgpack negotiation and compression of large list bodies."""
+    msgpack = pytest.importorskip("msgpack")
+    notes = [{
+        "id": f"note-{i}",
+        "user_id": "test-user-id",
+        "title": "Test Note",
+        "content": "This is a test note. " * 20,
+        "created_at": "2024-01-01T00:00:00Z",
+        "updated_at": "2024-01-01T00:00:00Z",
+        "basic_stats": {}
+    } for i in range(50)]
+    listed = mock_supabase.table.return_value.select.return_value.eq.return_value
+    listed.order.return_value.order.return_value.range.return_value.execute = AsyncMock(return_value=MagicMock(data=notes))
+
+    response = client.get("/notes/", headers={"Accept": "application/msgpack", "Accept-Encoding": "gzip"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/msgpack"
+    assert response.headers["content-encoding"] == "gzip"
+    assert msgpack.unpackb(response.content) == notes
+
+    response = client.get("/notes/", headers={"Accept-Encoding": "identity"})
+    assert response.headers["content-type"] == "application/json"
+    assert "content-encoding" not in response.headers
+    assert response.json() == notes
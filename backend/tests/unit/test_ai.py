@@ -1,22 +1,33 @@
+import asyncio
 import pytest
 from unittest.mock import MagicMock, patch, AsyncMock
-from app.routes.ai import process_ai_request, AIProcessRequest
+from google.api_core.grpc_helpers_async import _WrappedUnaryStreamCall
+from google.generativeai import protos
+from google.generativeai.types.generation_types import AsyncGenerateContentResponse
+from app.routes.ai import process_ai_request, stream_ai_request, AIProcessRequest
+from app.core.llm import Bulkhead
+from app.services.ai_cache import ai_response_cache, invalidate_notes
 from fastapi import HTTPException
 
+@pytest.fixture(autouse=True)
+def clear_ai_response_cache():
+    ai_response_cache.clear()
+    yield
+    ai_response_cache.clear()
+
 @pytest.mark.asyncio
 async def test_process_ai_request_success():
-    # Patch the global variable 'api_key' in the module
-    # Patch the global variable 'api_key' in the module
-    with patch("app.routes.ai.api_key", "fake-api-key"):
+    # Patch the global variable 'GEMINI_API_KEY' in the module
+    with patch("app.routes.ai.GEMINI_API_KEY", "fake-api-key"):
         
-        # Mock GenAI
-        with patch("app.routes.ai.genai") as mock_genai:
+        # Mock the shared Gemini model
+        with patch("app.routes.ai.get_gemini_model") as mock_get_model:
             mock_model = MagicMock()
-            mock_genai.GenerativeModel.return_value = mock_model
+            mock_get_model.return_value = mock_model
             
             mock_response = MagicMock()
             mock_response.text = "AI Result"
-            mock_model.generate_content.return_value = mock_response
+            mock_model.generate_content_async = AsyncMock(return_value=mock_response)
             
             request = AIProcessRequest(
                 noteTitle="Title", 
@@ -37,9 +48,9 @@ async def test_process_ai_request_no_key():
     # If the test runner already imported it, patching os.environ now won't change the global var.
     # We'll rely on the logic inside the function, but wait, the function refers to the global `api_key`.
     # Let's see: `if not api_key: raise HTTPException`.
-    # We can try to patch `app.routes.ai.api_key`.
+    # We can try to patch `app.routes.ai.GEMINI_API_KEY`.
     
-    with patch("app.routes.ai.api_key", None):
+    with patch("app.routes.ai.GEMINI_API_KEY", None):
         request = AIProcessRequest(
             noteTitle="Title", 
             noteContent="Content", 
@@ -48,3 +59,172 @@ async def test_process_ai_request_no_key():
         with pytest.raises(HTTPException) as exc:
             await process_ai_request(request)
         assert exc.value.status_code == 503
+
+class FakeStream:
+    """Async iterable standing in for a streamed Gemini response."""
+    def __init__(self, texts):
+        self._texts = texts
+
+    async def __aiter__(self):
+        for text in self._texts:
+            yield MagicMock(text=text)
+
+def fake_model(stream):
+    mock_model = MagicMock()
+    mock_model.generate_content_async = AsyncMock(return_value=stream)
+    return mock_model
+
+@pytest.mark.asyncio
+async def test_stream_ai_request_relays_chunks_as_sse():
+    stream = FakeStream(["Hello", " world"])
+    request = AIProcessRequest(noteTitle="Title", noteContent="Content", userPrompt="Summarize")
+
+    with patch("app.routes.ai.GEMINI_API_KEY", "fake-api-key"), patch("app.routes.ai.get_gemini_model", return_value=fake_model(stream)):
+        response = await stream_ai_request(request)
+        events = [event async for event in response.body_iterator]
+
+    assert response.media_type == "text/event-stream"
+    assert events[0] == 'event: chunk\ndata: {"text": "Hello"}\n\n'
+    assert events[1] == 'event: chunk\ndata: {"text": " world"}\n\n'
+    assert events[2].startswith("event: done\n")
+
+class FakeGrpcCall:
+    """
+    gRPC streaming call: yields its chunks, then blocks on the next read.
+    Like grpc.aio, a read cancelled while pending cancels the call.
+    """
+    def __init__(self, texts):
+        self._texts = texts
+        self.cancelled = False
+
+    async def __aiter__(self):
+        for text in self._texts:
+            yield protos.GenerateContentResponse(candidates=[
+                protos.Candidate(content=protos.Content(role="model", parts=[protos.Part(text=text)]))
+            ])
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+    def cancel(self):
+        self.cancelled = True
+
+async def real_stream(call):
+    """What generate_content_async(stream=True) returns for this call."""
+    return await AsyncGenerateContentResponse.from_aiterator(_WrappedUnaryStreamCall().with_call(call))
+
+@pytest.mark.asyncio
+async def test_stream_ai_request_cancels_upstream_on_disconnect():
+    call = FakeGrpcCall(["one", "two"])
+    stream = await real_stream(call)
+    request = AIProcessRequest(noteTitle="Title", noteContent="Content", userPrompt="Summarize")
+
+    with patch("app.routes.ai.GEMINI_API_KEY", "fake-api-key"), patch("app.routes.ai.get_gemini_model", return_value=fake_model(stream)):
+        response = await stream_ai_request(request)
+        body = response.body_iterator
+        assert await body.__anext__() == 'event: chunk\ndata: {"text": "one"}\n\n'
+        # Generation is still running; Starlette closes the body iterator
+        # when the client disconnects
+        await body.aclose()
+        await asyncio.sleep(0)
+
+    assert call.cancelled
+
+def test_ai_request_requires_note_source():
+    with pytest.raises(ValueError):
+        AIProcessRequest(userPrompt="Summarize")
+
+@pytest.mark.asyncio
+async def test_process_ai_request_note_id_requires_auth():
+    request = AIProcessRequest(note_id="n1", userPrompt="Summarize")
+    with patch("app.routes.ai.GEMINI_API_KEY", "fake-api-key"):
+        with pytest.raises(HTTPException) as exc:
+            await process_ai_request(request, None)
+    assert exc.value.status_code == 401
+
+@pytest.mark.asyncio
+async def test_process_ai_request_loads_note_by_id():
+    request = AIProcessRequest(note_id="n1", userPrompt="Summarize")
+    credentials = MagicMock(credentials="token")
+    note = {"id": "n1", "title": "Stored", "content": "Long text", "updated_at": "t"}
+    context = {"title": "Stored", "content": "Relevant chunk", "updated_at": "t", "strategy": "chunks"}
+
+    with patch("app.routes.ai.GEMINI_API_KEY", "fake-api-key"), \
+         patch("app.routes.ai.get_gemini_model") as mock_get_model, \
+         patch("app.routes.ai.get_current_user", AsyncMock(return_value={"id": "u1"})), \
+         patch("app.routes.ai.get_authenticated_client", AsyncMock(return_value=MagicMock())), \
+         patch("app.routes.ai.AIContextService.load_note", AsyncMock(return_value=note)), \
+         patch("app.routes.ai.AIContextService.build_note_context", AsyncMock(return_value=context)) as mock_context:
+        mock_model = mock_get_model.return_value
+        mock_model.generate_content_async = AsyncMock(return_value=MagicMock(text="AI Result"))
+
+        result = await process_ai_request(request, credentials)
+
+    assert mock_context.await_args[0][1:] == (note, "Summarize")
+    prompt = mock_model.generate_content_async.call_args[0][0]
+    assert "Note Title: Stored" in prompt and "Relevant chunk" in prompt
+    assert result.metadata == {"context": "chunks", "noteId": "n1", "cacheHit": False}
+
+@pytest.mark.asyncio
+async def test_process_ai_request_serves_repeats_from_cache():
+    with patch("app.routes.ai.GEMINI_API_KEY", "fake-api-key"), patch("app.routes.ai.get_gemini_model") as mock_get_model:
+        mock_model = mock_get_model.return_value
+        mock_model.generate_content_async = AsyncMock(return_value=MagicMock(text="AI Result"))
+
+        first = await process_ai_request(AIProcessRequest(noteTitle="Title", noteContent="Content", userPrompt="Summarize"))
+        # Same action, spelled differently
+        second = await process_ai_request(AIProcessRequest(noteTitle="Title", noteContent="Content", userPrompt="  SUMMARIZE "))
+        edited = await process_ai_request(AIProcessRequest(noteTitle="Title", noteContent="Content v2", userPrompt="Summarize"))
+
+    assert mock_model.generate_content_async.await_count == 2
+    assert first.metadata["cacheHit"] is False
+    assert second.metadata["cacheHit"] is True
+    assert second.result == first.result and second.processedAt == first.processedAt
+    assert edited.metadata["cacheHit"] is False
+
+@pytest.mark.asyncio
+async def test_stream_ai_request_replays_cached_answer():
+    request = AIProcessRequest(noteTitle="Title", noteContent="Content", userPrompt="Summarize")
+
+    mock_model = fake_model(FakeStream(["Hello", " world"]))
+    with patch("app.routes.ai.GEMINI_API_KEY", "fake-api-key"), patch("app.routes.ai.get_gemini_model", return_value=mock_model):
+        first = await stream_ai_request(request)
+        [event async for event in first.body_iterator]
+        second = await stream_ai_request(request)
+        events = [event async for event in second.body_iterator]
+
+    assert mock_model.generate_content_async.await_count == 1
+    assert events[0] == 'event: chunk\ndata: {"text": "Hello world"}\n\n'
+    assert '"cacheHit": true' in events[1]
+
+def test_invalidate_notes_drops_only_that_note():
+    ai_response_cache.set(("u1", "n1", "h", "summarize", "m"), {"result": "a"})
+    ai_response_cache.set(("u1", "n2", "h", "summarize", "m"), {"result": "b"})
+    ai_response_cache.set(("u2", "n1", "h", "summarize", "m"), {"result": "c"})
+
+    invalidate_notes("u1", ["n1"])
+
+    assert ai_response_cache.get(("u1", "n1", "h", "summarize", "m")) is None
+    assert ai_response_cache.get(("u1", "n2", "h", "summarize", "m")) == {"result": "b"}
+    assert ai_response_cache.get(("u2", "n1", "h", "summarize", "m")) == {"result": "c"}
+
+@pytest.mark.asyncio
+async def test_process_ai_request_shed_when_llm_saturated():
+    request = AIProcessRequest(noteTitle="Title", noteContent="Content", userPrompt="Summarize")
+    full = Bulkhead(max_concurrency=1, max_queue=0, queue_timeout=1)
+    await full._semaphore.acquire()
+
+    with patch("app.routes.ai.GEMINI_API_KEY", "fake-api-key"), \
+         patch("app.routes.ai.llm_bulkhead", full), \
+         patch("app.routes.ai.get_gemini_model") as mock_get_model:
+        with pytest.raises(HTTPException) as exc:
+            await process_ai_request(request)
+        with pytest.raises(HTTPException) as stream_exc:
+            await stream_ai_request(request)
+
+    assert exc.value.status_code == 503
+    assert exc.value.headers["Retry-After"]
+    assert stream_exc.value.status_code == 503
+    mock_get_model.assert_not_called()
@@ -0,0 +1,212 @@
+import pytest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock, AsyncMock, patch
+from fastapi import HTTPException
+from google.api_core import exceptions as google_exceptions
+from postgrest.exceptions import APIError
+from app.services.ai_cache import note_text_hash
+from app.services.ai_chat import AIChatService
+
+SESSION_ID = "5b3e2c1a-8f4d-4e6b-9a7c-2d1e0f3b4a5c"
+LONG_NOTE = {"id": "n1", "title": "Thesis", "content": "word " * 5000, "updated_at": "t"}
+
+def session(note=LONG_NOTE, cached_content="cachedContents/c1", expires_in=3600, messages=None):
+    return {
+        "id": "s1",
+        "note_id": note["id"],
+        "note_hash": note_text_hash(note["title"], note["content"]),
+        "cached_content": cached_content,
+        "cache_expires_at": (datetime.now(timezone.utc) + timedelta(seconds=expires_in)).isoformat(),
+        "messages": messages or [],
+        "created_at": "t",
+        "updated_at": "t"
+    }
+
+def model_replying(text="Reply"):
+    model = MagicMock()
+    model.generate_content_async = AsyncMock(return_value=MagicMock(
+        text=text, usage_metadata=MagicMock(prompt_token_count=9000, cached_content_token_count=8500)
+    ))
+    return model
+
+def chat_patches(existing, note=LONG_NOTE):
+    return (
+        patch("app.services.ai_chat.AIChatService.get_session", AsyncMock(return_value=existing)),
+        patch("app.services.ai_chat.AIContextService.load_note", AsyncMock(return_value=note)),
+    )
+
+def mock_admin(cache_swapped=True):
+    """Service-role client; session rows are only written through it."""
+    admin = MagicMock()
+    admin.table.return_value.insert.return_value.execute = AsyncMock(return_value=MagicMock(data=[{"id": "s1"}]))
+    admin.rpc.return_value.execute = AsyncMock(return_value=MagicMock(
+        data=[{"previous_cache": "cachedContents/c1", "cache_swapped": cache_swapped}]
+    ))
+    return admin
+
+def saved_turn(admin):
+    """Arguments of the append_ai_chat_turn call."""
+    name, params = admin.rpc.call_args[0]
+    assert name == "append_ai_chat_turn"
+    return params
+
+@pytest.mark.asyncio
+async def test_create_session_caches_long_note():
+    mock_supabase = MagicMock()
+    admin = mock_admin()
+
+    with patch("app.services.ai_chat.AIContextService.load_note", AsyncMock(return_value=LONG_NOTE)) as mock_load, \
+         patch("app.services.ai_chat.get_supabase_admin", return_value=admin), \
+         patch("app.services.ai_chat.create_context_cache", AsyncMock(return_value=("cachedContents/c1", "2030-01-01T00:00:00+00:00"))) as mock_cache:
+        await AIChatService.create_session(mock_supabase, "u1", "n1")
+
+    assert LONG_NOTE["content"] in mock_cache.await_args[0][1]
+    # Ownership is checked with the user's client, the row written with the service role
+    assert mock_load.await_args[0][0] is mock_supabase
+    mock_supabase.table.return_value.insert.assert_not_called()
+    row = admin.table.return_value.insert.call_args[0][0]
+    assert row["cached_content"] == "cachedContents/c1"
+    assert row["messages"] == []
+
+@pytest.mark.asyncio
+async def test_create_session_sends_short_note_inline():
+    short = {**LONG_NOTE, "content": "short"}
+    admin = mock_admin()
+
+    with patch("app.services.ai_chat.AIContextService.load_note", AsyncMock(return_value=short)), \
+         patch("app.services.ai_chat.get_supabase_admin", return_value=admin), \
+         patch("app.services.ai_chat.create_context_cache", AsyncMock()) as mock_cache:
+        await AIChatService.create_session(MagicMock(), "u1", "n1")
+
+    mock_cache.assert_not_awaited()
+    assert admin.table.return_value.insert.call_args[0][0]["cached_content"] is None
+
+@pytest.mark.asyncio
+async def test_send_message_with_cache_sends_only_history_and_message():
+    history = [{"role": "user", "text": "Hi", "at": "t"}, {"role": "model", "text": "Hello", "at": "t"}]
+    mock_supabase = MagicMock()
+    admin = mock_admin()
+    model = model_replying()
+    get_session, load_note = chat_patches(session(messages=history))
+
+    with get_session, load_note, patch("app.services.ai_chat.get_supabase_admin", return_value=admin), \
+         patch("app.services.ai_chat.create_context_cache", AsyncMock()) as mock_cache, \
+         patch("app.services.ai_chat.get_cached_model", AsyncMock(return_value=model)) as mock_cached_model:
+        reply, metadata = await AIChatService.send_message(mock_supabase, "u1", "s1", "What is the thesis?")
+
+    mock_cache.assert_not_awaited()
+    mock_cached_model.assert_called_once_with("cachedContents/c1")
+    contents = model.generate_content_async.await_args[0][0]
+    assert contents == [
+        {"role": "user", "parts": ["Hi"]},
+        {"role": "model", "parts": ["Hello"]},
+        {"role": "user", "parts": ["What is the thesis?"]},
+    ]
+    assert reply["text"] == "Reply"
+    assert metadata["context_cached"] is True
+    assert metadata["cached_tokens"] == 8500
+    mock_supabase.table.return_value.update.assert_not_called()
+    # Only the new exchange is sent; the database appends it
+    saved = saved_turn(admin)
+    assert [turn["text"] for turn in saved["p_messages"]] == ["What is the thesis?", "Reply"]
+    assert saved["p_expected_cache"] == saved["p_cached_content"] == "cachedContents/c1"
+
+@pytest.mark.asyncio
+async def test_send_message_rebuilds_cache_after_note_edit():
+    edited = {**LONG_NOTE, "content": LONG_NOTE["content"] + "more"}
+    mock_supabase = MagicMock()
+    admin = mock_admin()
+    get_session, load_note = chat_patches(session(), note=edited)
+
+    with get_session, load_note, patch("app.services.ai_chat.get_supabase_admin", return_value=admin), \
+         patch("app.services.ai_chat.create_context_cache", AsyncMock(return_value=("cachedContents/c2", "2030-01-01T00:00:00+00:00"))), \
+         patch("app.services.ai_chat.delete_context_cache", AsyncMock()) as mock_delete, \
+         patch("app.services.ai_chat.get_cached_model", AsyncMock(return_value=model_replying())) as mock_cached_model:
+        await AIChatService.send_message(mock_supabase, "u1", "s1", "And now?")
+
+    mock_cached_model.assert_called_once_with("cachedContents/c2")
+    mock_delete.assert_awaited_once_with("cachedContents/c1")
+    saved = saved_turn(admin)
+    assert saved["p_expected_cache"] == "cachedContents/c1"
+    assert saved["p_cached_content"] == "cachedContents/c2"
+    assert saved["p_note_hash"] == note_text_hash(edited["title"], edited["content"])
+
+@pytest.mark.asyncio
+async def test_send_message_drops_its_cache_when_another_turn_swapped_first():
+    edited = {**LONG_NOTE, "content": LONG_NOTE["content"] + "more"}
+    admin = mock_admin(cache_swapped=False)
+    get_session, load_note = chat_patches(session(), note=edited)
+
+    with get_session, load_note, patch("app.services.ai_chat.get_supabase_admin", return_value=admin), \
+         patch("app.services.ai_chat.create_context_cache", AsyncMock(return_value=("cachedContents/c2", "2030-01-01T00:00:00+00:00"))), \
+         patch("app.services.ai_chat.delete_context_cache", AsyncMock()) as mock_delete, \
+         patch("app.services.ai_chat.get_cached_model", AsyncMock(return_value=model_replying())):
+        await AIChatService.send_message(MagicMock(), "u1", "s1", "And now?")
+
+    # The session now uses the other turn's cache; c1 is theirs to delete
+    mock_delete.assert_awaited_once_with("cachedContents/c2")
+
+@pytest.mark.asyncio
+async def test_send_message_falls_back_inline_when_cache_is_gone():
+    mock_supabase = MagicMock()
+    admin = mock_admin()
+    stale = MagicMock()
+    stale.generate_content_async = AsyncMock(side_effect=google_exceptions.NotFound("gone"))
+    get_session, load_note = chat_patches(session())
+
+    with get_session, load_note, patch("app.services.ai_chat.get_supabase_admin", return_value=admin), \
+         patch("app.services.ai_chat.get_cached_model", AsyncMock(return_value=stale)), \
+         patch("app.services.ai_chat.delete_context_cache", AsyncMock()), \
+         patch("app.services.ai_chat.genai") as mock_genai:
+        mock_genai.GenerativeModel.return_value = model_replying("Inline reply")
+        reply, metadata = await AIChatService.send_message(mock_supabase, "u1", "s1", "Question")
+
+    assert reply["text"] == "Inline reply"
+    assert metadata["context_cached"] is False
+    assert LONG_NOTE["content"] in mock_genai.GenerativeModel.call_args[1]["system_instruction"]
+    assert saved_turn(admin)["p_cached_content"] is None
+
+@pytest.mark.asyncio
+async def test_create_session_deletes_cache_if_insert_fails():
+    admin = mock_admin()
+    admin.table.return_value.insert.return_value.execute = AsyncMock(side_effect=APIError({"message": "insert failed"}))
+
+    with patch("app.services.ai_chat.AIContextService.load_note", AsyncMock(return_value=LONG_NOTE)), \
+         patch("app.services.ai_chat.get_supabase_admin", return_value=admin), \
+         patch("app.services.ai_chat.create_context_cache", AsyncMock(return_value=("cachedContents/c1", "2030-01-01T00:00:00+00:00"))), \
+         patch("app.services.ai_chat.delete_context_cache", AsyncMock()) as mock_delete:
+        with pytest.raises(APIError):
+            await AIChatService.create_session(MagicMock(), "u1", "n1")
+
+    mock_delete.assert_awaited_once_with("cachedContents/c1")
+
+def mock_sessions(rows):
+    """User client whose session lookup returns rows; single() raises like PostgREST."""
+    mock_supabase = MagicMock()
+    query = mock_supabase.table.return_value.select.return_value.eq.return_value.eq.return_value
+    query.limit.return_value.execute = AsyncMock(return_value=MagicMock(data=rows))
+    query.single.return_value.execute = AsyncMock(side_effect=APIError({
+        "code": "PGRST116",
+        "message": "JSON object requested, multiple (or no) rows returned",
+        "details": "The result contains 0 rows"
+    }))
+    return mock_supabase
+
+@pytest.mark.asyncio
+async def test_get_session_returns_row():
+    row = session()
+    assert await AIChatService.get_session(mock_sessions([row]), "u1", SESSION_ID) == row
+
+@pytest.mark.asyncio
+async def test_get_session_unknown_or_foreign_is_404():
+    with pytest.raises(HTTPException) as exc:
+        await AIChatService.get_session(mock_sessions([]), "u1", SESSION_ID)
+    assert exc.value.status_code == 404
+
+@pytest.mark.asyncio
+async def test_get_session_malformed_id_is_404():
+    mock_supabase = mock_sessions([])
+    with pytest.raises(HTTPException) as exc:
+        await AIChatService.get_session(mock_supabase, "u1", "not-a-uuid")
+    assert exc.value.status_code == 404
+    mock_supabase.table.assert_not_called()
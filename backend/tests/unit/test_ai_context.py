@@ -0,0 +1,90 @@
+import pytest
+from unittest.mock import MagicMock, AsyncMock, patch
+from fastapi import HTTPException
+from postgrest.exceptions import APIError
+from app.services.ai_context import AIContextService, CHUNK_SEPARATOR
+
+NOTE_ID = "0b6e2a36-9c0e-4d8e-8f4f-3f1f2b6f9a11"
+
+def mock_context_supabase(note=None, chunks=None):
+    mock_supabase = MagicMock()
+    query = mock_supabase.table.return_value.select.return_value.eq.return_value.eq.return_value
+    query.limit.return_value.execute = AsyncMock(return_value=MagicMock(data=[note] if note else []))
+    # What PostgREST does for .single() when no row matches
+    query.single.return_value.execute = AsyncMock(side_effect=APIError({
+        "code": "PGRST116",
+        "message": "JSON object requested, multiple (or no) rows returned",
+        "details": "The result contains 0 rows",
+        "hint": None
+    }))
+    mock_supabase.rpc.return_value.execute = AsyncMock(return_value=MagicMock(data=chunks or []))
+    return mock_supabase
+
+def note(content):
+    return {"id": "n1", "title": "Long note", "content": content, "updated_at": "2024-01-01T00:00:00Z"}
+
+@pytest.mark.asyncio
+async def test_short_note_is_sent_whole():
+    mock_supabase = mock_context_supabase()
+
+    with patch("app.services.ai_context.embed_query", AsyncMock()) as mock_embed:
+        context = await AIContextService.build_note_context(mock_supabase, note("short"), "Summarize", budget=100)
+
+    assert context["strategy"] == "full"
+    assert context["content"] == "short"
+    mock_embed.assert_not_awaited()
+
+@pytest.mark.asyncio
+async def test_long_note_uses_relevant_chunks_in_document_order():
+    # Ranked best first; the second is skipped because it would overflow the 10-token budget
+    chunks = [
+        {"chunk_index": 4, "content": "b" * 12, "similarity": 0.9},
+        {"chunk_index": 0, "content": "a" * 15, "similarity": 0.8},
+        {"chunk_index": 2, "content": "c" * 12, "similarity": 0.7},
+    ]
+    mock_supabase = mock_context_supabase(chunks=chunks)
+
+    with patch("app.services.ai_context.embed_query", AsyncMock(return_value=[0.1])):
+        context = await AIContextService.build_note_context(mock_supabase, note("x" * 300), "Summarize", budget=10)
+
+    assert context["strategy"] == "chunks"
+    assert context["content"].split(CHUNK_SEPARATOR) == ["c" * 12, "b" * 12]
+    args = mock_supabase.rpc.call_args[0]
+    assert args[0] == "match_note_chunks"
+    assert args[1]["p_note_id"] == "n1"
+
+@pytest.mark.asyncio
+async def test_long_note_without_chunks_is_truncated():
+    mock_supabase = mock_context_supabase()
+
+    with patch("app.services.ai_context.embed_query", AsyncMock(side_effect=RuntimeError("no key"))):
+        context = await AIContextService.build_note_context(mock_supabase, note("x" * 300), "Summarize", budget=10)
+
+    assert context["strategy"] == "truncated"
+    assert context["content"] == "x" * 30
+
+@pytest.mark.asyncio
+async def test_load_note_missing_raises_404():
+    mock_supabase = mock_context_supabase(None)
+
+    with pytest.raises(HTTPException) as exc:
+        await AIContextService.load_note(mock_supabase, "u1", NOTE_ID)
+    assert exc.value.status_code == 404
+
+@pytest.mark.asyncio
+async def test_load_note_returns_the_row():
+    mock_supabase = mock_context_supabase(note("text"))
+
+    loaded = await AIContextService.load_note(mock_supabase, "u1", NOTE_ID)
+
+    assert loaded["content"] == "text"
+    assert mock_supabase.table.return_value.select.return_value.eq.call_args[0] == ("id", NOTE_ID)
+
+@pytest.mark.asyncio
+async def test_load_note_rejects_malformed_id_as_not_found():
+    mock_supabase = mock_context_supabase(note("text"))
+
+    with pytest.raises(HTTPException) as exc:
+        await AIContextService.load_note(mock_supabase, "u1", "not-a-uuid")
+    assert exc.value.status_code == 404
+    mock_supabase.table.assert_not_called()
@@ -1,13 +1,78 @@
+import time
+import jwt
 import pytest
-from unittest.mock import MagicMock, patch
+from unittest.mock import MagicMock, AsyncMock, patch
 from fastapi import HTTPException
-from app.core.auth import get_current_user, get_authenticated_client
+from cryptography.hazmat.primitives.asymmetric import rsa
+from app.core.auth import get_current_user, get_authenticated_client, token_cache, verify_token_locally
 from fastapi.security import HTTPAuthorizationCredentials
 
+SECRET = "test-jwt-secret-with-enough-bytes-for-hs256"
+
+def make_token(secret=SECRET, exp_offset=3600, sub="user-123"):
+    claims = {
+        "sub": sub,
+        "email": "test@example.com",
+        "aud": "authenticated",
+        "role": "authenticated",
+        "exp": int(time.time()) + exp_offset,
+    }
+    return jwt.encode(claims, secret, algorithm="HS256")
+
+@pytest.fixture(autouse=True)
+def clear_token_cache():
+    token_cache.clear()
+    yield
+    token_cache.clear()
+
+@pytest.mark.asyncio
+async def test_get_current_user_local_verification():
+    creds = HTTPAuthorizationCredentials(scheme="Bearer", credentials=make_token())
+    
+    with patch("app.core.auth.SUPABASE_JWT_SECRET", SECRET), \
+         patch("app.core.auth.get_supabase") as mock_get_supabase:
+        user = await get_current_user(creds)
+        
+        assert user["id"] == "user-123"
+        assert user["email"] == "test@example.com"
+        assert user["role"] == "authenticated"
+        # No round trip to Supabase Auth
+        mock_get_supabase.assert_not_called()
+
 @pytest.mark.asyncio
-async def test_get_current_user_valid():
-    # Mock credentials
-    creds = HTTPAuthorizationCredentials(scheme="Bearer", credentials="valid_token")
+async def test_get_current_user_cached():
+    creds = HTTPAuthorizationCredentials(scheme="Bearer", credentials=make_token())
+    
+    with patch("app.core.auth.SUPABASE_JWT_SECRET", SECRET), \
+         patch("app.core.auth.verify_token_locally", wraps=verify_token_locally) as mock_verify:
+        await get_current_user(creds)
+        await get_current_user(creds)
+        
+        assert mock_verify.call_count == 1
+
+@pytest.mark.asyncio
+async def test_get_current_user_bad_signature():
+    creds = HTTPAuthorizationCredentials(scheme="Bearer", credentials=make_token(secret="wrong-secret-that-is-also-long-enough"))
+    
+    with patch("app.core.auth.SUPABASE_JWT_SECRET", SECRET):
+        with pytest.raises(HTTPException) as exc:
+            await get_current_user(creds)
+        assert exc.value.status_code == 401
+
+@pytest.mark.asyncio
+async def test_get_current_user_expired():
+    creds = HTTPAuthorizationCredentials(scheme="Bearer", credentials=make_token(exp_offset=-60))
+    
+    with patch("app.core.auth.SUPABASE_JWT_SECRET", SECRET):
+        with pytest.raises(HTTPException) as exc:
+            await get_current_user(creds)
+        assert exc.value.status_code == 401
+
+@pytest.mark.asyncio
+async def test_get_current_user_remote_fallback():
+    # HS256 token but no secret configured -> falls back to Supabase Auth
+    token = make_token()
+    creds = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
     
     # Mock Supabase client and response
     mock_user = MagicMock()
@@ -20,24 +85,26 @@ async def test_get_current_user_valid():
     mock_response = MagicMock()
     mock_response.user = mock_user
     
-    with patch("app.core.auth.get_supabase") as mock_get_supabase:
+    with patch("app.core.auth.SUPABASE_JWT_SECRET", None), \
+         patch("app.core.auth.get_supabase") as mock_get_supabase:
         mock_client = MagicMock()
-        mock_client.auth.get_user.return_value = mock_response
+        mock_client.auth.get_user = AsyncMock(return_value=mock_response)
         mock_get_supabase.return_value = mock_client
         
         user = await get_current_user(creds)
         
         assert user["id"] == "user-123"
         assert user["email"] == "test@example.com"
-        mock_client.auth.get_user.assert_called_with("valid_token")
+        mock_client.auth.get_user.assert_called_with(token)
 
 @pytest.mark.asyncio
 async def test_get_current_user_invalid():
-    creds = HTTPAuthorizationCredentials(scheme="Bearer", credentials="invalid_token")
+    creds = HTTPAuthorizationCredentials(scheme="Bearer", credentials=make_token())
     
-    with patch("app.core.auth.get_supabase") as mock_get_supabase:
+    with patch("app.core.auth.SUPABASE_JWT_SECRET", None), \
+         patch("app.core.auth.get_supabase") as mock_get_supabase:
         mock_client = MagicMock()
-        mock_client.auth.get_user.return_value = None # Invalid token returns None/Error
+        mock_client.auth.get_user = AsyncMock(return_value=None) # Invalid token returns None/Error
         mock_get_supabase.return_value = mock_client
         
         with pytest.raises(HTTPException) as exc:
@@ -46,15 +113,48 @@ async def test_get_current_user_invalid():
         assert exc.value.status_code == 401
         assert "Invalid or expired token" in exc.value.detail
 
+RSA_KEY = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+def jwks_client_for(private_key):
+    """JWKS client stub returning the public half of private_key."""
+    jwk = jwt.PyJWK.from_json(jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key()))
+    client = MagicMock()
+    client.get_signing_key_from_jwt.return_value = jwk
+    return client
+
+def make_rsa_token(algorithm):
+    claims = {"sub": "user-123", "aud": "authenticated", "exp": int(time.time()) + 3600}
+    return jwt.encode(claims, RSA_KEY, algorithm=algorithm)
+
+def test_verify_token_locally_accepts_rs256_from_jwks():
+    with patch("app.core.auth._get_jwks_client", return_value=jwks_client_for(RSA_KEY)):
+        claims = verify_token_locally(make_rsa_token("RS256"))
+    assert claims["sub"] == "user-123"
+
+def test_verify_token_locally_ignores_algorithm_chosen_by_token():
+    # Validly signed, but with an algorithm outside the allowlist for RSA keys
+    with patch("app.core.auth._get_jwks_client", return_value=jwks_client_for(RSA_KEY)):
+        with pytest.raises(jwt.InvalidAlgorithmError):
+            verify_token_locally(make_rsa_token("RS384"))
+
+@pytest.mark.asyncio
+async def test_get_current_user_without_jwks_url_is_a_config_error():
+    creds = HTTPAuthorizationCredentials(scheme="Bearer", credentials=make_rsa_token("RS256"))
+
+    with patch("app.core.auth.JWKS_URL", None), patch("app.core.auth._jwks_client", None):
+        with pytest.raises(HTTPException) as exc:
+            await get_current_user(creds)
+    assert exc.value.status_code == 500
+
 @pytest.mark.asyncio
 async def test_get_authenticated_client():
     creds = HTTPAuthorizationCredentials(scheme="Bearer", credentials="token123")
     
-    with patch("app.core.auth.get_supabase") as mock_get_supabase:
+    with patch("app.core.auth.get_user_client") as mock_get_user_client:
         mock_client = MagicMock()
-        mock_get_supabase.return_value = mock_client
+        mock_get_user_client.return_value = mock_client
         
         client = await get_authenticated_client(creds)
         
         assert client == mock_client
-        mock_client.postgrest.auth.assert_called_with("token123")
+        mock_get_user_client.assert_called_with("token123")
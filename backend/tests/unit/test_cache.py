@@ -0,0 +1,38 @@
+import time
+from unittest.mock import patch
+from app.core.cache import TTLCache
+
+def test_get_set_and_counters():
+    cache = TTLCache(max_size=10, ttl_seconds=60)
+    assert cache.get("a") is None
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+def test_lru_eviction():
+    cache = TTLCache(max_size=2, ttl_seconds=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")  # "b" is now least recently used
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+def test_entries_expire():
+    cache = TTLCache(max_size=10, ttl_seconds=60)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl_seconds=5)
+    with patch("app.core.cache.time.time", return_value=time.time() + 30):
+        assert cache.get("a") == 1
+        assert cache.get("b") is None
+
+def test_delete_where():
+    cache = TTLCache(max_size=10, ttl_seconds=60)
+    cache.set(("u1", "a"), 1)
+    cache.set(("u1", "b"), 2)
+    cache.set(("u2", "a"), 3)
+    assert cache.delete_where(lambda key: key[1] == "a") == 2
+    assert len(cache) == 1
+    assert cache.get(("u1", "b")) == 2
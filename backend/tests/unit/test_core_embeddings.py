@@ -1,33 +1,185 @@
+import asyncio
+import httpx
+import openai
 import pytest
-from unittest.mock import MagicMock, patch
-from app.core.embeddings import create_embedding, embed_chunks, prepare_note_for_embedding
+from unittest.mock import MagicMock, AsyncMock, patch
+from app.core.embeddings import (
+    EmbeddingBatchError,
+    EmbeddingEngine,
+    embed_query,
+    query_embedding_cache,
+    create_embedding,
+    embed_chunks,
+    prepare_note_for_embedding,
+    pack_batches,
+)
 
 @pytest.fixture
-def mock_openai():
-    with patch("app.core.embeddings.client") as mock:
-        yield mock
+def engine():
+    engine = EmbeddingEngine(api_key="test-key", max_concurrency=2)
+    engine._client = MagicMock()
+    engine._client.embeddings.create = AsyncMock()
+    with patch("app.core.embeddings.OPENAI_API_KEY", "test-key"), \
+         patch("app.core.embeddings.get_embedding_engine", return_value=engine):
+        yield engine
 
-def test_create_embedding(mock_openai):
+@pytest.mark.asyncio
+async def test_create_embedding(engine):
     mock_response = MagicMock()
     mock_response.data = [MagicMock(embedding=[0.1, 0.2])]
-    mock_openai.embeddings.create.return_value = mock_response
+    engine._client.embeddings.create.return_value = mock_response
     
-    emb = create_embedding("test")
+    emb = await create_embedding("test")
     assert emb == [0.1, 0.2]
-    mock_openai.embeddings.create.assert_called_once()
+    engine._client.embeddings.create.assert_called_once()
 
-def test_embed_chunks(mock_openai):
+@pytest.mark.asyncio
+async def test_embed_chunks(engine):
     mock_response = MagicMock()
-    mock_response.data = [MagicMock(embedding=[0.1, 0.2])]
-    mock_openai.embeddings.create.return_value = mock_response
+    mock_response.data = [MagicMock(embedding=[0.1, 0.2], index=0)]
+    engine._client.embeddings.create.return_value = mock_response
     
     chunks = [{"content": "c1"}]
-    result = embed_chunks(chunks)
+    result = await embed_chunks(chunks)
     assert len(result) == 1
     assert result[0]["embedding"] == [0.1, 0.2]
 
+@pytest.mark.asyncio
+async def test_embed_batch_keeps_input_order(engine):
+    mock_response = MagicMock()
+    mock_response.data = [
+        MagicMock(embedding=[2.0], index=1),
+        MagicMock(embedding=[1.0], index=0),
+    ]
+    engine._client.embeddings.create.return_value = mock_response
+    
+    result = await engine.embed_batch(["a", "b"])
+    assert result == [[1.0], [2.0]]
+
+@pytest.mark.asyncio
+async def test_engine_limits_concurrency(engine):
+    in_flight = 0
+    peak = 0
+    
+    async def slow_create(**kwargs):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return MagicMock(data=[MagicMock(embedding=[0.0])])
+    
+    engine._client.embeddings.create.side_effect = slow_create
+    
+    await asyncio.gather(*(engine.embed_one(f"q{i}") for i in range(6)))
+    assert peak == 2
+
+@pytest.mark.asyncio
+async def test_embed_one_empty_text(engine):
+    with pytest.raises(ValueError):
+        await engine.embed_one("   ")
+
 def test_prepare_note_for_embedding():
     # This uses TextChunker, which we already tested, but this wraps it.
     chunks = prepare_note_for_embedding("Title", "Content", 100)
     assert len(chunks) == 1
     assert chunks[0]["title"] == "Title"
+
+def test_pack_batches_respects_input_limit():
+    batches = pack_batches(["a"] * 5, max_inputs=2)
+    assert batches == [[0, 1], [2, 3], [4]]
+
+def test_pack_batches_respects_token_limit():
+    texts = ["x" * 30, "x" * 30, "x" * 30]  # ~11 estimated tokens each
+    batches = pack_batches(texts, max_tokens=25)
+    assert batches == [[0, 1], [2]]
+    # A single oversized text still gets its own batch
+    assert pack_batches(["x" * 300], max_tokens=10) == [[0]]
+
+def api_error(cls, status_code, headers=None):
+    response = httpx.Response(
+        status_code,
+        headers=headers or {},
+        request=httpx.Request("POST", "https://api.openai.com/v1/embeddings")
+    )
+    return cls("error", response=response, body=None)
+
+def embeddings_response(inputs):
+    return MagicMock(data=[MagicMock(embedding=[float(len(t))], index=i) for i, t in enumerate(inputs)])
+
+@pytest.mark.asyncio
+async def test_embed_batch_splits_into_sub_batches(engine):
+    engine._client.embeddings.create.side_effect = lambda input, model: embeddings_response(input)
+    
+    with patch("app.core.embeddings.pack_batches", side_effect=lambda texts: pack_batches(texts, max_inputs=2)):
+        result = await engine.embed_batch(["a", "bb", "ccc", "dddd", "eeeee"])
+    
+    assert engine._client.embeddings.create.call_count == 3
+    assert result == [[1.0], [2.0], [3.0], [4.0], [5.0]]
+
+@pytest.mark.asyncio
+async def test_retries_rate_limit_honoring_headers(engine):
+    engine._client.embeddings.create.side_effect = [
+        api_error(openai.RateLimitError, 429, {"retry-after-ms": "1500"}),
+        embeddings_response(["a"]),
+    ]
+    
+    with patch("app.core.embeddings.asyncio.sleep", new=AsyncMock()) as mock_sleep:
+        result = await engine.embed_one("a")
+    
+    assert result == [1.0]
+    assert mock_sleep.call_args.args[0] >= 1.5
+
+@pytest.mark.asyncio
+async def test_does_not_retry_client_errors(engine):
+    engine._client.embeddings.create.side_effect = api_error(openai.AuthenticationError, 401)
+    
+    with pytest.raises(openai.AuthenticationError):
+        await engine.embed_one("a")
+    assert engine._client.embeddings.create.call_count == 1
+
+@pytest.mark.asyncio
+async def test_embed_batch_reports_partial_failures(engine):
+    def create(input, model):
+        if any(t == "bad" for t in input):
+            raise api_error(openai.BadRequestError, 400)
+        return embeddings_response(input)
+    
+    engine._client.embeddings.create.side_effect = create
+    
+    with pytest.raises(EmbeddingBatchError) as exc:
+        await engine.embed_batch(["ok", "bad", "fine", ""])
+    
+    # The bad input is isolated by halving; the others still get vectors
+    assert set(exc.value.failures) == {1, 3}
+    assert exc.value.embeddings[0] == [2.0]
+    assert exc.value.embeddings[2] == [4.0]
+
+@pytest.fixture
+def query_cache():
+    query_embedding_cache.clear()
+    yield query_embedding_cache
+    query_embedding_cache.clear()
+
+@pytest.mark.asyncio
+async def test_embed_query_caches_normalized_queries(query_cache):
+    with patch("app.core.embeddings.create_embedding", new=AsyncMock(return_value=[0.3])) as mock_create:
+        first = await embed_query("  Machine   Learning ")
+        second = await embed_query("machine learning")
+    
+    assert first == second == [0.3]
+    mock_create.assert_called_once_with("machine learning")
+    assert query_cache.hits == 1
+    assert query_cache.misses == 1
+
+@pytest.mark.asyncio
+async def test_embed_query_shares_inflight_calls(query_cache):
+    async def slow_create(text):
+        await asyncio.sleep(0.01)
+        return [0.4]
+    
+    with patch("app.core.embeddings.create_embedding", side_effect=slow_create) as mock_create:
+        results = await asyncio.gather(*(embed_query("same query") for _ in range(5)))
+    
+    assert results == [[0.4]] * 5
+    mock_create.assert_called_once()
@@ -0,0 +1,43 @@
+import pytest
+from unittest.mock import patch
+from app.core import database
+
+@pytest.fixture(autouse=True)
+def configured():
+    with patch("app.core.database.SUPABASE_URL", "https://example.supabase.co"), \
+         patch("app.core.database.SUPABASE_KEY", "anon-key"), \
+         patch("app.core.database.SUPABASE_SERVICE_KEY", "service-key"):
+        database._http_client = None
+        database._supabase = None
+        database._supabase_admin = None
+        yield
+        database._http_client = None
+        database._supabase = None
+        database._supabase_admin = None
+
+def test_get_supabase_is_shared():
+    assert database.get_supabase() is database.get_supabase()
+    assert database.get_supabase_admin() is database.get_supabase_admin()
+    assert database.get_supabase() is not database.get_supabase_admin()
+
+def test_user_client_shares_pool():
+    c1 = database.get_user_client("token-1")
+    c2 = database.get_user_client("token-2")
+    
+    # Distinct per-user views over one transport
+    assert c1.session is c2.session is database.get_http_client()
+    assert c1.headers["Authorization"] == "Bearer token-1"
+    assert c2.headers["Authorization"] == "Bearer token-2"
+    assert c1.headers["apikey"] == "anon-key"
+
+@pytest.mark.asyncio
+async def test_close_clients_resets_pool():
+    pool = database.get_http_client()
+    await database.close_clients()
+    assert pool.is_closed
+    assert database.get_http_client() is not pool
+
+def test_missing_config():
+    with patch("app.core.database.SUPABASE_KEY", None):
+        with pytest.raises(ValueError):
+            database.get_user_client("token")
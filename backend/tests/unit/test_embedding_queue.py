@@ -0,0 +1,145 @@
+import asyncio
+import pytest
+from unittest.mock import MagicMock, patch
+from app.services.embedding_queue import EmbeddingQueue
+
+@pytest.mark.asyncio
+async def test_burst_of_saves_embeds_once():
+    queue = EmbeddingQueue(debounce_seconds=0.05)
+    supabase = MagicMock()
+    
+    with patch("app.services.embedding_queue.EmbeddingService.embed_note") as mock_embed:
+        for i in range(20):
+            queue.schedule(supabase, "u1", "n1", "T", f"version {i}")
+        
+        assert queue.pending_count() == 1
+        await asyncio.sleep(0.15)
+        
+        mock_embed.assert_called_once()
+        assert mock_embed.call_args.kwargs["content"] == "version 19"
+
+@pytest.mark.asyncio
+async def test_different_notes_embed_separately():
+    queue = EmbeddingQueue(debounce_seconds=0.01)
+    
+    with patch("app.services.embedding_queue.EmbeddingService.embed_note") as mock_embed:
+        queue.schedule(MagicMock(), "u1", "n1", "T", "a")
+        queue.schedule(MagicMock(), "u1", "n2", "T", "b")
+        await asyncio.sleep(0.05)
+        
+        assert mock_embed.call_count == 2
+
+@pytest.mark.asyncio
+async def test_max_delay_caps_debounce():
+    queue = EmbeddingQueue(debounce_seconds=0.05, max_delay_seconds=0.08)
+    
+    with patch("app.services.embedding_queue.EmbeddingService.embed_note") as mock_embed:
+        # Keep saving faster than the debounce for longer than max delay
+        for i in range(6):
+            queue.schedule(MagicMock(), "u1", "n1", "T", f"v{i}")
+            await asyncio.sleep(0.03)
+        
+        assert mock_embed.call_count >= 1
+
+@pytest.mark.asyncio
+async def test_flush_embeds_pending_now():
+    queue = EmbeddingQueue(debounce_seconds=60)
+    
+    with patch("app.services.embedding_queue.EmbeddingService.embed_note") as mock_embed:
+        queue.schedule(MagicMock(), "u1", "n1", "T", "a")
+        await queue.flush(timeout=1)
+        
+        mock_embed.assert_called_once()
+        assert queue.pending_count() == 0
+
+@pytest.mark.asyncio
+async def test_embed_errors_are_logged_not_raised():
+    queue = EmbeddingQueue(debounce_seconds=0)
+    
+    with patch("app.services.embedding_queue.EmbeddingService.embed_note", side_effect=Exception("boom")):
+        queue.schedule(MagicMock(), "u1", "n1", "T", "a")
+        await queue.flush(timeout=1)
+
+@pytest.mark.asyncio
+async def test_schedule_batch_embeds_together_and_supersedes_pending():
+    queue = EmbeddingQueue(debounce_seconds=10)
+    notes = [{"id": "n1", "title": "T", "content": "a"}, {"id": "n2", "title": "T", "content": "b"}]
+
+    with patch("app.services.embedding_queue.EmbeddingService.embed_note") as mock_embed, \
+         patch("app.services.embedding_queue.EmbeddingService.embed_notes", return_value={"failed_notes": 0}) as mock_embed_notes:
+        queue.schedule(MagicMock(), "u1", "n1", "T", "old")
+        queue.schedule_batch(MagicMock(), "u1", notes)
+        await queue.flush(timeout=1)
+
+        mock_embed_notes.assert_called_once()
+        assert mock_embed_notes.call_args.args[2] == notes
+        mock_embed.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_schedule_batch_waits_for_running_embed_of_same_note():
+    queue = EmbeddingQueue(debounce_seconds=0)
+    calls = []
+
+    async def slow_embed_note(**kwargs):
+        calls.append(("start", kwargs["content"]))
+        await asyncio.sleep(0.05)
+        calls.append(("end", kwargs["content"]))
+
+    async def embed_notes(supabase, user_id, notes):
+        calls.append(("batch", notes[0]["content"]))
+        return {"failed_notes": 0}
+
+    with patch("app.services.embedding_queue.EmbeddingService.embed_note", side_effect=slow_embed_note), \
+         patch("app.services.embedding_queue.EmbeddingService.embed_notes", side_effect=embed_notes):
+        queue.schedule(MagicMock(), "u1", "n1", "T", "old")
+        await asyncio.sleep(0.01)  # the single-note embed is now running
+        queue.schedule_batch(MagicMock(), "u1", [{"id": "n1", "title": "T", "content": "new"}])
+        await queue.flush(timeout=1)
+
+    # The newer batch version is written last
+    assert calls == [("start", "old"), ("end", "old"), ("batch", "new")]
+
+@pytest.mark.asyncio
+async def test_save_during_batch_is_written_after_it():
+    queue = EmbeddingQueue(debounce_seconds=0)
+    calls = []
+
+    async def slow_embed_notes(supabase, user_id, notes):
+        calls.append(("batch start", notes[0]["content"]))
+        await asyncio.sleep(0.05)
+        calls.append(("batch end", notes[0]["content"]))
+        return {"failed_notes": 0}
+
+    async def embed_note(**kwargs):
+        calls.append(("single", kwargs["content"]))
+
+    with patch("app.services.embedding_queue.EmbeddingService.embed_note", side_effect=embed_note), \
+         patch("app.services.embedding_queue.EmbeddingService.embed_notes", side_effect=slow_embed_notes):
+        queue.schedule_batch(MagicMock(), "u1", [{"id": "n1", "title": "T", "content": "batch"}])
+        await asyncio.sleep(0.01)
+        queue.schedule(MagicMock(), "u1", "n1", "T", "newer")
+        await queue.flush(timeout=1)
+
+    assert calls == [("batch start", "batch"), ("batch end", "batch"), ("single", "newer")]
+    assert queue._versions == {}
+
+@pytest.mark.asyncio
+async def test_embed_now_waits_for_running_embed_of_same_note():
+    queue = EmbeddingQueue(debounce_seconds=0)
+    calls = []
+
+    async def slow_embed_note(**kwargs):
+        calls.append(("start", kwargs["content"]))
+        await asyncio.sleep(0.05)
+        calls.append(("end", kwargs["content"]))
+        return [{"chunk": kwargs["content"]}]
+
+    with patch("app.services.embedding_queue.EmbeddingService.embed_note", side_effect=slow_embed_note):
+        queue.schedule(MagicMock(), "u1", "n1", "T", "queued")
+        await asyncio.sleep(0.01)  # the queued embed is now running
+        chunks = await queue.embed_now(MagicMock(), "u1", "n1", "T", "manual")
+        await queue.flush(timeout=1)
+
+    assert calls == [("start", "queued"), ("end", "queued"), ("start", "manual"), ("end", "manual")]
+    assert chunks == [{"chunk": "manual"}]
+    assert queue._versions == {}
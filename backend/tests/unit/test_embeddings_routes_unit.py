@@ -1,5 +1,5 @@
 import pytest
-from unittest.mock import MagicMock, patch
+from unittest.mock import MagicMock, AsyncMock, patch
 from fastapi import HTTPException
 from app.routes.embeddings import embed_note
 from app.schemas.embeddings import EmbeddingResponse
@@ -14,7 +14,7 @@ async def test_embed_note_success():
     mock_supabase = MagicMock()
     # Mock note fetch - success
     mock_db_note = {"id": note_id, "user_id": user_id, "title": "T", "content": "C"}
-    mock_supabase.table.return_value.select.return_value.eq.return_value.single.return_value.execute.return_value.data = mock_db_note
+    mock_supabase.table.return_value.select.return_value.eq.return_value.single.return_value.execute = AsyncMock(return_value=MagicMock(data=mock_db_note))
     
     # Patch EmbeddingService.embed_note
     with patch("app.services.embeddings.EmbeddingService.embed_note") as mock_service_embed:
@@ -42,7 +42,7 @@ async def test_embed_note_forbidden():
     mock_supabase = MagicMock()
     # Note owned by someone else
     mock_db_note = {"id": "n1", "user_id": "other", "title": "T", "content": "C"}
-    mock_supabase.table.return_value.select.return_value.eq.return_value.single.return_value.execute.return_value.data = mock_db_note
+    mock_supabase.table.return_value.select.return_value.eq.return_value.single.return_value.execute = AsyncMock(return_value=MagicMock(data=mock_db_note))
     
     with pytest.raises(HTTPException) as exc:
         await embed_note("n1", 1000, {"id": "me"}, mock_supabase) 
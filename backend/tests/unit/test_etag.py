@@ -0,0 +1,21 @@
+from app.core.etag import weak_etag, etag_matches, not_modified
+
+def test_weak_etag_is_stable_and_distinct():
+    assert weak_etag("n1", "2024-01-01") == weak_etag("n1", "2024-01-01")
+    assert weak_etag("n1", "2024-01-01") != weak_etag("n1", "2024-01-02")
+
+def test_etag_matches_weak_comparison():
+    etag = weak_etag("n1", 1)
+    opaque = etag.removeprefix("W/")
+    assert etag_matches(etag, etag)
+    assert etag_matches(opaque, etag)
+    assert etag_matches(f'W/"other", {etag}', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches(None, etag)
+    assert not etag_matches('W/"other"', etag)
+
+def test_not_modified_varies_on_accept():
+    response = not_modified(weak_etag("n1", 1))
+    assert response.status_code == 304
+    assert response.headers["vary"] == "Accept, Authorization"
+    assert response.headers["cache-control"].startswith("private")
@@ -0,0 +1,186 @@
+import asyncio
+import time
+import pytest
+from unittest.mock import MagicMock, AsyncMock, patch
+from app.schemas.embeddings import VectorSearchResult
+from app.services.library_qa import LibraryQAService, NO_RESULTS_ANSWER
+
+def chunk(note_id, similarity, chunk_index=0):
+    return VectorSearchResult(
+        chunk_id=f"{note_id}-{chunk_index}",
+        note_id=note_id,
+        content=f"chunk {chunk_index} of {note_id}",
+        similarity=similarity,
+        chunk_index=chunk_index,
+        total_chunks=3
+    )
+
+class FakeStream:
+    """Async iterable standing in for a streamed Gemini response."""
+    def __init__(self, texts):
+        self._texts = texts
+
+    async def __aiter__(self):
+        for text in self._texts:
+            yield MagicMock(text=text)
+
+def fake_model(extracts, delays=None, reduce_stream=None):
+    """Map calls answer from extracts by note id (found in the prompt); the reduce call streams."""
+    delays = delays or {}
+
+    async def generate(prompt, stream=False, request_options=None):
+        if stream:
+            return reduce_stream or FakeStream(["Combined", " answer"])
+        for note_id, text in extracts.items():
+            if f"of {note_id}" in prompt:
+                await asyncio.sleep(delays.get(note_id, 0))
+                return MagicMock(text=text)
+        return MagicMock(text="NONE")
+
+    model = MagicMock()
+    model.generate_content_async = AsyncMock(side_effect=generate)
+    return model
+
+def mock_titles_supabase(titles):
+    mock_supabase = MagicMock()
+    mock_supabase.table.return_value.select.return_value.in_.return_value.execute = AsyncMock(
+        return_value=MagicMock(data=[{"id": note_id, "title": title} for note_id, title in titles.items()])
+    )
+    return mock_supabase
+
+async def collect(events):
+    return [event async for event in events]
+
+def test_group_by_note_ranks_notes_and_keeps_document_order():
+    chunks = [chunk("a", 0.7, 2), chunk("b", 0.9, 0), chunk("a", 0.8, 0), chunk("c", 0.5)]
+
+    groups = LibraryQAService._group_by_note(chunks, max_notes=2)
+
+    assert [group["note_id"] for group in groups] == ["b", "a"]
+    assert [c.chunk_index for c in groups[1]["chunks"]] == [0, 2]
+    assert groups[1]["similarity"] == 0.8
+
+@pytest.mark.asyncio
+async def test_ask_streams_partials_then_combined_answer():
+    chunks = [chunk("a", 0.9), chunk("b", 0.8), chunk("c", 0.7)]
+    model = fake_model({"a": "- point from a", "b": "NONE", "c": "- point from c"})
+    mock_supabase = mock_titles_supabase({"a": "Alpha", "b": "Beta", "c": "Gamma"})
+
+    with patch("app.services.library_qa.EmbeddingService.vector_search", AsyncMock(return_value=chunks)), \
+         patch("app.services.library_qa.get_gemini_model", return_value=model):
+        events = await collect(LibraryQAService.ask(mock_supabase, "u1", "what about x?"))
+
+    names = [name for name, _ in events]
+    assert names[0] == "sources"
+    assert [note["title"] for note in events[0][1]["notes"]] == ["Alpha", "Beta", "Gamma"]
+    partials = {data["note_id"]: data["text"] for name, data in events if name == "partial"}
+    assert partials == {"a": "- point from a", "c": "- point from c"}
+    assert "".join(data["text"] for name, data in events if name == "chunk") == "Combined answer"
+    assert names[-1] == "done"
+    metadata = events[-1][1]["metadata"]
+    assert metadata["notesConsidered"] == 3
+    assert metadata["notesAnswered"] == 2
+    assert metadata["timedOut"] is False
+    # The reduce prompt carries only the useful extracts
+    reduce_prompt = model.generate_content_async.await_args_list[-1][0][0]
+    assert "Alpha" in reduce_prompt and "Gamma" in reduce_prompt and "Beta" not in reduce_prompt
+
+@pytest.mark.asyncio
+async def test_ask_drops_slow_notes_to_stay_within_budget():
+    chunks = [chunk("fast", 0.9), chunk("slow", 0.8)]
+    model = fake_model({"fast": "- quick point", "slow": "- late point"}, delays={"slow": 5})
+    mock_supabase = mock_titles_supabase({"fast": "Fast", "slow": "Slow"})
+
+    started = time.monotonic()
+    with patch("app.services.library_qa.EmbeddingService.vector_search", AsyncMock(return_value=chunks)), \
+         patch("app.services.library_qa.get_gemini_model", return_value=model):
+        events = await collect(LibraryQAService.ask(mock_supabase, "u1", "question", budget_seconds=0.4))
+
+    assert time.monotonic() - started < 1
+    partials = [data["note_id"] for name, data in events if name == "partial"]
+    assert partials == ["fast"]
+    metadata = events[-1][1]["metadata"]
+    assert metadata["timedOut"] is True
+    assert metadata["notesSkipped"] == 1
+    assert "".join(data["text"] for name, data in events if name == "chunk") == "Combined answer"
+
+@pytest.mark.asyncio
+async def test_ask_without_matches_answers_directly():
+    mock_supabase = MagicMock()
+
+    with patch("app.services.library_qa.EmbeddingService.vector_search", AsyncMock(return_value=[])), \
+         patch("app.services.library_qa.get_gemini_model") as mock_get_model:
+        events = await collect(LibraryQAService.ask(mock_supabase, "u1", "question"))
+
+    assert events[0] == ("sources", {"notes": []})
+    assert events[1] == ("chunk", {"text": NO_RESULTS_ANSWER})
+    assert events[2][0] == "done"
+    mock_get_model.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_closing_the_stream_cancels_running_extractions():
+    chunks = [chunk("fast", 0.9), chunk("slow", 0.8)]
+    model = fake_model({"fast": "- quick point", "slow": "- late point"}, delays={"slow": 5})
+    mock_supabase = mock_titles_supabase({"fast": "Fast", "slow": "Slow"})
+
+    with patch("app.services.library_qa.EmbeddingService.vector_search", AsyncMock(return_value=chunks)), \
+         patch("app.services.library_qa.get_gemini_model", return_value=model):
+        events = LibraryQAService.ask(mock_supabase, "u1", "question")
+        assert (await events.__anext__())[0] == "sources"
+        assert (await events.__anext__())[0] == "partial"
+        running = [task for task in asyncio.all_tasks() if task.get_coro().__qualname__ == "LibraryQAService._extract"]
+        # The client disconnects while "slow" is still being read
+        await events.aclose()
+        await asyncio.gather(*running, return_exceptions=True)
+
+    assert len(running) == 1
+    assert running[0].cancelled()
+
+class StalledStream:
+    """Streamed response that sends one chunk, then hangs on the next read."""
+    def __init__(self):
+        self.read_cancelled = False
+
+    async def __aiter__(self):
+        yield MagicMock(text="Partial")
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            # grpc.aio cancels the call when a pending read is cancelled
+            self.read_cancelled = True
+            raise
+
+@pytest.mark.asyncio
+async def test_answer_over_budget_is_cut_short_and_cancelled():
+    stream = StalledStream()
+    model = fake_model({"a": "- point"}, reduce_stream=stream)
+    mock_supabase = mock_titles_supabase({"a": "Alpha"})
+
+    with patch("app.services.library_qa.EmbeddingService.vector_search", AsyncMock(return_value=[chunk("a", 0.9)])), \
+         patch("app.services.library_qa.get_gemini_model", return_value=model):
+        events = await collect(LibraryQAService.ask(mock_supabase, "u1", "question", budget_seconds=0.2))
+        await asyncio.sleep(0)
+
+    assert ("chunk", {"text": "Partial"}) in events
+    assert events[-2] == ("error", {"detail": "Answer cut short by the time limit"})
+    assert events[-1][1]["metadata"]["timedOut"] is True
+    assert stream.read_cancelled
+
+class FailingStream:
+    """Streamed response that sends one chunk, then fails."""
+    async def __aiter__(self):
+        yield MagicMock(text="Partial")
+        raise RuntimeError("stream reset")
+
+@pytest.mark.asyncio
+async def test_answer_failure_is_reported_then_done():
+    model = fake_model({"a": "- point"}, reduce_stream=FailingStream())
+    mock_supabase = mock_titles_supabase({"a": "Alpha"})
+
+    with patch("app.services.library_qa.EmbeddingService.vector_search", AsyncMock(return_value=[chunk("a", 0.9)])), \
+         patch("app.services.library_qa.get_gemini_model", return_value=model):
+        events = await collect(LibraryQAService.ask(mock_supabase, "u1", "question"))
+
+    assert ("chunk", {"text": "Partial"}) in events
+    assert events[-2] == ("error", {"detail": "stream reset"})
+    assert events[-1][0] == "done"
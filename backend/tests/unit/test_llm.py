@@ -0,0 +1,107 @@
+import asyncio
+import pytest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import AsyncMock, MagicMock, patch
+from app.core import llm
+from app.core.llm import Bulkhead, BulkheadFullError
+
+@pytest.mark.asyncio
+async def test_bulkhead_queues_beyond_concurrency():
+    bulkhead = Bulkhead(max_concurrency=1, max_queue=1, queue_timeout=1)
+    release = asyncio.Event()
+    order = []
+
+    async def call(name):
+        async with bulkhead.slot():
+            order.append(name)
+            await release.wait()
+
+    first = asyncio.create_task(call("first"))
+    await asyncio.sleep(0)
+    second = asyncio.create_task(call("second"))
+    await asyncio.sleep(0)
+
+    assert bulkhead.stats()["active"] == 1
+    assert bulkhead.stats()["waiting"] == 1
+    release.set()
+    await asyncio.gather(first, second)
+    assert order == ["first", "second"]
+    assert bulkhead.stats()["completed"] == 2
+    assert bulkhead.stats()["waiting"] == 0
+
+@pytest.mark.asyncio
+async def test_bulkhead_sheds_when_queue_is_full():
+    bulkhead = Bulkhead(max_concurrency=1, max_queue=0, queue_timeout=1)
+    release = asyncio.Event()
+
+    async def hold():
+        async with bulkhead.slot():
+            await release.wait()
+
+    holder = asyncio.create_task(hold())
+    await asyncio.sleep(0)
+
+    assert bulkhead.is_full()
+    with pytest.raises(BulkheadFullError):
+        async with bulkhead.slot():
+            pass
+    assert bulkhead.stats()["rejected"] == 1
+    release.set()
+    await holder
+
+@pytest.mark.asyncio
+async def test_bulkhead_wait_times_out():
+    bulkhead = Bulkhead(max_concurrency=1, max_queue=5, queue_timeout=0.01)
+    release = asyncio.Event()
+
+    async def hold():
+        async with bulkhead.slot():
+            await release.wait()
+
+    holder = asyncio.create_task(hold())
+    await asyncio.sleep(0)
+
+    with pytest.raises(BulkheadFullError):
+        async with bulkhead.slot():
+            pass
+    assert bulkhead.stats()["timed_out"] == 1
+    assert bulkhead.stats()["waiting"] == 0
+    release.set()
+    await holder
+    # The slot is free again once the holder finishes
+    async with bulkhead.slot():
+        assert bulkhead.stats()["active"] == 1
+
+@pytest.fixture
+def cached_models():
+    llm._cached_models.clear()
+    yield llm._cached_models
+    llm._cached_models.clear()
+
+def cached_content(name="cachedContents/c1"):
+    cached = MagicMock(model="models/gemini-2.5-flash", expire_time=datetime.now(timezone.utc) + timedelta(hours=1))
+    # MagicMock(name=...) names the mock itself
+    cached.name = name
+    return cached
+
+@pytest.mark.asyncio
+async def test_get_cached_model_looks_up_once_with_the_public_api(cached_models):
+    with patch("app.core.llm.caching.CachedContent.get", return_value=cached_content()) as mock_get:
+        first = await llm.get_cached_model("cachedContents/c1")
+        second = await llm.get_cached_model("cachedContents/c1")
+
+    mock_get.assert_called_once_with("cachedContents/c1")
+    assert first is second
+    assert first.cached_content == "cachedContents/c1"
+
+@pytest.mark.asyncio
+async def test_close_gemini_client_closes_only_its_own_transport(cached_models):
+    model = MagicMock()
+    model._async_client.transport.close = AsyncMock()
+
+    with patch("app.core.llm._model", model), \
+         patch("app.core.llm.genai_client._client_manager") as mock_manager:
+        await llm.close_gemini_client()
+
+    model._async_client.transport.close.assert_awaited_once()
+    assert mock_manager.mock_calls == []
@@ -0,0 +1,95 @@
+import pytest
+from unittest.mock import MagicMock, AsyncMock, patch
+from app.schemas.notes import NoteBatchOperation
+from app.services.notes import NoteService, derive_title
+
+N1 = "00000000-0000-4000-8000-000000000001"
+N2 = "00000000-0000-4000-8000-000000000002"
+N3 = "00000000-0000-4000-8000-000000000003"
+MISSING = "00000000-0000-4000-8000-0000000000ff"
+
+def note_row(idx, op, note_id, title="T", content="C"):
+    return {
+        "idx": idx,
+        "op": op,
+        "id": note_id,
+        "user_id": "u1",
+        "title": title,
+        "content": content,
+        "created_at": "2024-01-01T00:00:00Z",
+        "updated_at": "2024-01-01T00:00:00Z",
+        "basic_stats": {}
+    }
+
+def test_derive_title():
+    assert derive_title("Given", "body") == "Given"
+    assert derive_title(None, "\n  First line\nsecond") == "First line"
+    assert derive_title("", "   ") == "Untitled Note"
+
+def test_fold_merges_repeated_edits_of_a_note():
+    operations = [
+        NoteBatchOperation(op="update", note_id=N1, title="A"),
+        NoteBatchOperation(op="update", note_id=N1, content="B"),
+        NoteBatchOperation(op="update", note_id=N2, title="X"),
+        NoteBatchOperation(op="delete", note_id=N2),
+        NoteBatchOperation(op="update", note_id=N2, title="Y"),
+        NoteBatchOperation(op="update", note_id=N3),
+        NoteBatchOperation(op="create", content="hello\nworld"),
+    ]
+
+    payload, members, results = NoteService._fold_operations(operations)
+
+    assert payload == [
+        {"idx": 0, "op": "update", "note_id": N1, "title": "A", "content": "B"},
+        {"idx": 2, "op": "delete", "note_id": N2},
+        {"idx": 6, "op": "create", "title": "hello", "content": "hello\nworld", "basic_stats": {}},
+    ]
+    assert members == {0: [0, 1], 2: [2, 3], 6: [6]}
+    assert results[4].status == 404
+    assert results[5].status == 400
+
+@pytest.mark.asyncio
+async def test_apply_batch_one_statement_and_per_operation_results():
+    mock_supabase = MagicMock()
+    mock_supabase.rpc.return_value.execute = AsyncMock(return_value=MagicMock(data=[
+        note_row(0, "create", "new-1", title="First", content="First"),
+        note_row(1, "update", N1, content="edited"),
+        {**note_row(2, "delete", N2), "title": None, "content": None, "created_at": None, "updated_at": None},
+    ]))
+    operations = [
+        NoteBatchOperation(op="create", content="First"),
+        NoteBatchOperation(op="update", note_id=N1, content="edited"),
+        NoteBatchOperation(op="delete", note_id=N2),
+        NoteBatchOperation(op="delete", note_id=MISSING),
+        NoteBatchOperation(op="delete"),
+        NoteBatchOperation(op="update", note_id="not-a-uuid", title="X"),
+    ]
+
+    with patch("app.services.notes.embedding_queue") as mock_queue:
+        response = await NoteService.apply_batch(mock_supabase, "u1", operations)
+
+    mock_supabase.rpc.assert_called_once()
+    assert mock_supabase.rpc.call_args[0][0] == "apply_note_batch"
+    assert [r.status for r in response.results] == [201, 200, 204, 404, 400, 400]
+    assert response.results[5].error == "note_id must be a UUID"
+    assert response.results[0].note.id == "new-1"
+    assert response.results[2].note is None
+    assert (response.succeeded, response.failed) == (3, 3)
+    # Malformed ids never reach the database
+    sent = mock_supabase.rpc.call_args[0][1]["p_operations"]
+    assert all(op.get("note_id") != "not-a-uuid" for op in sent)
+
+    # Created and edited notes are embedded together
+    embedded = mock_queue.schedule_batch.call_args.args[2]
+    assert [n["id"] for n in embedded] == ["new-1", N1]
+
+def test_fold_canonicalizes_note_ids():
+    operations = [
+        NoteBatchOperation(op="update", note_id=N1.upper(), title="A"),
+        NoteBatchOperation(op="update", note_id=N1, content="B"),
+    ]
+
+    payload, members, results = NoteService._fold_operations(operations)
+
+    assert payload == [{"idx": 0, "op": "update", "note_id": N1, "title": "A", "content": "B"}]
+    assert results == {}
@@ -1,33 +1,159 @@
 import pytest
-from unittest.mock import MagicMock, patch
+from unittest.mock import MagicMock, AsyncMock, patch
 from app.services.embeddings import EmbeddingService
+from app.core.embeddings import chunk_content_hash, EmbeddingBatchError
 
-def test_embed_note_success():
+def add_embeddings(chunks):
+    for chunk in chunks:
+        chunk["embedding"] = [0.1]
+    return chunks
+
+@pytest.mark.asyncio
+async def test_embed_note_success():
     mock_supabase = MagicMock()
     mock_note = {"id": "n1", "title": "T", "content": "C", "user_id": "u1"}
-    
+
     with patch("app.services.embeddings.prepare_note_for_embedding") as mock_prep:
-        mock_prep.return_value = [{"chunk": 1}]
-        
-        with patch("app.services.embeddings.embed_chunks") as mock_embed:
-            mock_embed.return_value = [{
-                "chunk_index": 0, 
-                "total_chunks": 1, 
-                "content": "C", 
-                "embedding": [0.1]
-            }]
-            
-            mock_supabase.table.return_value.delete.return_value.eq.return_value.execute.return_value = None
-            mock_supabase.table.return_value.insert.return_value.execute.return_value = None
-            
+        mock_prep.return_value = [{
+            "chunk_index": 0,
+            "total_chunks": 1,
+            "content": "C"
+        }]
+
+        with patch("app.services.embeddings.embed_chunks", side_effect=add_embeddings) as mock_embed:
+            mock_supabase.table.return_value.select.return_value.eq.return_value.execute = AsyncMock(return_value=MagicMock(data=[]))
+            mock_supabase.rpc.return_value.execute = AsyncMock(return_value=None)
+
             # Use EmbeddingService.embed_note
-            EmbeddingService.embed_note(
+            await EmbeddingService.embed_note(
                 supabase=mock_supabase,
                 user_id="u1",
                 note_id="n1",
                 title="T",
                 content="C"
             )
-            
+
             mock_prep.assert_called_once()
             mock_embed.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_embed_note_writes_only_changed_chunks():
+    mock_supabase = MagicMock()
+
+    # Stored: index 0 "same" (unchanged), index 1 "moved" (now at index 2)
+    mock_supabase.table.return_value.select.return_value.eq.return_value.execute = AsyncMock(return_value=MagicMock(data=[
+        {"chunk_index": 0, "total_chunks": 3, "content_hash": chunk_content_hash("same")},
+        {"chunk_index": 1, "total_chunks": 3, "content_hash": chunk_content_hash("moved")},
+        {"chunk_index": 2, "total_chunks": 3, "content_hash": chunk_content_hash("old")},
+    ]))
+    mock_supabase.table.return_value.select.return_value.eq.return_value.in_.return_value.execute = AsyncMock(return_value=MagicMock(data=[
+        {"content_hash": chunk_content_hash("moved"), "embedding": "[0.5]"}
+    ]))
+    mock_supabase.rpc.return_value.execute = AsyncMock(return_value=None)
+
+    with patch("app.services.embeddings.prepare_note_for_embedding") as mock_prep:
+        mock_prep.return_value = [
+            {"chunk_index": 0, "total_chunks": 3, "content": "same"},
+            {"chunk_index": 1, "total_chunks": 3, "content": "edited"},
+            {"chunk_index": 2, "total_chunks": 3, "content": "moved"},
+        ]
+
+        with patch("app.services.embeddings.embed_chunks", side_effect=add_embeddings) as mock_embed:
+            await EmbeddingService.embed_note(
+                supabase=mock_supabase,
+                user_id="u1",
+                note_id="n1",
+                title="T",
+                content="C"
+            )
+
+            # Only the edited chunk goes to OpenAI
+            embedded = mock_embed.call_args[0][0]
+            assert [c["content"] for c in embedded] == ["edited"]
+
+            # Unchanged row 0 is not rewritten; moved chunk reuses its vector
+            name, params = mock_supabase.rpc.call_args[0]
+            assert name == "sync_note_chunks"
+            records = {r["chunk_index"]: r for r in params["p_chunks"]}
+            assert set(records) == {1, 2}
+            assert records[1]["embedding"] == [0.1]
+            assert records[2]["embedding"] == "[0.5]"
+            assert params["p_total_chunks"] == 3
+
+@pytest.mark.asyncio
+async def test_embed_note_unchanged_note_writes_nothing():
+    mock_supabase = MagicMock()
+    mock_supabase.table.return_value.select.return_value.eq.return_value.execute = AsyncMock(return_value=MagicMock(data=[
+        {"chunk_index": 0, "total_chunks": 1, "content_hash": chunk_content_hash("same")},
+    ]))
+
+    with patch("app.services.embeddings.prepare_note_for_embedding") as mock_prep:
+        mock_prep.return_value = [{"chunk_index": 0, "total_chunks": 1, "content": "same"}]
+
+        with patch("app.services.embeddings.embed_chunks") as mock_embed:
+            await EmbeddingService.embed_note(
+                supabase=mock_supabase,
+                user_id="u1",
+                note_id="n1",
+                title="T",
+                content="C"
+            )
+
+            mock_embed.assert_not_called()
+            mock_supabase.rpc.assert_not_called()
+
+def mock_bulk_supabase(notes, stored_chunks=None):
+    mock_supabase = MagicMock()
+    ordered = mock_supabase.table.return_value.select.return_value.eq.return_value.order.return_value
+    # notes: .order("id").range(); chunks: .order("note_id").order("chunk_index").range()
+    ordered.range.return_value.execute = AsyncMock(return_value=MagicMock(data=notes))
+    ordered.order.return_value.range.return_value.execute = AsyncMock(return_value=MagicMock(data=stored_chunks or []))
+    mock_supabase.rpc.return_value.execute = AsyncMock(return_value=None)
+    return mock_supabase
+
+@pytest.mark.asyncio
+async def test_embed_all_notes_batches_chunks_across_notes():
+    notes = [
+        {"id": "n1", "title": "A", "content": "alpha"},
+        {"id": "n2", "title": "B", "content": "beta"},
+        {"id": "n3", "title": "C", "content": "gamma"},
+        {"id": "n4", "title": "A", "content": "alpha"},  # same text as n1
+    ]
+    mock_supabase = mock_bulk_supabase(notes)
+
+    async def fake_batch(texts):
+        return [[float(len(t))] for t in texts]
+
+    with patch("app.services.embeddings.create_embeddings_batch", side_effect=fake_batch) as mock_batch:
+        result = await EmbeddingService.embed_all_notes(mock_supabase, "u1")
+
+    # One batched call for 3 distinct texts across 4 notes
+    mock_batch.assert_called_once()
+    assert len(mock_batch.call_args.args[0]) == 3
+    assert result["total_notes"] == 4
+    assert result["total_chunks"] == 4
+    assert result["failed_notes"] == 0
+
+    # Vectors land on the right notes
+    writes = {call.args[1]["p_note_id"]: call.args[1] for call in mock_supabase.rpc.call_args_list}
+    assert writes["n2"]["p_chunks"][0]["embedding"] == [float(len("B\n\nbeta"))]
+    assert writes["n1"]["p_chunks"][0]["embedding"] == writes["n4"]["p_chunks"][0]["embedding"]
+
+@pytest.mark.asyncio
+async def test_embed_all_notes_reports_failed_inputs_per_note():
+    notes = [
+        {"id": "n1", "title": "A", "content": "alpha"},
+        {"id": "n2", "title": "B", "content": "beta"},
+    ]
+    mock_supabase = mock_bulk_supabase(notes)
+
+    async def partial_batch(texts):
+        failures = {i: "rate limited" for i, t in enumerate(texts) if "beta" in t}
+        raise EmbeddingBatchError(failures, [None if i in failures else [0.1] for i in range(len(texts))])
+
+    with patch("app.services.embeddings.create_embeddings_batch", side_effect=partial_batch):
+        result = await EmbeddingService.embed_all_notes(mock_supabase, "u1")
+
+    assert result["failed_notes"] == 1
+    assert result["errors"] == [{"note_id": "n2", "error": "rate limited"}]
+    assert result["total_chunks"] == 1
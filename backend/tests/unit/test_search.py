@@ -0,0 +1,65 @@
+import pytest
+from unittest.mock import MagicMock, AsyncMock, patch
+from app.services.search import SearchService, RRF_K
+from app.schemas.embeddings import VectorSearchResult
+
+def keyword_hit(note_id, title):
+    return {"id": note_id, "title": title, "snippet": f"<b>{title}</b>", "rank": 0.1}
+
+def chunk(note_id, similarity, chunk_index=0):
+    return VectorSearchResult(
+        chunk_id=f"{note_id}-{chunk_index}",
+        note_id=note_id,
+        content=f"chunk {chunk_index} of {note_id}",
+        similarity=similarity,
+        chunk_index=chunk_index,
+        total_chunks=2
+    )
+
+def mock_search_supabase(keyword_hits, titles=None):
+    mock_supabase = MagicMock()
+    mock_supabase.rpc.return_value.execute = AsyncMock(return_value=MagicMock(data=keyword_hits))
+    mock_supabase.table.return_value.select.return_value.in_.return_value.execute = AsyncMock(return_value=MagicMock(data=titles or []))
+    return mock_supabase
+
+@pytest.mark.asyncio
+async def test_hybrid_search_fuses_rankings():
+    mock_supabase = mock_search_supabase(
+        [keyword_hit("a", "Alpha"), keyword_hit("b", "Beta")],
+        titles=[{"id": "c", "title": "Gamma"}]
+    )
+    chunks = [chunk("b", 0.9, 1), chunk("c", 0.8), chunk("b", 0.7, 0)]
+
+    with patch("app.services.search.embed_query", AsyncMock(return_value=[0.1])) as mock_embed, \
+         patch("app.services.search.EmbeddingService.search_by_embedding", AsyncMock(return_value=chunks)):
+        results = await SearchService.hybrid_search(mock_supabase, "u1", "query", limit=10)
+
+    mock_embed.assert_awaited_once_with("query")
+    # b is in both lists, so it outranks a (keyword #1) and c (vector #2)
+    assert [r.note_id for r in results] == ["b", "a", "c"]
+    assert results[0].score == pytest.approx(1 / (RRF_K + 2) + 1 / (RRF_K + 1))
+    # Best chunk is the snippet; keyword-only notes keep their headline
+    assert results[0].snippet == "chunk 1 of b"
+    assert results[0].chunk_index == 1
+    assert results[1].snippet == "<b>Alpha</b>"
+    assert results[1].vector_rank is None
+    # Vector-only note gets its title looked up
+    assert results[2].title == "Gamma"
+
+@pytest.mark.asyncio
+async def test_hybrid_search_falls_back_when_one_side_fails():
+    mock_supabase = mock_search_supabase([keyword_hit("a", "Alpha")])
+
+    with patch("app.services.search.embed_query", AsyncMock(side_effect=ValueError("no key"))):
+        results = await SearchService.hybrid_search(mock_supabase, "u1", "query", limit=5)
+
+    assert [r.note_id for r in results] == ["a"]
+
+@pytest.mark.asyncio
+async def test_hybrid_search_raises_when_both_fail():
+    mock_supabase = MagicMock()
+    mock_supabase.rpc.return_value.execute = AsyncMock(side_effect=RuntimeError("db down"))
+
+    with patch("app.services.search.embed_query", AsyncMock(side_effect=ValueError("no key"))):
+        with pytest.raises(RuntimeError):
+            await SearchService.hybrid_search(mock_supabase, "u1", "query")
@@ -0,0 +1,147 @@
+import asyncio
+import threading
+import pytest
+from unittest.mock import MagicMock, AsyncMock, patch
+
+np = pytest.importorskip("numpy")
+
+from app.core import vector_index as vi
+from app.core.vector_index import UserVectorIndex, VectorIndexManager
+
+def row(chunk_id, note_id, embedding, chunk_index=0):
+    return {
+        "id": chunk_id,
+        "note_id": note_id,
+        "content": f"content {chunk_id}",
+        "chunk_index": chunk_index,
+        "total_chunks": 1,
+        "embedding": embedding,
+    }
+
+def test_search_ranks_by_cosine_similarity():
+    index = UserVectorIndex(dimension=3)
+    index.add_rows([
+        row("c1", "n1", [1, 0, 0]),
+        row("c2", "n2", "[0, 1, 0]"),  # pgvector text form
+        row("c3", "n3", [0.7, 0.7, 0]),
+    ])
+
+    results = index.search([1, 0.1, 0], limit=2)
+
+    assert [r["id"] for r in results] == ["c1", "c3"]
+    assert results[0]["similarity"] == pytest.approx(0.995, abs=1e-3)
+    assert "embedding" not in results[0]
+
+def test_replace_and_remove_note():
+    index = UserVectorIndex(dimension=2)
+    index.add_rows([row("c1", "n1", [1, 0]), row("c2", "n2", [0, 1])])
+
+    index.replace_note("n1", [row("c3", "n1", [0, 1])])
+    assert {r["id"] for r in index.search([0, 1], limit=5)} == {"c2", "c3"}
+
+    index.remove_note("n2")
+    assert [r["id"] for r in index.search([0, 1], limit=5)] == ["c3"]
+    assert index.size == 1
+
+def test_hnsw_used_above_threshold():
+    pytest.importorskip("hnswlib")
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(50, 8))
+
+    with patch.object(vi, "VECTOR_INDEX_HNSW_THRESHOLD", 20):
+        index = UserVectorIndex(dimension=8)
+        index.add_rows([row(f"c{i}", f"n{i}", v.tolist()) for i, v in enumerate(vectors)])
+        index.remove_note("n7")
+
+    assert index._hnsw is not None
+    results = index.search(vectors[3].tolist(), limit=3)
+    assert results[0]["id"] == "c3"
+    assert results[0]["similarity"] == pytest.approx(1.0, abs=1e-4)
+    assert "c7" not in [r["id"] for r in index.search(vectors[7].tolist(), limit=5)]
+
+def test_snapshot_round_trip(tmp_path):
+    index = UserVectorIndex(dimension=2, watermark="2:ts")
+    index.add_rows([row("c1", "n1", [1, 0]), row("c2", "n2", [0, 1])])
+    path = str(tmp_path / "u1.npz")
+
+    index.save(path)
+    loaded = UserVectorIndex.load(path)
+
+    assert loaded.watermark == "2:ts"
+    assert [r["id"] for r in loaded.search([0, 1], limit=1)] == ["c2"]
+
+def mock_chunks_supabase(rows):
+    mock_supabase = MagicMock()
+    table = mock_supabase.table.return_value.select.return_value.eq.return_value
+    # watermark: .order("updated_at").limit(1)
+    table.order.return_value.limit.return_value.execute = AsyncMock(return_value=MagicMock(data=[{"updated_at": "ts"}], count=len(rows)))
+    # load: .not_.is_("embedding", "null").order("id").range()
+    table.not_.is_.return_value.order.return_value.range.return_value.execute = AsyncMock(return_value=MagicMock(data=rows))
+    return mock_supabase
+
+@pytest.mark.asyncio
+async def test_manager_loads_lazily_then_serves_from_memory():
+    manager = VectorIndexManager(enabled=True, snapshot_dir=None)
+    mock_supabase = mock_chunks_supabase([row("c1", "n1", [1, 0])])
+
+    # First search misses and starts a background load
+    assert await manager.search(mock_supabase, "u1", [1, 0], 5) is None
+    await asyncio.gather(*manager._loading.values())
+
+    results = await manager.search(mock_supabase, "u1", [1, 0], 5)
+    assert [r["id"] for r in results] == ["c1"]
+    assert manager.stats()["hits"] == 1
+    assert manager.stats()["misses"] == 1
+
+    await manager.note_deleted("u1", "n1")
+    assert await manager.search(mock_supabase, "u1", [1, 0], 5) == []
+
+@pytest.mark.asyncio
+async def test_manager_evicts_least_recently_used(tmp_path):
+    manager = VectorIndexManager(enabled=True, max_bytes=1, snapshot_dir=str(tmp_path))
+    for user_id in ("u1", "u2"):
+        index = UserVectorIndex(dimension=2)
+        index.add_rows([row("c1", "n1", [1, 0])])
+        manager._indexes[user_id] = index
+
+    await manager._evict()
+
+    assert list(manager._indexes) == ["u2"]
+    assert (tmp_path / "u1.npz").exists()
+
+@pytest.mark.asyncio
+async def test_manager_updates_index_off_the_event_loop(tmp_path):
+    manager = VectorIndexManager(enabled=True, max_bytes=1, snapshot_dir=str(tmp_path))
+    for user_id in ("u1", "u2"):
+        index = UserVectorIndex(dimension=2)
+        index.add_rows([row("c1", "n1", [1, 0])])
+        manager._indexes[user_id] = index
+    mock_supabase = MagicMock()
+    mock_supabase.table.return_value.select.return_value.eq.return_value.execute = AsyncMock(
+        return_value=MagicMock(data=[row("c2", "n1", [0, 1])])
+    )
+    threads = []
+    replace_note = UserVectorIndex.replace_note
+    save = UserVectorIndex.save
+
+    def record(method):
+        def wrapper(*args):
+            threads.append(threading.current_thread())
+            return method(*args)
+        return wrapper
+
+    with patch.object(UserVectorIndex, "replace_note", record(replace_note)), \
+         patch.object(UserVectorIndex, "save", record(save)):
+        await manager.note_changed(mock_supabase, "u2", "n1")
+
+    # Both the update and the snapshot written by eviction ran in worker threads
+    assert len(threads) == 2
+    assert threading.main_thread() not in threads
+    assert [r["id"] for r in manager._indexes["u2"].search([0, 1], limit=1)] == ["c2"]
+    assert (tmp_path / "u1.npz").exists()
+
+@pytest.mark.asyncio
+async def test_manager_disabled_always_defers_to_database():
+    manager = VectorIndexManager(enabled=False)
+    assert await manager.search(MagicMock(), "u1", [1, 0], 5) is None
+    assert manager._loading == {}